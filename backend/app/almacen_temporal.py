@@ -0,0 +1,163 @@
+# app/almacen_temporal.py
+"""
+Almacén clave → valor con expiración, compartido entre workers.
+
+- Con REDIS_URL: cada entrada es una clave Redis con TTL nativo (JSON) y
+  los índices secundarios son SETs; cualquier worker ve lo mismo.
+- Sin Redis: el mismo contrato en memoria (válido para un solo proceso);
+  las entradas vencidas se descartan al leerlas y en purgar(), que
+  recorre solo las vencidas (heap por instante de expiración).
+- Lecturas y escrituras O(1); índice secundario (p. ej. por usuario_id)
+  para no recorrer todo el almacén.
+"""
+import heapq
+import json
+import time
+from typing import Optional
+
+from app.core.config import config
+
+
+class _AlmacenMemoria:
+    def __init__(self):
+        self._datos: dict = {}      # { clave: (expira_en, valor) }
+        self._indices: dict = {}    # { indice: { clave } }
+        self._indices_de: dict = {}  # { clave: { indice } } (para soltarla)
+        self._vencimientos: list = []  # heap [(expira_en, clave)]
+
+    def _soltar(self, clave: str):
+        self._datos.pop(clave, None)
+        for indice in self._indices_de.pop(clave, ()):
+            claves = self._indices.get(indice)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._indices[indice]
+
+    def _vivo(self, clave: str):
+        entrada = self._datos.get(clave)
+        if entrada and entrada[0] <= time.time():
+            self._soltar(clave)
+            return None
+        return entrada
+
+    async def obtener(self, clave: str) -> Optional[dict]:
+        entrada = self._vivo(clave)
+        return entrada[1] if entrada else None
+
+    async def guardar(self, clave: str, valor: dict, ttl: int):
+        expira = time.time() + ttl
+        self._datos[clave] = (expira, valor)
+        heapq.heappush(self._vencimientos, (expira, clave))
+
+    async def actualizar(self, clave: str, valor: dict) -> bool:
+        entrada = self._vivo(clave)
+        if not entrada:
+            return False
+        self._datos[clave] = (entrada[0], valor)
+        return True
+
+    async def borrar(self, *claves: str):
+        for clave in claves:
+            self._soltar(clave)
+
+    async def indexar(self, indice: str, clave: str, ttl: int):
+        self._indices.setdefault(indice, set()).add(clave)
+        self._indices_de.setdefault(clave, set()).add(indice)
+
+    async def claves_de(self, indice: str) -> list:
+        return [c for c in list(self._indices.get(indice, ())) if self._vivo(c)]
+
+    async def borrar_indice(self, indice: str):
+        for clave in self._indices.pop(indice, ()):
+            self._indices_de.get(clave, set()).discard(indice)
+
+    async def purgar(self) -> int:
+        ahora = time.time()
+        borradas = 0
+        while self._vencimientos and self._vencimientos[0][0] <= ahora:
+            expira, clave = heapq.heappop(self._vencimientos)
+            entrada = self._datos.get(clave)
+            # Solo si no se volvió a guardar con otra expiración
+            if entrada and entrada[0] == expira:
+                self._soltar(clave)
+                borradas += 1
+        return borradas
+
+
+class _AlmacenRedis:
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+        self._redis = aioredis.from_url(url, decode_responses=True)
+
+    async def obtener(self, clave: str) -> Optional[dict]:
+        crudo = await self._redis.get(clave)
+        return json.loads(crudo) if crudo else None
+
+    async def guardar(self, clave: str, valor: dict, ttl: int):
+        await self._redis.set(clave, json.dumps(valor), ex=ttl)
+
+    async def actualizar(self, clave: str, valor: dict) -> bool:
+        # xx: solo si sigue existiendo; keepttl: conserva su vencimiento
+        return bool(await self._redis.set(clave, json.dumps(valor), xx=True, keepttl=True))
+
+    async def borrar(self, *claves: str):
+        if claves:
+            await self._redis.delete(*claves)
+
+    async def indexar(self, indice: str, clave: str, ttl: int):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.sadd(indice, clave)
+        pipe.expire(indice, ttl)
+        await pipe.execute()
+
+    async def claves_de(self, indice: str) -> list:
+        return list(await self._redis.smembers(indice))
+
+    async def borrar_indice(self, indice: str):
+        await self._redis.delete(indice)
+
+    async def purgar(self) -> int:
+        return 0  # Redis expira solo
+
+
+class AlmacenExpirable:
+    """Un espacio de nombres (prefijo) con TTL por defecto."""
+
+    def __init__(self, prefijo: str, ttl: int):
+        self.prefijo = prefijo
+        self.ttl = ttl
+        self._almacen = _AlmacenRedis(config.REDIS_URL) if config.REDIS_URL else _AlmacenMemoria()
+
+    def _clave(self, clave: str) -> str:
+        return f"{self.prefijo}{clave}"
+
+    def _indice(self, indice: str) -> str:
+        return f"{self.prefijo}idx:{indice}"
+
+    async def obtener(self, clave: str) -> Optional[dict]:
+        return await self._almacen.obtener(self._clave(clave))
+
+    async def guardar(self, clave: str, valor: dict, ttl: Optional[int] = None):
+        await self._almacen.guardar(self._clave(clave), valor, ttl or self.ttl)
+
+    async def actualizar(self, clave: str, valor: dict) -> bool:
+        """Reemplaza el valor conservando el vencimiento. False si ya expiró."""
+        return await self._almacen.actualizar(self._clave(clave), valor)
+
+    async def borrar(self, *claves: str):
+        await self._almacen.borrar(*(self._clave(c) for c in claves))
+
+    async def indexar(self, indice: str, clave: str):
+        await self._almacen.indexar(self._indice(indice), self._clave(clave), self.ttl)
+
+    async def claves_de(self, indice: str) -> list:
+        n = len(self.prefijo)
+        return [c[n:] for c in await self._almacen.claves_de(self._indice(indice))]
+
+    async def borrar_indice(self, indice: str):
+        await self._almacen.borrar_indice(self._indice(indice))
+
+    async def purgar(self) -> int:
+        """Descarta lo vencido (en Redis no hace falta)."""
+        return await self._almacen.purgar()
@@ -9,6 +9,8 @@ from typing import List
 from app.db.sesion import obtener_sesion
 from app.api.usuarios import validar_sesion_header as validar_sesion
 from app.db.modelos import Contacto, Usuario
+from app.db.nombres import invalidar_alias
+from app.db.interes import invalidar_interes
 from app.schemas.contacto import (
     ContactoLeer,
     ContactoCrearTelefono,
@@ -50,6 +52,8 @@ async def agregar_contacto(
     nuevo = Contacto(usuario_id=usuario_id, contacto_id=destino.id, alias=alias)
     sesion.add(nuevo)
     await sesion.commit()
+    await invalidar_alias(usuario_id)
+    await invalidar_interes([destino.id])
     await sesion.refresh(nuevo, ["contacto_agregado"])
 
     perfil = nuevo.contacto_agregado
@@ -117,6 +121,7 @@ async def actualizar_alias(
 
     contacto.alias = datos.alias
     await sesion.commit()
+    await invalidar_alias(usuario_id)
     await sesion.refresh(contacto)
 
     perfil = contacto.contacto_agregado
@@ -146,9 +151,12 @@ async def eliminar_contacto(
         delete(Contacto).where(
             Contacto.id == contacto_id,
             Contacto.usuario_id == usuario_id
-        )
+        ).returning(Contacto.contacto_id)
     )
-    if result.rowcount == 0:
+    destino_id = result.scalar_one_or_none()
+    if destino_id is None:
         raise HTTPException(404, detail="Contacto no encontrado")
     await sesion.commit()
+    await invalidar_alias(usuario_id)
+    await invalidar_interes([destino_id])
     return None
\ No newline at end of file
@@ -2,10 +2,11 @@
 from uuid import UUID
 from typing import List, Optional
 import uuid
+import base64
 from sqlalchemy import update
 from fastapi import Response
 
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from fastapi import Query
 
 from fastapi import (
@@ -18,7 +19,9 @@ from fastapi import (
     Request,
 )
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, delete  # 👈 asegúrate de tener delete importado
+from sqlalchemy import select, func, delete, tuple_  # 👈 asegúrate de tener delete importado
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 import jwt
 
@@ -36,14 +39,20 @@ from app.db.modelos import (
     ParticipanteLlamada,  # 👈 para borrar participantes de llamadas
     ReaccionMensaje,
     ConversacionOculta,
+    ResumenConversacion,
 )
 from app.db import crud
+from app.db.nombres import ResolutorNombres
+from app.db.interes import invalidar_interes, invalidar_interes_conversacion
+from app.presencia import presencia
 from app.schemas.conversacion import ConversacionCrear, ConversacionLeer, ConversacionDetalle
 from app.schemas.mensaje import MensajeCrear, MensajeLeer, MensajeEditar
 from app.core.config import config
+from app.core.autenticacion import UsuarioVerificado, verificar_token
 from app.realtime import sio, CONV_ROOM, USER_ROOM
+from app.outbox import encolar, encolar_estados_actualizados
 from fastapi import UploadFile, File, Form
-from app.api.files import upload_file
+from app.api.files import upload_file, adjunto_por_hash, progreso_por_socket, usuario_de_cookie
 from app.realtime import sio
 # from app.api.sockets import manager
 
@@ -67,26 +76,9 @@ async def obtener_nombre_visible(
     """
     Devuelve alias si existe,
     sino teléfono (NUNCA nombre real de la BD).
+    Para varios usuarios usar ResolutorNombres directamente (1 query).
     """
-
-    # Buscar alias en CONTACTOS
-    q = await sesion.execute(
-        select(Contacto.alias).where(
-            Contacto.usuario_id == usuario_actual_id,
-            Contacto.contacto_id == str(usuario_objetivo.id)
-        )
-    )
-    alias = q.scalar_one_or_none()
-
-    if alias:
-        return alias
-
-    # Si no hay alias → usar teléfono
-    if usuario_objetivo.telefono:
-        return usuario_objetivo.telefono
-
-    # Último fallback
-    return usuario_objetivo.telefono or "Usuario"
+    return await ResolutorNombres(sesion, usuario_actual_id).nombre(usuario_objetivo)
 
 # ----------------------------------------------------
 # Helper: verificar miembro (VERSIÓN FINAL 2025)
@@ -134,7 +126,7 @@ async def _obtener_usuario_desde_cookie(
     auth_token: Optional[str],
     sesion: AsyncSession,
     request: Optional[Request] = None
-) -> Usuario:
+) -> UsuarioVerificado:
     token = auth_token
     if not token and request:
         token = request.query_params.get("jwt")
@@ -142,23 +134,9 @@ async def _obtener_usuario_desde_cookie(
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             token = auth_header.split(" ")[1]
-    if not token:
-        raise HTTPException(status_code=401, detail="No autenticado (falta token)")
-
-    try:
-        payload = jwt.decode(token, config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Token inválido (sin sub)")
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expirado")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Token inválido")
 
-    usuario = await sesion.get(Usuario, user_id)
-    if not usuario:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    return usuario
+    # Firma + existencia del usuario, cacheadas por token
+    return await verificar_token(token, sesion)
 
 
 # ----------------------------------------------------
@@ -209,48 +187,9 @@ async def crear_conversacion(
         otro_id_str = str(otro_id)
 
         # ============================
-        # BUSCAR CHAT 1 A 1 REAL
-        # ============================
-        # SOLO conversaciones:
-        # - es_grupo == False
-        # - EXACTAMENTE 2 miembros
-        # - ambos activos
-        # - los 2 ids corresponden exactamente usuario + otro
+        # BUSCAR CHAT 1 A 1 REAL (clave canónica de la pareja)
         # ============================
-
-        q_conv = await sesion.execute(
-            select(Conversacion.id)
-            .where(Conversacion.es_grupo == False)
-        )
-        candidatos = q_conv.scalars().all()
-
-        existente = None
-
-        for cid in candidatos:
-
-            # obtener usuario_id y activo
-            rows = await sesion.execute(
-                select(
-                    MiembroConversacion.usuario_id,
-                    MiembroConversacion.activo
-                ).where(MiembroConversacion.conversacion_id == cid)
-            )
-            miembros_chat = rows.all()
-
-            # Debe tener EXACTAMENTE 2 miembros
-            if len(miembros_chat) != 2:
-                continue
-
-            # Ambos activos
-            if not all(row[1] for row in miembros_chat):
-                continue
-
-            ids = {row[0] for row in miembros_chat}
-
-            # Deben ser EXACTAMENTE usuario + otro
-            if ids == {usuario_id_str, otro_id_str}:
-                existente = await sesion.get(Conversacion, cid)
-                break
+        existente = await crud.obtener_conversacion_entre(sesion, usuario.id, otro_id)
 
         # Reusar conversación existente correcta
         if existente:
@@ -299,22 +238,37 @@ async def crear_conversacion(
     # ----------------------------------------------------
     # CREAR NUEVA CONVERSACIÓN
     # ----------------------------------------------------
-    conv = await crud.crear_conversacion(
-        sesion,
-        titulo=nombre_chat,
-        creador_id=str(usuario.id),
-        es_grupo=payload.es_grupo,
-    )
+    if not payload.es_grupo and len(miembros) == 2:
+        # La BD deduplica si otra petición creó el mismo chat a la vez
+        conv, creada = await crud.obtener_o_crear_conversacion_directa(
+            sesion,
+            creador_id=usuario_id_str,
+            otro_id=otro_id_str,
+            titulo=nombre_chat,
+        )
+        if not creada:
+            return ConversacionDetalle(
+                id=conv.id,
+                titulo=conv.titulo,
+                es_grupo=conv.es_grupo,
+                creado_en=conv.creado_en,
+                miembros=miembros,
+            )
+    else:
+        conv = await crud.crear_conversacion(
+            sesion,
+            titulo=nombre_chat,
+            creador_id=str(usuario.id),
+            es_grupo=payload.es_grupo,
+        )
 
     # Insertar miembros como activos
     for uid in miembros:
         await crud.agregar_miembro_conversacion(sesion, conv.id, str(uid))
-
-    await sesion.commit()
-    await sesion.refresh(conv)
+    await sesion.flush()
 
     # ----------------------------------------------------
-    # Emitir por socket a todos los miembros
+    # Avisar por socket a todos los miembros (outbox, misma transacción)
     # ----------------------------------------------------
     payload_socket = {
         "tipo": "conversacion_creada",
@@ -331,12 +285,17 @@ async def crear_conversacion(
         .where(MiembroConversacion.conversacion_id == conv.id)
     )
 
-    for (uid,) in q_miembros.all():
-        await sio.emit(
-            "conversacion_creada",
-            payload_socket,
-            room=USER_ROOM(str(uid)),
-        )
+    encolar(
+        sesion,
+        "conversacion_creada",
+        payload_socket,
+        [USER_ROOM(str(uid)) for (uid,) in q_miembros.all()],
+        conversacion_id=conv.id,
+    )
+
+    await sesion.commit()
+    await sesion.refresh(conv)
+    await invalidar_interes_conversacion(sesion, conv.id)
 
     return ConversacionDetalle(
         id=conv.id,
@@ -354,8 +313,12 @@ async def crear_conversacion(
 async def enviar_archivo(
     request: Request,
     conversacion_id: str,
-    file: UploadFile = File(...),      # 👈 NOMBRE EXACTO: "file"
+    file: Optional[UploadFile] = File(None),  # 👈 NOMBRE EXACTO: "file"
     usuario_id: str = Form(...),       # 👈 viene en el FormData
+    subida_id: Optional[str] = Form(None),  # 👈 para asociar los "progreso_subida"
+    sha256: Optional[str] = Form(None),     # 👈 sin "file": reenviar contenido ya guardado
+    nombre_archivo: Optional[str] = Form(None),
+    auth_token: Optional[str] = Cookie(None),
     sesion: AsyncSession = Depends(obtener_sesion),
 ):
     # 1) Validar conversación
@@ -363,8 +326,23 @@ async def enviar_archivo(
     if not conv:
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
 
-    # 2) Subir archivo al disco usando el helper de files.py
-    file_info = await upload_file(request, file)
+    # 2) Contenido: por hash si ya está guardado (sin subir ni escribir nada),
+    #    si no, subirlo (una sola copia por SHA-256, ver files.py)
+    if file is not None:
+        # Progreso solo al usuario de la cookie, no al usuario_id del form
+        progreso = progreso_por_socket(
+            await usuario_de_cookie(auth_token, sesion, request), subida_id, conversacion_id=conversacion_id
+        )
+        file_info = await upload_file(request, file, sesion, progreso)
+    elif sha256:
+        # Solo un usuario autenticado, miembro, y con acceso a ese contenido
+        usuario = await _obtener_usuario_desde_cookie(auth_token, sesion, request)
+        if str(usuario.id) != str(usuario_id):
+            raise HTTPException(status_code=403, detail="usuario_id no coincide con la sesión")
+        await _asegurar_miembro(sesion, conversacion_id, usuario.id)
+        file_info = await adjunto_por_hash(request, sesion, sha256, nombre_archivo, usuario.id)
+    else:
+        raise HTTPException(status_code=422, detail="Falta el archivo o su sha256")
 
     # 3) Crear mensaje en la BD
     nuevo = Mensaje(
@@ -376,10 +354,11 @@ async def enviar_archivo(
         tipo_adjunto=file_info["tipo"],
         tamano_adjunto=file_info["tamano"],
         nombre_archivo=file_info["nombre_archivo"],
+        adjunto_sha256=file_info["sha256"],
     )
 
     sesion.add(nuevo)
-    await sesion.commit()
+    await crud.resumen_registrar_mensaje(sesion, nuevo)
     await sesion.refresh(nuevo)
 
     # 4) Notificar en tiempo real a los miembros
@@ -394,10 +373,12 @@ async def enviar_archivo(
         "tamano_adjunto": file_info["tamano"],
         "nombre_archivo": file_info["nombre_archivo"],
         "creado_en": nuevo.creado_en.isoformat(),
+        "seq": nuevo.seq,
     }
 
     # 👉 usa la sala del USER si quieres, o la de la conv:
-    await sio.emit("mensaje_recibido", data_emit, room=CONV_ROOM(conversacion_id))
+    encolar(sesion, "mensaje_recibido", data_emit, [CONV_ROOM(conversacion_id)], conversacion_id=conversacion_id)
+    await sesion.commit()
 
     # 5) Devolver al frontend el mensaje ya creado
     return data_emit
@@ -435,17 +416,13 @@ async def obtener_miembros_grupo(
     rows = res.all()
     miembros = []
 
-    # 📌 4) Para cada miembro, obtener alias > teléfono
-    for mc, user in rows:
+    # 📌 4) Alias de todos los miembros en mi agenda (1 query)
+    aliases = await ResolutorNombres(sesion, usuario_actual.id).aliases(
+        user.id for _, user in rows
+    )
 
-        q_alias = await sesion.execute(
-            select(Contacto.alias)
-            .where(
-                Contacto.usuario_id == usuario_actual.id,     # mi agenda
-                Contacto.contacto_id == user.id               # contacto objetivo
-            )
-        )
-        alias = q_alias.scalar_one_or_none()
+    for mc, user in rows:
+        alias = aliases[str(user.id)]
 
         miembros.append({
             "id": str(user.id),
@@ -460,10 +437,15 @@ async def obtener_miembros_grupo(
 # ============================================================
 # 🔵 OBTENER ESTADOS DE MENSAJES (✓ / ✓✓)
 # ============================================================
+# Margen para no perder marcas de transacciones que confirmaron tarde
+ESTADOS_MARGEN_SEG = 5
+
+
 @router_conversaciones.get("/{conversacion_id}/estados")
 async def obtener_estados_mensajes(
     request: Request,
     conversacion_id: UUID,
+    since: Optional[datetime] = Query(None),
     auth_token: Optional[str] = Cookie(None),
     sesion: AsyncSession = Depends(obtener_sesion)
 ):
@@ -473,30 +455,53 @@ async def obtener_estados_mensajes(
     # 2️⃣ validar membresía (activo o inactivo)
     await _asegurar_miembro(sesion, conversacion_id, usuario.id)
 
-    # 3️⃣ obtener estados de todos los mensajes de esta conversación
-    q = await sesion.execute(
-        select(
-            EstadoMensaje.mensaje_id,
-            EstadoMensaje.usuario_id,
-            EstadoMensaje.estado
-        )
-        .join(Mensaje, Mensaje.id == EstadoMensaje.mensaje_id)
-        .where(Mensaje.conversacion_id == conversacion_id)
-    )
+    # 3️⃣ estados de MIS mensajes (los únicos con ✓ / ✓✓), derivados
+    #    de las marcas de entregado / leído de cada miembro.
+    #    Con ?since= solo lo que cambió desde entonces (tras reconectar).
+    ahora = datetime.utcnow()
+    cambiados_desde = None
+    if since is not None:
+        if since.tzinfo:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        cambiados_desde = since - timedelta(seconds=ESTADOS_MARGEN_SEG)
 
-    rows = q.all()
+    rows = await crud.recibos_estados(
+        sesion,
+        conversacion_id=conversacion_id,
+        remitente_id=usuario.id,
+        cambiados_desde=cambiados_desde
+    )
 
     # 4️⃣ Formato EXACTO que espera tu frontend
     estados = [
         {
-            "mensaje_id": str(mid),
-            "usuario_id": str(uid),
-            "estado": est
+            "mensaje_id": str(r.mensaje_id),
+            "usuario_id": str(r.usuario_id),
+            "estado": r.estado
         }
-        for mid, uid, est in rows
+        for r in rows
     ]
 
-    return {"ok": True, "estados": estados}
+    return {"ok": True, "estados": estados, "ahora": ahora.isoformat()}
+
+# ----------------------------------------------------
+# Helper: cursores opacos para paginar mensajes
+# ----------------------------------------------------
+def _codificar_cursor(msg: Mensaje) -> str:
+    """Cursor opaco = base64url("<creado_en iso>|<id>")."""
+    crudo = f"{msg.creado_en.isoformat()}|{msg.id}"
+    return base64.urlsafe_b64encode(crudo.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        crudo = base64.urlsafe_b64decode(cursor + relleno).decode("utf-8")
+        fecha, mid = crudo.split("|", 1)
+        return datetime.fromisoformat(fecha), UUID(mid)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 
 # ----------------------------------------------------
 # 📨 LISTAR MENSAJES DE UNA CONVERSACIÓN (OFICIAL)
@@ -504,10 +509,24 @@ async def obtener_estados_mensajes(
 @router_conversaciones.get("/{conversacion_id}/mensajes", response_model=List[MensajeLeer])
 async def listar_mensajes(
     request: Request,
+    response: Response,
     conversacion_id: UUID,
+    before: Optional[str] = Query(None, description="Cursor: mensajes anteriores a este"),
+    after: Optional[str] = Query(None, description="Cursor: mensajes posteriores a este"),
+    after_seq: Optional[int] = Query(None, ge=0, description="Mensajes con seq mayor a este (recuperar huecos)"),
+    limit: int = Query(50, ge=1, le=200),
     auth_token: Optional[str] = Cookie(None),
     sesion: AsyncSession = Depends(obtener_sesion),
 ):
+    """
+    Página de mensajes visibles en orden cronológico (keyset sobre
+    ix_mensajes_conversacion_creado). Sin cursor devuelve los más recientes.
+    El cursor para seguir paginando viaja en la cabecera X-Next-Cursor.
+    Con after_seq devuelve el tramo que sigue a ese seq (ux_mensajes_conversacion_seq).
+    """
+    if sum(x is not None for x in (before, after, after_seq)) > 1:
+        raise HTTPException(400, "Usa solo uno de 'before', 'after' o 'after_seq'")
+
     # Usuario autenticado
     usuario = await _obtener_usuario_desde_cookie(auth_token, sesion, request)
 
@@ -523,7 +542,7 @@ async def listar_mensajes(
         raise HTTPException(403, "No perteneces a esta conversación")
 
     # Seleccionar mensajes visibles
-    res_msg = await sesion.execute(
+    q = (
         select(Mensaje)
         .outerjoin(
             MensajeOculto,
@@ -534,18 +553,43 @@ async def listar_mensajes(
             Mensaje.conversacion_id == conversacion_id,
             MensajeOculto.mensaje_id.is_(None),
         )
-        .order_by(Mensaje.creado_en.asc())
     )
 
-    mensajes = res_msg.scalars().all()
-
     # Si salió, cortar
     if not miembro.activo and miembro.fecha_salida:
-        mensajes = [m for m in mensajes if m.creado_en <= miembro.fecha_salida]
+        q = q.where(Mensaje.creado_en <= miembro.fecha_salida)
 
     # Si ingresó después, cortar anteriores
     if miembro.activo and miembro.creado_en:
-        mensajes = [m for m in mensajes if m.creado_en >= miembro.creado_en]
+        q = q.where(Mensaje.creado_en >= miembro.creado_en)
+
+    clave = tuple_(Mensaje.creado_en, Mensaje.id)
+
+    if after_seq is not None:
+        q = q.where(Mensaje.seq > after_seq).order_by(Mensaje.seq.asc())
+    elif after:
+        q = q.where(clave > tuple_(*_decodificar_cursor(after)))
+        q = q.order_by(Mensaje.creado_en.asc(), Mensaje.id.asc())
+    else:
+        if before:
+            q = q.where(clave < tuple_(*_decodificar_cursor(before)))
+        q = q.order_by(Mensaje.creado_en.desc(), Mensaje.id.desc())
+
+    res_msg = await sesion.execute(q.limit(limit + 1))
+    mensajes = list(res_msg.scalars().all())
+
+    hay_mas = len(mensajes) > limit
+    mensajes = mensajes[:limit]
+
+    if hay_mas:
+        # El último de la página en el sentido recorrido
+        if after_seq is not None:
+            response.headers["X-Next-Seq"] = str(mensajes[-1].seq)
+        else:
+            response.headers["X-Next-Cursor"] = _codificar_cursor(mensajes[-1])
+
+    if not after and after_seq is None:
+        mensajes.reverse()
 
     return mensajes
 
@@ -592,6 +636,11 @@ async def eliminar_conversacion(
             MiembroConversacion.usuario_id == usuario.id,
         )
     )
+    await crud.resumen_eliminar_miembro(sesion, conversacion_id, usuario.id)
+
+    # Chat 1 a 1 incompleto → liberar la pareja para un chat nuevo
+    if not conv.es_grupo:
+        conv.par_directo = None
     await sesion.flush()
 
     # 5️⃣ Ver cuántos miembros quedan en TOTAL
@@ -606,6 +655,8 @@ async def eliminar_conversacion(
     #     (ellos siguen viendo el chat normal)
     if restantes > 0:
         await sesion.commit()
+        await invalidar_interes([usuario.id])
+        await invalidar_interes_conversacion(sesion, conversacion_id)
         return Response(status_code=204)
 
     # 🧹 7️⃣ Si NO queda NADIE, eliminar TODO lo relacionado
@@ -662,6 +713,7 @@ async def eliminar_conversacion(
     )
 
     await sesion.commit()
+    await invalidar_interes([usuario.id])
     return Response(status_code=204)
 
 # ===================================================================
@@ -684,6 +736,61 @@ async def enviar_mensaje(
     # ---------------------------------------------------
     usuario = await _obtener_usuario_desde_cookie(auth_token, sesion, request)
 
+    return await publicar_mensaje(sesion, usuario.id, conversacion_id, payload)
+
+
+def _mensaje_leer(msg: Mensaje) -> MensajeLeer:
+    """MensajeLeer de un mensaje con sus menciones ya cargadas."""
+    return MensajeLeer.model_validate({
+        "id": msg.id,
+        "conversacion_id": msg.conversacion_id,
+        "remitente_id": str(msg.remitente_id) if msg.remitente_id else None,
+        "cuerpo": msg.cuerpo,
+        "tipo": msg.tipo,
+        "creado_en": msg.creado_en,
+        "seq": msg.seq,
+        "editado_en": msg.editado_en,
+        "borrado_en": msg.borrado_en,
+        "url_adjunto": msg.url_adjunto,
+        "tipo_adjunto": msg.tipo_adjunto,
+        "mensaje_id_respuesta": (
+            str(msg.mensaje_id_respuesta)
+            if msg.mensaje_id_respuesta else None
+        ),
+        "mencionados": [m.usuario_id for m in msg.menciones]
+    })
+
+
+async def _mensaje_por_cliente_id(sesion: AsyncSession, remitente_id, cliente_id) -> Optional[Mensaje]:
+    q = await sesion.execute(
+        select(Mensaje)
+        .options(selectinload(Mensaje.menciones))
+        .where(
+            Mensaje.remitente_id == remitente_id,
+            Mensaje.cliente_id == cliente_id,
+        )
+    )
+    return q.scalar_one_or_none()
+
+
+async def publicar_mensaje(
+    sesion: AsyncSession,
+    usuario_id,
+    conversacion_id: UUID,
+    payload: MensajeCrear,
+) -> MensajeLeer:
+    """
+    Persiste el mensaje y encola sus eventos (HTTP y socket "enviar_mensaje").
+    Con payload.cliente_id un reintento devuelve el mensaje ya guardado.
+    """
+    # ---------------------------------------------------
+    # 🔁 Reintento idempotente (mismo cliente_id)
+    # ---------------------------------------------------
+    if payload.cliente_id:
+        previo = await _mensaje_por_cliente_id(sesion, usuario_id, payload.cliente_id)
+        if previo:
+            return _mensaje_leer(previo)
+
     # ---------------------------------------------------
     # 2️⃣ La conversación existe?
     # ---------------------------------------------------
@@ -697,7 +804,7 @@ async def enviar_mensaje(
     miembro = await sesion.execute(
         select(MiembroConversacion).where(
             MiembroConversacion.conversacion_id == conversacion_id,
-            MiembroConversacion.usuario_id == usuario.id,
+            MiembroConversacion.usuario_id == usuario_id,
             MiembroConversacion.activo.is_(True)
         )
     )
@@ -709,15 +816,24 @@ async def enviar_mensaje(
     # ---------------------------------------------------
     # 4️⃣ Crear el mensaje usando tu CRUD (corregido)
     # ---------------------------------------------------
-    msg = await crud.enviar_mensaje(
-        db=sesion,
-        conversacion_id=str(conversacion_id),
-        remitente_id=str(usuario.id),
-        cuerpo=payload.cuerpo,
-        mensaje_id_respuesta=payload.mensaje_id_respuesta,
-        mencionados_ids=payload.mencionados   # TU BACKEND RECIBE ESTO
-    )
-    await sesion.flush()
+    try:
+        msg = await crud.enviar_mensaje(
+            db=sesion,
+            conversacion_id=str(conversacion_id),
+            remitente_id=str(usuario_id),
+            cuerpo=payload.cuerpo,
+            mensaje_id_respuesta=payload.mensaje_id_respuesta,
+            mencionados_ids=payload.mencionados,   # TU BACKEND RECIBE ESTO
+            cliente_id=payload.cliente_id
+        )
+        await sesion.flush()
+    except IntegrityError:
+        # Dos reintentos simultáneos: ganó el otro
+        await sesion.rollback()
+        previo = payload.cliente_id and await _mensaje_por_cliente_id(sesion, usuario_id, payload.cliente_id)
+        if not previo:
+            raise
+        return _mensaje_leer(previo)
 
     # ---------------------------------------------------
     # 5️⃣ Listar miembros activos de la conversación
@@ -728,40 +844,25 @@ async def enviar_mensaje(
     )
     miembros_activos = (await sesion.execute(q)).scalars().all()
 
-    estados_iniciales = []
-    destinos = []
+    # el remitente no recibe estado (solo lectura)
+    destinos = [str(uid) for uid in miembros_activos if str(uid) != str(usuario_id)]
 
     # ---------------------------------------------------
-    # 6️⃣ Registrar estados iniciales (SIN DUPLICADOS)
+    # 6️⃣ Estados iniciales: los conectados ya lo tienen entregado
     # ---------------------------------------------------
-    for uid in miembros_activos:
-        uid = str(uid)
-
-        # el remitente no recibe estado (solo lectura)
-        if uid == str(usuario.id):
-            continue
-
-        u = await sesion.get(Usuario, uid)
-        esta_online = bool(u and u.en_linea)
-
-        estado = "enviado" if esta_online else "pendiente"
-
-        sesion.add(EstadoMensaje(
-            id=uuid.uuid4(),
-            mensaje_id=msg.id,
-            usuario_id=uid,
-            estado=estado
-        ))
+    online = await presencia.is_online(destinos)
+    online_ids = {uid for uid, conectado in online.items() if conectado}
 
-        estados_iniciales.append({
+    estados_iniciales = [
+        {
             "usuario_id": uid,
-            "estado": estado
-        })
-
-        destinos.append(uid)
+            "estado": "enviado" if uid in online_ids else "pendiente"
+        }
+        for uid in destinos
+    ]
 
-    await sesion.commit()
-    await sesion.refresh(msg, attribute_names=["menciones"])
+    await crud.recibos_avanzar(sesion, conversacion_id, online_ids, mensaje_id=msg.id)
+    await crud.resumen_registrar_mensaje(sesion, msg)
 
 
     # ---------------------------------------------------
@@ -769,11 +870,12 @@ async def enviar_mensaje(
     # ---------------------------------------------------
     msg_dict = {
         "id": str(msg.id),
-        "usuario_id": str(usuario.id),
+        "usuario_id": str(usuario_id),
         "conversacion_id": str(conversacion_id),
         "cuerpo": msg.cuerpo,
         "tipo": msg.tipo,
         "creado_en": msg.creado_en.isoformat(),
+        "seq": msg.seq,
         "mensaje_id_respuesta": (
             str(msg.mensaje_id_respuesta)
             if msg.mensaje_id_respuesta else None
@@ -781,48 +883,38 @@ async def enviar_mensaje(
     }
 
     # ---------------------------------------------------
-    # 8️⃣ Emitir el mensaje solo a los otros miembros
+    # 8️⃣ Encolar el mensaje solo para los otros miembros
     # ---------------------------------------------------
-    for uid in destinos:
-        await sio.emit(
-            "mensaje_recibido",
-            msg_dict,
-            room=USER_ROOM(uid)
-        )
+    encolar(
+        sesion,
+        "mensaje_recibido",
+        msg_dict,
+        [USER_ROOM(uid) for uid in destinos],
+        conversacion_id=conversacion_id
+    )
 
     # ---------------------------------------------------
-    # 9️⃣ Emitir estados iniciales SOLO al remitente
+    # 9️⃣ Estados iniciales SOLO al remitente
     # ---------------------------------------------------
-    await sio.emit(
+    encolar(
+        sesion,
         "estado_mensaje_inicial",
         {
             "mensaje_id": str(msg.id),
             "conversacion_id": str(conversacion_id),
             "estados": estados_iniciales
         },
-        room=USER_ROOM(str(usuario.id))
+        [USER_ROOM(str(usuario_id))],
+        conversacion_id=conversacion_id
     )
 
+    await sesion.commit()
+    await sesion.refresh(msg, attribute_names=["menciones"])
+
     # ---------------------------------------------------
     # 🔟 Retorno Pydantic FINAL seguro y limpio
     # ---------------------------------------------------
-    return MensajeLeer.model_validate({
-        "id": msg.id,
-        "conversacion_id": msg.conversacion_id,
-        "remitente_id": str(msg.remitente_id) if msg.remitente_id else None,
-        "cuerpo": msg.cuerpo,
-        "tipo": msg.tipo,
-        "creado_en": msg.creado_en,
-        "editado_en": msg.editado_en,
-        "borrado_en": msg.borrado_en,
-        "url_adjunto": msg.url_adjunto,
-        "tipo_adjunto": msg.tipo_adjunto,
-        "mensaje_id_respuesta": (
-            str(msg.mensaje_id_respuesta)
-            if msg.mensaje_id_respuesta else None
-        ),
-        "mencionados": [m.usuario_id for m in msg.menciones]
-    })
+    return _mensaje_leer(msg)
 
 
 
@@ -844,20 +936,13 @@ async def marcar_leidos(
     # 2️⃣ Validar que pertenece (aunque inactivo)
     await _asegurar_miembro(sesion, conversacion_id, usuario.id)
 
-    # 3️⃣ Actualizar estados → marcar como leido
-    await sesion.execute(
-        update(EstadoMensaje)
-        .where(
-            EstadoMensaje.usuario_id == str(usuario.id),
-            EstadoMensaje.estado != "leido",
-            EstadoMensaje.mensaje_id.in_(
-                select(Mensaje.id).where(Mensaje.conversacion_id == conversacion_id)
-            )
-        )
-        .values(
-            estado="leido"
-        )
-    )
+    # 3️⃣ Subir la marca de leído hasta el último mensaje
+    avances = await crud.recibos_avanzar(sesion, conversacion_id, [usuario.id], leido=True)
+    avisos = await crud.recibos_avisos(sesion, conversacion_id, avances)
+    await crud.resumen_marcar_leido(sesion, conversacion_id, usuario.id)
+
+    # 4️⃣ Avisar a los remitentes (✓✓ azules)
+    encolar_estados_actualizados(sesion, conversacion_id, avisos)
 
     await sesion.commit()
     return Response(status_code=204)
@@ -913,21 +998,12 @@ async def administrar_miembro_grupo(
     usuario_salida = await sesion.get(Usuario, usuario_objetivo)
 
     # ------------------------------
-    # FUNCIÓN nombre_visible(alias>telefono)
+    # Nombres visibles (alias>telefono) según la agenda del actor
     # ------------------------------
-    async def nombre_visible(visto_por, usuario_obj):
-        q_alias = await sesion.execute(
-            select(Contacto).where(
-                Contacto.usuario_id == visto_por,
-                Contacto.contacto_id == usuario_obj.id
-            )
-        )
-        c = q_alias.scalar_one_or_none()
-        return c.alias if (c and c.alias) else usuario_obj.telefono
-
-    # nombres visibles
-    nombre_salida_para_actor = await nombre_visible(usuario_actor.id, usuario_salida)
-    nombre_actor_visible = await nombre_visible(usuario_actor.id, usuario_actor)
+    nombres_actor = ResolutorNombres(sesion, usuario_actor.id)
+    visibles = await nombres_actor.nombres([usuario_salida, usuario_actor])
+    nombre_salida_para_actor = visibles[str(usuario_salida.id)]
+    nombre_actor_visible = visibles[str(usuario_actor.id)]
 
     # ----------------------------------------------------
     # TRANSFERENCIA AUTOMÁTICA DE ADMINISTRADOR
@@ -989,19 +1065,22 @@ async def administrar_miembro_grupo(
         )
         sesion.add(msg_admin_db)
 
-    await sesion.commit()
+    await crud.resumen_registrar_mensaje(sesion, msg_db)
+    if nuevo_admin_id:
+        await crud.resumen_registrar_mensaje(sesion, msg_admin_db)
 
     # ----------------------------------------------------
     # 🔵 SOCKET - mensaje personalizado para cada usuario
     # ----------------------------------------------------
-    await sio.emit(
+    encolar(
+        sesion,
         "usuario_salio_grupo",
         {
             "conversacion_id": str(conversacion_id),
             "usuario_id": str(usuario_objetivo),
 
             # nombre visible para todos (alias>telefono)
-            "nombre_salida": await nombre_visible(usuario_actor.id, usuario_salida),
+            "nombre_salida": nombre_salida_para_actor,
 
             # para que el front personalice:
             "actor_id": str(usuario_actor.id),
@@ -1009,22 +1088,27 @@ async def administrar_miembro_grupo(
             "es_salida_propia": es_salida_propia,
             "nuevo_admin_id": nuevo_admin_id,
         },
-        room=CONV_ROOM(str(conversacion_id)),
+        [CONV_ROOM(str(conversacion_id))],
+        conversacion_id=conversacion_id,
     )
 
     # nuevo admin → emitir
     if nuevo_admin_id:
-        usuario_admin_nuevo = await sesion.get(Usuario, nuevo_admin_id)
-        await sio.emit(
+        encolar(
+            sesion,
             "nuevo_admin_grupo",
             {
                 "conversacion_id": str(conversacion_id),
                 "nuevo_admin_id": nuevo_admin_id,
-                "nombre": await nombre_visible(usuario_actor.id, usuario_admin_nuevo),
+                "nombre": await nombres_actor.nombre(usuario_nuevo_admin),
             },
-            room=CONV_ROOM(str(conversacion_id)),
+            [CONV_ROOM(str(conversacion_id))],
+            conversacion_id=conversacion_id,
         )
 
+    await sesion.commit()
+    await invalidar_interes_conversacion(sesion, conversacion_id)
+
     return Response(status_code=204)
 
 
@@ -1096,32 +1180,29 @@ async def agregar_miembros_grupo(
     if not agregados:
         return {"agregados": [], "mensaje": "No se agregaron nuevos miembros"}
 
-    await sesion.commit()
+    # Sin commit aquí: membresías, mensajes de sistema y eventos del outbox
+    # se confirman juntos (una caída no deja miembros sin aviso)
+    await sesion.flush()
+    await crud.resumen_asegurar_miembros(sesion, conversacion_id, agregados)
 
     # ----------------------------------------------------
-    # ALIAS O TELÉFONO (alias > teléfono)
+    # ALIAS O TELÉFONO (alias > teléfono) — todo en lote
     # ----------------------------------------------------
-    async def nombre_visible(para_usuario_id, usuario_obj):
-        q_alias = await sesion.execute(
-            select(Contacto).where(
-                Contacto.usuario_id == para_usuario_id,
-                Contacto.contacto_id == usuario_obj.id
-            )
-        )
-        c = q_alias.scalar_one_or_none()
-        return c.alias if (c and c.alias) else usuario_obj.telefono
+    q_nuevos = await sesion.execute(select(Usuario).where(Usuario.id.in_(agregados)))
+    usuarios_nuevos = {str(u.id): u for u in q_nuevos.scalars().all()}
+
+    visibles = await ResolutorNombres(sesion, usuario_admin.id).nombres(
+        [usuario_admin, *usuarios_nuevos.values()]
+    )
 
     # Obtener nombre visible del admin para él mismo
-    admin_visible_para_admin = await nombre_visible(usuario_admin.id, usuario_admin)
+    admin_visible_para_admin = visibles[str(usuario_admin.id)]
 
     # ----------------------------------------------------
     # CREAR MENSAJE EN BD (versión NEUTRA)
     # ----------------------------------------------------
     for uid in agregados:
-        usuario_nuevo = await sesion.get(Usuario, uid)
-
-        # nombre visible del NUEVO miembro
-        nombre_nuevo_para_admin = await nombre_visible(usuario_admin.id, usuario_nuevo)
+        usuario_nuevo = usuarios_nuevos[uid]
 
         # Mensaje NEUTRO para BD:
         #    "AdminTel agregó a NuevoTel"
@@ -1134,21 +1215,19 @@ async def agregar_miembros_grupo(
             tipo="sistema"
         )
         sesion.add(msg_db)
-
-    await sesion.commit()
+        await crud.resumen_registrar_mensaje(sesion, msg_db)
 
     # ----------------------------------------------------
     # SOCKETS — PERSONALIZAR EL MENSAJE EN FRONT
     # ----------------------------------------------------
     for uid in agregados:
 
-        usuario_nuevo = await sesion.get(Usuario, uid)
-
         # nombre visible del nuevo para el admin
-        nombre_nuevo_para_admin = await nombre_visible(usuario_admin.id, usuario_nuevo)
+        nombre_nuevo_para_admin = visibles[uid]
 
         # Emitir a la sala del grupo (lo recibirán todos)
-        await sio.emit(
+        encolar(
+            sesion,
             "miembro_agregado",
             {
                 "conversacion_id": str(conversacion_id),
@@ -1160,20 +1239,26 @@ async def agregar_miembros_grupo(
                 "admin_visible": admin_visible_para_admin,
                 "nuevo_visible": nombre_nuevo_para_admin,
             },
-            room=CONV_ROOM(str(conversacion_id)),
+            [CONV_ROOM(str(conversacion_id))],
+            conversacion_id=conversacion_id,
         )
 
         # Enviar chat al usuario nuevo SIN RECARGAR
-        await sio.emit(
+        encolar(
+            sesion,
             "nuevo_chat",
             {
                 "id": str(conversacion_id),
                 "titulo": conv.titulo,
                 "es_grupo": True,
             },
-            room=USER_ROOM(uid),
+            [USER_ROOM(uid)],
+            conversacion_id=conversacion_id,
         )
 
+    await sesion.commit()
+    await invalidar_interes_conversacion(sesion, conversacion_id)
+
     return {"agregados": agregados}
 
 
@@ -1222,6 +1307,7 @@ async def vaciar_mensajes_conversacion(
                 )
             )
 
+    await crud.resumen_recalcular(sesion, conversacion_id, usuario.id)
     await sesion.commit()
 
     # 204 → el front solo mira resp.ok
@@ -1261,18 +1347,26 @@ async def eliminar_mensaje(
 
         if not existe:
             sesion.add(MensajeOculto(mensaje_id=mensaje_id, usuario_id=usuario.id))
-            await sesion.commit()
+            await crud.resumen_recalcular(sesion, msg.conversacion_id, usuario.id)
 
         payload = {
             "tipo": "mensaje_eliminado",
             "modo": "para_mi",
             "mensaje_id": str(msg.id),
             "conversacion_id": str(msg.conversacion_id),
+            "seq": msg.seq,
             "usuario_id": str(usuario.id),
         }
 
         # Solo se emite al usuario que lo borró (por si tiene más pestañas abiertas)
-        await sio.emit("mensaje_eliminado", payload, room=USER_ROOM(str(usuario.id)))
+        encolar(
+            sesion,
+            "mensaje_eliminado",
+            payload,
+            [USER_ROOM(str(usuario.id))],
+            conversacion_id=msg.conversacion_id,
+        )
+        await sesion.commit()
         return Response(status_code=204)
 
     # ─────────────────────────────────────────────
@@ -1290,28 +1384,38 @@ async def eliminar_mensaje(
     if hasattr(msg, "borrado_en"):
         msg.borrado_en = datetime.utcnow()
 
-    await sesion.commit()
+    # El adjunto deja de estar disponible (el trigger suelta su referencia)
+    msg.url_adjunto = None
+    msg.adjunto_sha256 = None
+
+    await crud.resumen_actualizar_preview(sesion, msg.id, msg.cuerpo)
 
     payload = {
         "tipo": "mensaje_eliminado",
         "modo": "para_todos",
         "mensaje_id": str(msg.id),
         "conversacion_id": str(msg.conversacion_id),
+        "seq": msg.seq,
         "texto": msg.cuerpo,
     }
 
     # A todos los miembros de la conversación (sala de la conversación)
-    await sio.emit("mensaje_eliminado", payload, room=CONV_ROOM(str(msg.conversacion_id)))
-
-    # Y además a cada usuario por si tiene más pestañas abiertas
+    # y además a cada usuario por si tiene más pestañas abiertas
     q_miembros = await sesion.execute(
         select(MiembroConversacion.usuario_id).where(
             MiembroConversacion.conversacion_id == msg.conversacion_id
         )
     )
-    for (uid,) in q_miembros.all():
-        await sio.emit("mensaje_eliminado", payload, room=USER_ROOM(str(uid)))
+    encolar(
+        sesion,
+        "mensaje_eliminado",
+        payload,
+        [CONV_ROOM(str(msg.conversacion_id))]
+        + [USER_ROOM(str(uid)) for (uid,) in q_miembros.all()],
+        conversacion_id=msg.conversacion_id,
+    )
 
+    await sesion.commit()
     return Response(status_code=204)
 
 
@@ -1344,7 +1448,7 @@ async def editar_mensaje(
         raise HTTPException(status_code=403, detail="Solo el autor puede editar este mensaje")
 
     # 📝 Actualizar cuerpo
-    nuevo_texto = (payload.cuerpo or "").trim()
+    nuevo_texto = (payload.cuerpo or "").strip()
     if not nuevo_texto:
         raise HTTPException(status_code=400, detail="El mensaje no puede quedar vacío")
 
@@ -1356,33 +1460,35 @@ async def editar_mensaje(
     if hasattr(msg, "editado"):
         msg.editado = True
 
-    await sesion.commit()
-    await sesion.refresh(msg)
+    await crud.resumen_actualizar_preview(sesion, msg.id, msg.cuerpo)
 
     # 🔔 Payload para Socket.IO
     payload_socket = {
         "tipo": "mensaje_editado",
         "mensaje_id": str(msg.id),
         "conversacion_id": str(msg.conversacion_id),
+        "seq": msg.seq,
         "cuerpo": msg.cuerpo,
         "editado_en": msg.editado_en.isoformat() if msg.editado_en else None,
     }
 
-    # Emitir actualización a la sala del grupo/chat
-    await sio.emit(
-        "mensaje_editado",
-        payload_socket,
-        room=CONV_ROOM(str(msg.conversacion_id)),
-    )
-
-    # Emitir a todas las sesiones del usuario
+    # Actualización a la sala del grupo/chat y a todas las sesiones de cada miembro
     q_miembros = await sesion.execute(
         select(MiembroConversacion.usuario_id).where(
             MiembroConversacion.conversacion_id == msg.conversacion_id
         )
     )
-    for (uid,) in q_miembros.all():
-        await sio.emit("mensaje_editado", payload_socket, room=USER_ROOM(str(uid)))
+    encolar(
+        sesion,
+        "mensaje_editado",
+        payload_socket,
+        [CONV_ROOM(str(msg.conversacion_id))]
+        + [USER_ROOM(str(uid)) for (uid,) in q_miembros.all()],
+        conversacion_id=msg.conversacion_id,
+    )
+
+    await sesion.commit()
+    await sesion.refresh(msg)
 
     return msg
 
@@ -1405,20 +1511,22 @@ async def reaccionar(
         emoji=emoji
     )
     sesion.add(reaccion)
-    await sesion.commit()
-    
+
     # Emitir socket
     msg = await sesion.get(Mensaje, mensaje_id)
-    await sio.emit(
+    encolar(
+        sesion,
         "reaccion_recibida",
         {
             "mensaje_id": str(mensaje_id),
             "usuario_id": str(usuario.id),
             "emoji": emoji,
         },
-        room=CONV_ROOM(str(msg.conversacion_id))
+        [CONV_ROOM(str(msg.conversacion_id))],
+        conversacion_id=msg.conversacion_id,
     )
 
+    await sesion.commit()
     return {"ok": True}
 
 
@@ -1477,18 +1585,14 @@ async def obtener_info_grupo(
         .where(MiembroConversacion.conversacion_id == conversacion_id)
     )
 
-    miembros = []
-    for u, m in miembros_q.all():
+    filas = miembros_q.all()
 
-        # Obtener alias que ESTE usuario tiene para ese contacto
-        alias_query = await sesion.execute(
-            select(Contacto.alias)
-            .where(
-                Contacto.usuario_id == usuario.id,
-                Contacto.contacto_id == u.id
-            )
-        )
-        alias_row = alias_query.scalar()
+    # Alias que ESTE usuario tiene para cada miembro (1 query)
+    aliases = await ResolutorNombres(sesion, usuario.id).aliases(u.id for u, _ in filas)
+
+    miembros = []
+    for u, m in filas:
+        alias_row = aliases[str(u.id)]
 
         miembros.append({
             "id": str(u.id),
@@ -1514,80 +1618,64 @@ async def obtener_chats(usuario_id: str, sesion: AsyncSession = Depends(obtener_
     try:
         uid = uuid.UUID(usuario_id)
 
+        # Resumen por miembro: scan por (usuario_id, ultima_actividad)
         res = await sesion.execute(
             select(
                 Conversacion,
                 MiembroConversacion.activo,
-                MiembroConversacion.fecha_salida
+                MiembroConversacion.fecha_salida,
+                ResumenConversacion,
+                Mensaje.remitente_id,
             )
+            .select_from(ResumenConversacion)
+            .join(Conversacion, Conversacion.id == ResumenConversacion.conversacion_id)
             .join(
                 MiembroConversacion,
-                MiembroConversacion.conversacion_id == Conversacion.id
+                (MiembroConversacion.conversacion_id == ResumenConversacion.conversacion_id)
+                & (MiembroConversacion.usuario_id == ResumenConversacion.usuario_id)
             )
-            .where(MiembroConversacion.usuario_id == uid)
+            .outerjoin(Mensaje, Mensaje.id == ResumenConversacion.ultimo_mensaje_id)
+            .where(ResumenConversacion.usuario_id == uid)
+            .order_by(ResumenConversacion.ultima_actividad.desc())
         )
         rows = res.all()
         if not rows:
             return []
 
-        conversaciones = []
-        for conv, activo, fecha_salida in rows:
+        conv_ids = [row[0].id for row in rows]
 
-            # Lista de usuarios
-            miembros_q = await sesion.execute(
-                select(Usuario, MiembroConversacion)
-                .join(MiembroConversacion, MiembroConversacion.usuario_id == Usuario.id)
-                .where(MiembroConversacion.conversacion_id == conv.id)
-            )
-            miembros = miembros_q.all()
+        # Miembros de TODAS las conversaciones (1 query)
+        miembros_q = await sesion.execute(
+            select(MiembroConversacion.conversacion_id, Usuario)
+            .join(Usuario, MiembroConversacion.usuario_id == Usuario.id)
+            .where(MiembroConversacion.conversacion_id.in_(conv_ids))
+        )
+        usuarios_por_conv = {}
+        for cid, u in miembros_q.all():
+            usuarios_por_conv.setdefault(cid, []).append(u)
+
+        conversaciones = []
+        for conv, activo, fecha_salida, resumen, remitente_id in rows:
 
-            usuarios_list = []
-            for u, m in miembros:
-                usuarios_list.append({
+            usuarios_list = [
+                {
                     "id": str(u.id),
                     "nombre": u.nombre,
                     "telefono": u.telefono,
                     "es_admin": (str(u.id) == str(conv.creador_id))
-                })
-
-            # Últimos mensajes
-            ult_q = await sesion.execute(
-                select(Mensaje)
-                .outerjoin(
-                    MensajeOculto,
-                    (MensajeOculto.mensaje_id == Mensaje.id)
-                    & (MensajeOculto.usuario_id == uid)
-                )
-                .where(
-                    Mensaje.conversacion_id == conv.id,
-                    MensajeOculto.mensaje_id.is_(None),
-                )
-                .order_by(Mensaje.creado_en.desc())
-                .limit(3)
-            )
-
-            ult_msgs = [
-                {
-                    "id": str(m.id),
-                    "usuario_id": str(m.remitente_id),
-                    "contenido": m.cuerpo,
-                    "fecha": m.creado_en.isoformat()
                 }
-                for m in ult_q.scalars().all()
+                for u in usuarios_por_conv.get(conv.id, [])
             ]
 
-            # 🔥 Contador de no leídos
-            unread_q = await sesion.execute(
-                select(func.count())
-                .select_from(EstadoMensaje)
-                .join(Mensaje, EstadoMensaje.mensaje_id == Mensaje.id)
-                .where(
-                    EstadoMensaje.usuario_id == uid,
-                    EstadoMensaje.estado != "leido",
-                    Mensaje.conversacion_id == conv.id
-                )
-            )
-            unread = unread_q.scalar_one()
+            # Solo el último mensaje: es lo único que pinta la barra lateral
+            ult_msgs = []
+            if resumen.ultimo_mensaje_id:
+                ult_msgs.append({
+                    "id": str(resumen.ultimo_mensaje_id),
+                    "usuario_id": str(remitente_id),
+                    "contenido": resumen.ultimo_mensaje_preview,
+                    "fecha": resumen.ultimo_mensaje_en.isoformat() if resumen.ultimo_mensaje_en else None
+                })
 
             conversaciones.append({
                 "id": str(conv.id),
@@ -1598,8 +1686,9 @@ async def obtener_chats(usuario_id: str, sesion: AsyncSession = Depends(obtener_
                 "fecha_salida": fecha_salida.isoformat() if fecha_salida else None,
                 "creador_id": str(conv.creador_id) if conv.creador_id else None,
                 "usuarios": usuarios_list,
-                "mensajes": list(reversed(ult_msgs)),
-                "no_leidos": unread,
+                "mensajes": ult_msgs,
+                "no_leidos": resumen.no_leidos,
+                "ultima_actividad": resumen.ultima_actividad.isoformat() if resumen.ultima_actividad else None,
             })
 
         return conversaciones
@@ -3,12 +3,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from sqlalchemy.exc import IntegrityError
 
 from uuid import UUID
 
 from app.db.sesion import obtener_sesion
-from app.db.modelos import EstadoMensaje
+from app.db import crud
+from app.db.modelos import Mensaje
+from app.outbox import encolar_estados_actualizados
 from app.schemas.estado_mensaje import EstadoMensajeCrear, EstadoMensajeLeer
 
 router = APIRouter(prefix="/estados_mensaje", tags=["EstadosMensaje"])
@@ -16,45 +17,45 @@ router = APIRouter(prefix="/estados_mensaje", tags=["EstadosMensaje"])
 
 # -------------------------------------------------------------------------
 # POST ✔ Registrar nuevo estado del mensaje (enviado / entregado / leido)
+#   → sube la marca de agua del miembro hasta ese mensaje
 # -------------------------------------------------------------------------
 @router.post("", response_model=EstadoMensajeLeer, status_code=status.HTTP_201_CREATED)
 async def registrar_estado(payload: EstadoMensajeCrear, db: AsyncSession = Depends(obtener_sesion)):
 
-    nuevo_estado = EstadoMensaje(
-        mensaje_id=payload.mensaje_id,
-        usuario_id=payload.usuario_id,
-        estado=payload.estado
+    q = await db.execute(
+        select(Mensaje.conversacion_id).where(Mensaje.id == payload.mensaje_id)
     )
+    conversacion_id = q.scalar_one_or_none()
 
-    db.add(nuevo_estado)
-
-    try:
-        await db.commit()
-        await db.refresh(nuevo_estado)
-        return nuevo_estado
+    if conversacion_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Mensaje no encontrado."
+        )
 
-    except IntegrityError:
-        # ⚠ Ya existe este registro (mensaje_id + usuario_id + estado)
-        await db.rollback()
+    avances = await crud.recibos_avanzar(
+        db,
+        conversacion_id,
+        [payload.usuario_id],
+        mensaje_id=payload.mensaje_id,
+        leido=(payload.estado == "leido")
+    )
+    avisos = await crud.recibos_avisos(db, conversacion_id, avances)
 
-        # → Lo devolvemos (no es error)
-        q = await db.execute(
-            select(EstadoMensaje).where(
-                EstadoMensaje.mensaje_id == payload.mensaje_id,
-                EstadoMensaje.usuario_id == payload.usuario_id,
-                EstadoMensaje.estado == payload.estado
-            )
-        )
-        existente = q.scalars().first()
+    # Avisar a los remitentes afectados (✓✓)
+    encolar_estados_actualizados(db, conversacion_id, avisos)
+    await db.commit()
 
-        if existente:
-            return existente
+    estados = await crud.recibos_estados(db, mensaje_id=payload.mensaje_id)
+    for e in estados:
+        if e.usuario_id == payload.usuario_id:
+            return _a_estado_leer(e)
 
-        # Si NO se encontró → error real
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error inesperado al registrar el estado del mensaje."
-        )
+    # ⚠ No es destinatario del mensaje (remitente o fuera de la conversación)
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="El usuario no es destinatario de este mensaje."
+    )
 
 
 # -------------------------------------------------------------------------
@@ -63,10 +64,16 @@ async def registrar_estado(payload: EstadoMensajeCrear, db: AsyncSession = Depen
 @router.get("/mensaje/{mensaje_id}", response_model=list[EstadoMensajeLeer])
 async def estados_de_mensaje(mensaje_id: UUID, db: AsyncSession = Depends(obtener_sesion)):
 
-    q = await db.execute(
-        select(EstadoMensaje)
-        .where(EstadoMensaje.mensaje_id == mensaje_id)
-        .order_by(EstadoMensaje.creado_en.asc())
-    )
+    estados = await crud.recibos_estados(db, mensaje_id=mensaje_id)
+    return [_a_estado_leer(e) for e in estados]
+
 
-    return q.scalars().all()
+def _a_estado_leer(fila) -> dict:
+    # id = fila de membresía que guarda la marca; creado_en = instante del estado
+    return {
+        "id": fila.miembro_id,
+        "mensaje_id": fila.mensaje_id,
+        "usuario_id": fila.usuario_id,
+        "estado": fila.estado,
+        "creado_en": fila.marca,
+    }
@@ -1,14 +1,47 @@
 # app/api/files.py
+import asyncio
+import hashlib
+import logging
+import mimetypes
 import os
+import re
+import time
 import uuid
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from typing import Awaitable, Callable, Optional
+from fastapi import APIRouter, Cookie, Depends, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.requests import Request
 
+from app.core.autenticacion import verificar_token
+from app.core.config import config
+from app.db import crud
+from app.db.sesion import obtener_sesion
+from app.realtime import difundir
+
+logger = logging.getLogger("app.files")
+
 router = APIRouter()
 
 # Carpeta raíz de uploads
 UPLOAD_ROOT = "uploads"
+# Contenido por hash (uploads/cas/ab/<sha>.<ext>) y subidas en curso
+CAS_DIR = "cas"
+TMP_DIR = "tmp"
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Escritura por trozos: memoria constante por subida, sin importar el tamaño
+CHUNK_SUBIDA = 1024 * 1024  # 1 MiB
+MAX_SUBIDA = config.MAX_SUBIDA_MB * 1024 * 1024
+PROGRESO_CADA_SEG = 0.5
+# Cuerpo multipart = archivo + campos + separadores
+MARGEN_MULTIPART = 64 * 1024
+# Rutas que reciben archivos (las vigila LimiteSubida)
+RUTAS_SUBIDA = re.compile(r"^(/api/upload_file|/conversaciones/[^/]+/archivo)/?$")
+
+# progreso(escritos, total) — total = None si el cliente no lo informó
+Progreso = Callable[[int, Optional[int]], Awaitable[None]]
 
 # Extensiones soportadas
 EXT_IMAGES = {"jpg","jpeg","png","gif","webp"}
@@ -31,29 +64,218 @@ def detect_folder(extension: str):
     return "others"
 
 
-def ensure_unique_filename(path: str, filename: str):
+def nombre_seguro(nombre: str) -> str:
+    """Nombre visible del archivo (por mensaje), sin separadores de ruta."""
+    return nombre.replace("/", "_").replace("\\", "_").strip()
+
+
+def ruta_contenido(sha256: str, ext: str) -> str:
+    """Ruta relativa a UPLOAD_ROOT; la extensión solo sirve para el MIME."""
+    ext = re.sub(r"[^a-z0-9]", "", ext.lower())[:10]
+    nombre = f"{sha256}.{ext}" if ext else sha256
+    return f"{CAS_DIR}/{sha256[:2]}/{nombre}"
+
+
+class LimiteSubida:
+    """
+    Middleware ASGI: corta con 413 las subidas de más de MAX_SUBIDA en
+    RUTAS_SUBIDA mientras el cuerpo llega, antes de que Starlette lo
+    guarde entero al parsear el formulario:
+    - Content-Length declarado mayor → 413 sin leer nada.
+    - Sin Content-Length (chunked) o con uno falso → se cuentan los bytes
+      recibidos y se corta al pasar el límite.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not RUTAS_SUBIDA.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        limite = MAX_SUBIDA + MARGEN_MULTIPART
+        declarado = dict(scope["headers"]).get(b"content-length")
+        if declarado and declarado.isdigit() and int(declarado) > limite:
+            await _demasiado_grande()(scope, receive, send)
+            return
+
+        recibidos = 0
+        iniciada = False
+
+        async def receive_limitado():
+            nonlocal recibidos
+            msg = await receive()
+            if msg["type"] == "http.request":
+                recibidos += len(msg.get("body", b""))
+                if recibidos > limite:
+                    # FastAPI la deja pasar tal cual al parsear el form → 413
+                    raise StarletteHTTPException(status_code=413, detail=_detalle_413())
+            return msg
+
+        async def send_marcado(msg):
+            nonlocal iniciada
+            if msg["type"] == "http.response.start":
+                iniciada = True
+            await send(msg)
+
+        try:
+            await self.app(scope, receive_limitado, send_marcado)
+        except StarletteHTTPException as e:
+            if e.status_code != 413 or iniciada:
+                raise
+            await _demasiado_grande()(scope, receive, send)
+
+
+def _detalle_413() -> str:
+    return f"El archivo supera {config.MAX_SUBIDA_MB} MB"
+
+
+def _demasiado_grande() -> JSONResponse:
+    return JSONResponse({"detail": _detalle_413()}, status_code=413, headers={"Connection": "close"})
+
+
+async def usuario_de_cookie(auth_token: Optional[str], sesion: AsyncSession, request: Optional[Request] = None):
+    """
+    id del usuario autenticado (cookie auth_token o Authorization: Bearer),
+    o None si no hay token o no es válido.
     """
-    Evita nombres repetidos.
-    Si existe "archivo.pdf", crea "archivo (1).pdf", "archivo (2).pdf", etc.
+    token = auth_token
+    if not token and request:
+        cabecera = request.headers.get("Authorization") or ""
+        if cabecera.startswith("Bearer "):
+            token = cabecera[len("Bearer "):]
+    if not token:
+        return None
+    try:
+        return (await verificar_token(token, sesion)).id
+    except HTTPException:
+        return None
+
+
+def progreso_por_socket(usuario_id, subida_id: Optional[str], **extra) -> Optional[Progreso]:
     """
-    base, ext = os.path.splitext(filename)
-    counter = 1
-    final_name = filename
+    Emite "progreso_subida" a los dispositivos del usuario (user:{id}).
+    usuario_id tiene que ser el AUTENTICADO, nunca uno que mande el cliente.
+    """
+    if not usuario_id:
+        return None
+
+    async def progreso(escritos: int, total: Optional[int]):
+        try:
+            await difundir(
+                "progreso_subida",
+                {"subida_id": subida_id, "escritos": escritos, "total": total, **extra},
+                usuarios=[usuario_id],
+            )
+        except Exception as e:
+            # El aviso es informativo: nunca corta la subida
+            logger.warning("[files] progreso no emitido: %s", e)
 
-    while os.path.exists(os.path.join(path, final_name)):
-        final_name = f"{base} ({counter}){ext}"
-        counter += 1
+    return progreso
 
-    return final_name
+
+def _escribir_trozo(f, sha, trozo: bytes):
+    # En un hilo: ni el disco ni el hash (hashlib suelta el GIL) frenan el loop
+    f.write(trozo)
+    sha.update(trozo)
+
+
+async def guardar_por_trozos(archivo: UploadFile, destino: str, progreso: Optional[Progreso] = None) -> tuple[int, str]:
+    """
+    Copia el archivo a destino por trozos de CHUNK_SUBIDA en un hilo,
+    calculando el SHA-256 al vuelo. Corta con 413 en cuanto supera
+    MAX_SUBIDA (y borra lo escrito). Devuelve (tamaño, sha256).
+    """
+    # El cuerpo ya lo limitó LimiteSubida; esto acota el archivo en sí
+    total = getattr(archivo, "size", None)
+    if total is not None and total > MAX_SUBIDA:
+        raise HTTPException(status_code=413, detail=_detalle_413())
+
+    sha = hashlib.sha256()
+    escritos = 0
+    ultimo_aviso = 0.0
+
+    f = await asyncio.to_thread(open, destino, "wb")
+    try:
+        while True:
+            trozo = await archivo.read(CHUNK_SUBIDA)
+            if not trozo:
+                break
+            escritos += len(trozo)
+            if escritos > MAX_SUBIDA:
+                raise HTTPException(status_code=413, detail=_detalle_413())
+            await asyncio.to_thread(_escribir_trozo, f, sha, trozo)
+
+            if progreso and time.monotonic() - ultimo_aviso >= PROGRESO_CADA_SEG:
+                ultimo_aviso = time.monotonic()
+                await progreso(escritos, total)
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.remove, destino)
+        raise
+    await asyncio.to_thread(f.close)
+
+    if progreso:
+        await progreso(escritos, escritos)
+    return escritos, sha.hexdigest()
+
+
+def _colocar(temporal: str, destino: str):
+    """Mueve la subida a su ruta por hash; si ya existe, descarta la copia."""
+    if os.path.exists(destino):
+        os.remove(temporal)
+        return
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    os.replace(temporal, destino)
+
+
+def _info_adjunto(request: Request, adjunto, nombre: str) -> dict:
+    ext = nombre.split(".")[-1].lower() if "." in nombre else ""
+    base_url = str(request.base_url).rstrip("/")
+    return {
+        "url": f"{base_url}/{UPLOAD_ROOT}/{adjunto.ruta}",
+        "tipo": ext,
+        "tamano": adjunto.tamano,
+        "mime": adjunto.mime,
+        "sha256": adjunto.sha256,
+        "nombre_archivo": nombre,           # ✔ nombre visible de ESTE mensaje
+        "nombre_original": nombre,
+        "categoria": detect_folder(ext),
+    }
+
+
+async def adjunto_por_hash(request: Request, sesion: AsyncSession, sha256: str, nombre: str, usuario_id) -> dict:
+    """
+    Reenvío sin subir nada, SOLO de contenido que el usuario ya ve en una
+    de sus conversaciones. Inexistente o ajeno dan la misma respuesta
+    (404 "adjunto_desconocido" → el cliente sube el archivo), así el hash
+    no sirve para averiguar qué hay guardado.
+    """
+    sha256 = sha256.lower()
+    if not SHA256_RE.match(sha256):
+        raise HTTPException(status_code=422, detail="sha256 inválido")
+    adjunto = await crud.adjunto_accesible(sesion, sha256, usuario_id)
+    if not adjunto:
+        raise HTTPException(status_code=404, detail="adjunto_desconocido")
+    return _info_adjunto(request, adjunto, nombre_seguro(nombre or "archivo"))
 
 
 # ============================================================
 # 🔥 MÉTODO OFICIAL PARA SUBIR ARCHIVOS (/conversaciones/.../archivo)
 # ============================================================
-async def upload_file(request: Request, archivo: UploadFile):
+async def upload_file(
+    request: Request,
+    archivo: UploadFile,
+    sesion: AsyncSession,
+    progreso: Optional[Progreso] = None,
+):
     """
-    Guarda el archivo respetando el nombre original y evitando colisiones.
+    Guarda el contenido UNA vez por SHA-256 (uploads/cas/...) y lo registra
+    en adjuntos. Los mensajes que lo usan cuentan solos (trigger).
+    El nombre original queda como nombre visible del mensaje.
     Retorna los campos EXACTOS que espera tu frontend.
+    No hace commit: va en la transacción del llamador.
     """
 
     original_name = archivo.filename
@@ -61,53 +283,53 @@ async def upload_file(request: Request, archivo: UploadFile):
         raise HTTPException(status_code=400, detail="Archivo inválido")
 
     # Extraer extensión
-    ext = original_name.split(".")[-1].lower()
-    folder = detect_folder(ext)
-
-    # Crear carpeta destino
-    save_dir = os.path.join(UPLOAD_ROOT, folder)
-    os.makedirs(save_dir, exist_ok=True)
+    ext = original_name.split(".")[-1].lower() if "." in original_name else ""
 
     # -----------------------------
-    # 🔥 NOMBRE REAL DEL ARCHIVO
+    # 🔥 SUBIDA → temporal (hash al vuelo) → ruta por contenido
     # -----------------------------
-    # Limpiar caracteres peligrosos del nombre
-    safe_name = original_name.replace("/", "_").replace("\\", "_").strip()
+    tmp_dir = os.path.join(UPLOAD_ROOT, TMP_DIR)
+    await asyncio.to_thread(os.makedirs, tmp_dir, exist_ok=True)
+    temporal = os.path.join(tmp_dir, f"{uuid.uuid4().hex}.part")
+    tamano, sha256 = await guardar_por_trozos(archivo, temporal, progreso)
 
-    # Evitar duplicados → archivo.pdf, archivo (1).pdf, archivo (2).pdf...
-    final_name = ensure_unique_filename(save_dir, safe_name)
+    mime = archivo.content_type
+    if not mime or mime == "application/octet-stream":
+        mime = mimetypes.guess_type(original_name)[0] or mime
 
-    # -----------------------------
-    # GUARDAR ARCHIVO REAL
-    # -----------------------------
-    full_path = os.path.join(save_dir, final_name)
-    content = await archivo.read()
+    # Primero la fila (bloquea frente a la purga de huérfanos), luego el
+    # disco: si el contenido ya estaba, la subida temporal se descarta
+    try:
+        adjunto = await crud.adjunto_registrar(
+            sesion, sha256, tamano, mime, ruta_contenido(sha256, ext)
+        )
+        await asyncio.to_thread(_colocar, temporal, os.path.join(UPLOAD_ROOT, adjunto.ruta))
+    except BaseException:
+        if os.path.exists(temporal):
+            await asyncio.to_thread(os.remove, temporal)
+        raise
 
-    with open(full_path, "wb") as f:
-        f.write(content)
-
-    # -----------------------------
-    # URL pública
-    # -----------------------------
-    base_url = str(request.base_url).rstrip("/")
-    file_url = f"{base_url}/uploads/{folder}/{final_name}"
-
-    # -----------------------------
-    # RETORNO EXACTO PARA EL FRONT
-    # -----------------------------
-    return {
-        "url": file_url,
-        "tipo": ext,
-        "tamano": len(content),
-        "nombre_archivo": final_name,       # ✔ nombre tal cual
-        "nombre_original": original_name,   # ✔ por si lo necesitas
-        "categoria": folder,
-    }
+    info = _info_adjunto(request, adjunto, nombre_seguro(original_name))
+    info["nombre_original"] = original_name
+    return info
 
 
 # ============================================================
 # ENDPOINT PÚBLICO (COMPATIBILIDAD)
 # ============================================================
 @router.post("/upload_file")
-async def upload_file_public(request: Request, file: UploadFile = File(...)):
-    return await upload_file(request, file)
+async def upload_file_public(
+    request: Request,
+    file: UploadFile = File(...),
+    subida_id: Optional[str] = Form(None),
+    auth_token: Optional[str] = Cookie(None),
+    sesion: AsyncSession = Depends(obtener_sesion),
+):
+    # Progreso solo al usuario de la cookie (sin sesión, sin avisos)
+    progreso = progreso_por_socket(await usuario_de_cookie(auth_token, sesion, request), subida_id)
+
+    # Sin referencias propias: si ningún mensaje lo usa, la limpieza lo
+    # purga pasada ADJUNTO_HUERFANO_GRACIA (subirlo de nuevo la reinicia)
+    info = await upload_file(request, file, sesion, progreso)
+    await sesion.commit()
+    return info
@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.sesion import obtener_sesion
 from app.db.modelos import Mensaje, Conversacion, MiembroConversacion
 from app.db import crud
+from app.core.autenticacion import verificar_sesion_web
 from app.schemas.mensaje import MensajeCrear, MensajeLeer, MensajeActualizar
 
 router = APIRouter(prefix="/mensajes", tags=["mensajes"])
@@ -28,7 +29,7 @@ async def listar_mensajes_plano(
     token_sesion: str = Query(...),
     sesion: AsyncSession = Depends(obtener_sesion),
 ):
-    s = await crud.validar_sesion_web(sesion, token_sesion)
+    s = await verificar_sesion_web(token_sesion, sesion)
     if not s:
         raise HTTPException(status_code=401, detail="Sesión inválida")
     await _asegurar_miembro(sesion, conversacion_id, s.usuario_id)
@@ -42,7 +43,7 @@ async def crear_mensaje_plano(
     token_sesion: str = Query(...),
     sesion: AsyncSession = Depends(obtener_sesion),
 ):
-    s = await crud.validar_sesion_web(sesion, token_sesion)
+    s = await verificar_sesion_web(token_sesion, sesion)
     if not s:
         raise HTTPException(status_code=401, detail="Sesión inválida")
     await _asegurar_miembro(sesion, conversacion_id, s.usuario_id)
@@ -8,7 +8,8 @@ from app.schemas.usuario import UsuarioLeer
 from typing import Optional
 import jwt
 from app.core.config import config
-from app.realtime import online_users
+from app.core.autenticacion import verificar_token, verificar_sesion_web, invalidar_en_todos
+from app.presencia import presencia, persistencia
 from datetime import datetime
 
 # 🚨 NUEVA IMPORTACIÓN PARA VALIDACIÓN DE TELÉFONO 🚨
@@ -118,7 +119,7 @@ async def confirmar_qr(
 # ---------------------- Sesiones Web ----------------------
 @router.get("/sesion/validar", summary="Validar sesión web activa")
 async def validar_sesion(token_sesion: str = Query(...), sesion: AsyncSession = Depends(obtener_sesion)):
-    s = await crud.validar_sesion_web(sesion, token_sesion)
+    s = await verificar_sesion_web(token_sesion, sesion)
     if not s:
         raise HTTPException(status_code=401, detail="Sesión inválida o expirada")
     return {"valida": True, "usuario_id": str(s.usuario_id)}
@@ -129,6 +130,7 @@ async def cerrar_sesion(token_sesion: str = Body(..., embed=True), sesion: Async
     cerrado = await crud.cerrar_sesion_web(sesion, token_sesion)
     if not cerrado:
         raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    await invalidar_en_todos(cerrado.usuario_id, token_sesion)
     return {"cerrado": True}
 
 
@@ -138,7 +140,7 @@ async def obtener_perfil(
     token_sesion: str = Query(..., description="Token de sesión válido"),
     sesion: AsyncSession = Depends(obtener_sesion)
 ):
-    s = await crud.validar_sesion_web(sesion, token_sesion)
+    s = await verificar_sesion_web(token_sesion, sesion)
     if not s:
         raise HTTPException(status_code=401, detail="Sesión inválida o expirada")
     usuario = await crud.obtener_usuario_por_id(sesion, s.usuario_id)
@@ -170,21 +172,8 @@ async def validar_sesion_header(
     if not token:
         raise HTTPException(status_code=401, detail="Falta token de autenticación")
 
-    # 4️⃣ Decodificar JWT
-    try:
-        payload = jwt.decode(token, config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Token inválido")
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expirado")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Token inválido")
-
-    # 5️⃣ Confirmar usuario existente
-    usuario = await sesion.get(Usuario, user_id)
-    if not usuario:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    # 4️⃣ Decodificar JWT + confirmar usuario existente (cacheado por token)
+    usuario = await verificar_token(token, sesion)
 
     return {"usuario_id": str(usuario.id)}
 
@@ -198,18 +187,11 @@ async def obtener_estado_usuario(
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    en_linea = bool(usuario.en_linea)
     ultima_conexion = usuario.ultima_conexion
 
-    info = online_users.get(str(usuario.id))
-
-    # 🟢 Si hay SID → está realmente online
-    if info and info.get("sid"):
-        en_linea = True
-    else:
-        # 🔴 OFFLINE → usar solo BD
-        en_linea = False
-        ultima_conexion = usuario.ultima_conexion
+    # 🟢 Algún dispositivo conectado (en cualquier worker) → online
+    # 🔴 Si no → offline con la última conexión de BD
+    en_linea = (await presencia.is_online([usuario.id]))[str(usuario.id)]
 
     return {
         "id": str(usuario.id),
@@ -227,10 +209,10 @@ async def marcar_online_http(
     if not usuario:
       raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    usuario.en_linea = True
-    # guardamos también la última actividad
-    usuario.ultima_conexion = datetime.utcnow()
-    await sesion.commit()
+    # guardamos también la última actividad (escritura diferida, en lote);
+    # la marca con TTL evita que el barrido de caídos lo pase a offline
+    await presencia.marcar_http(usuario.id)
+    persistencia.anotar(usuario.id, en_linea=True, ultima_conexion=datetime.utcnow())
     return {"ok": True}
 
 
@@ -243,8 +225,7 @@ async def marcar_offline_http(
     if not usuario:
       raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
-    usuario.en_linea = False
-    # esta será la "última vez" que verás en el chat
-    usuario.ultima_conexion = datetime.utcnow()
-    await sesion.commit()
+    # esta será la "última vez" que verás en el chat (escritura diferida)
+    await presencia.marcar_http(usuario.id, activo=False)
+    persistencia.anotar(usuario.id, en_linea=False, ultima_conexion=datetime.utcnow())
     return {"ok": True}
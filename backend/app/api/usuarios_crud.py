@@ -4,6 +4,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from app.db.sesion import obtener_sesion
 from app.db import crud
+from app.core.autenticacion import invalidar_en_todos
 from app.schemas.usuario import UsuarioLeer, UsuarioActualizar, UsuarioBase
 
 router = APIRouter(prefix="/usuarios", tags=["Usuarios"])
@@ -52,4 +53,5 @@ async def eliminar_usuario(usuario_id: str, db: AsyncSession = Depends(obtener_s
     eliminado = await crud.eliminar_usuario(db, usuario_id)
     if not eliminado:
         raise HTTPException(status_code=404, detail="Usuario no encontrado.")
+    await invalidar_en_todos(usuario_id)
     return None
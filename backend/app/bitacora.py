@@ -0,0 +1,180 @@
+# app/bitacora.py
+"""
+Bitácora de eventos por room para reenviar lo perdido al reconectar.
+
+- El despachador del outbox anota cada evento publicado (eid = orden de
+  publicación, eventos_outbox.eid) en un anillo acotado por room.
+- Con REDIS_URL: un ZSET por room (score = eid), compartido entre workers.
+  Sin Redis: el mismo anillo en memoria (válido para un solo proceso).
+- Cada anillo guarda su "piso": el eid a partir del cual está completo.
+  Si un anillo no puede garantizar el tramo pedido se consulta
+  eventos_outbox (retención 24 h); si tampoco alcanza → resincronizar.
+"""
+import json
+from collections import OrderedDict, deque
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+
+from app.core.config import config
+from app.db.modelos import EventoOutbox
+from app.db.sesion import SessionLocal
+
+BITACORA_MAX_POR_ROOM = 200
+BITACORA_TTL_SEG = 24 * 3600
+BITACORA_MAX_ROOMS = 20000
+REENVIO_MAX = 500
+_PREFIJO = "bitacora:r:"
+_PREFIJO_PISO = "bitacora:piso:"
+
+
+def _completo(piso, total: int, primero, desde_eid: int) -> bool:
+    """
+    El anillo cubre todo lo posterior a desde_eid si nació antes
+    (piso <= desde_eid) y, cuando está lleno y ya descartó eventos,
+    si lo descartado es anterior a desde_eid.
+    """
+    if piso is None or desde_eid < piso:
+        return False
+    return total < BITACORA_MAX_POR_ROOM or desde_eid >= primero - 1
+
+
+class _BitacoraMemoria:
+    def __init__(self):
+        # { room: (piso, deque[(eid, evento, payload)]) }
+        self._rooms: "OrderedDict[str, tuple[int, deque]]" = OrderedDict()
+
+    async def anotar(self, por_room: dict):
+        for room, eventos in por_room.items():
+            if room not in self._rooms:
+                self._rooms[room] = (eventos[0][0] - 1, deque(maxlen=BITACORA_MAX_POR_ROOM))
+            self._rooms[room][1].extend(eventos)
+            self._rooms.move_to_end(room)
+
+        while len(self._rooms) > BITACORA_MAX_ROOMS:
+            self._rooms.popitem(last=False)
+
+    async def descartar(self, rooms: Iterable[str]):
+        for room in rooms:
+            self._rooms.pop(room, None)
+
+    async def desde(self, rooms: Iterable[str], desde_eid: int) -> Optional[list]:
+        encontrados = []
+        for room in rooms:
+            piso, eventos = self._rooms.get(room, (None, ()))
+            primero = eventos[0][0] if eventos else None
+            if not _completo(piso, len(eventos), primero, desde_eid):
+                return None
+            encontrados.extend(ev for ev in eventos if ev[0] > desde_eid)
+        return encontrados
+
+
+class _BitacoraRedis:
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+        self._redis = aioredis.from_url(url, decode_responses=True)
+
+    async def anotar(self, por_room: dict):
+        pipe = self._redis.pipeline(transaction=False)
+        for room, eventos in por_room.items():
+            clave, clave_piso = _PREFIJO + room, _PREFIJO_PISO + room
+            pipe.set(clave_piso, eventos[0][0] - 1, nx=True)
+            pipe.zadd(clave, {json.dumps(ev): ev[0] for ev in eventos})
+            pipe.zremrangebyrank(clave, 0, -(BITACORA_MAX_POR_ROOM + 1))
+            pipe.expire(clave, BITACORA_TTL_SEG)
+            pipe.expire(clave_piso, BITACORA_TTL_SEG)
+        await pipe.execute()
+
+    async def descartar(self, rooms: Iterable[str]):
+        claves = [p + r for r in rooms for p in (_PREFIJO, _PREFIJO_PISO)]
+        if claves:
+            await self._redis.delete(*claves)
+
+    async def desde(self, rooms: Iterable[str], desde_eid: int) -> Optional[list]:
+        rooms = list(rooms)
+        pipe = self._redis.pipeline(transaction=False)
+        for room in rooms:
+            clave = _PREFIJO + room
+            pipe.get(_PREFIJO_PISO + room)
+            pipe.zcard(clave)
+            pipe.zrange(clave, 0, 0, withscores=True)
+            pipe.zrangebyscore(clave, f"({desde_eid}", "+inf")
+        r = await pipe.execute()
+
+        encontrados = []
+        for i in range(len(rooms)):
+            piso, total, primero, eventos = r[4 * i:4 * i + 4]
+            piso = int(piso) if piso is not None else None
+            primero = int(primero[0][1]) if primero else None
+            if not _completo(piso, total, primero, desde_eid):
+                return None
+            encontrados.extend(tuple(json.loads(ev)) for ev in eventos)
+        return encontrados
+
+
+class BitacoraEventos:
+    """Fachada: anillo por room (Redis o memoria) + respaldo en eventos_outbox."""
+
+    def __init__(self):
+        self._almacen = _BitacoraRedis(config.REDIS_URL) if config.REDIS_URL else _BitacoraMemoria()
+
+    async def anotar(self, publicados: Iterable[tuple]):
+        """publicados = [(eid, evento, payload, rooms)] en orden de eid."""
+        por_room: dict = {}
+        for eid, evento, payload, rooms in publicados:
+            for room in rooms:
+                por_room.setdefault(room, []).append((eid, evento, payload))
+        if not por_room:
+            return
+
+        try:
+            await self._almacen.anotar(por_room)
+        except Exception:
+            # Un anillo con huecos no debe parecer completo: fuera
+            await self._almacen.descartar(por_room.keys())
+            raise
+
+    async def perdidos(self, rooms: Iterable[str], desde_eid: int) -> Optional[list]:
+        """
+        Eventos con eid > desde_eid dirigidos a alguna de las rooms, en
+        orden y sin repetir. None = el hueco es demasiado grande
+        (o ya se purgó): el cliente debe resincronizar.
+        """
+        rooms = list(dict.fromkeys(rooms))
+        try:
+            eventos = await self._almacen.desde(rooms, desde_eid)
+        except Exception:
+            eventos = None
+
+        if eventos is None:
+            eventos = await self._perdidos_en_bd(rooms, desde_eid)
+            if eventos is None:
+                return None
+
+        unicos = sorted({ev[0]: ev for ev in eventos}.values(), key=lambda ev: ev[0])
+        return unicos if len(unicos) <= REENVIO_MAX else None
+
+    async def _perdidos_en_bd(self, rooms: list, desde_eid: int) -> Optional[list]:
+        async with SessionLocal() as db:
+            minimo = (await db.execute(select(func.min(EventoOutbox.eid)))).scalar()
+            if minimo is not None and desde_eid + 1 < minimo:
+                return None
+
+            q = await db.execute(
+                select(EventoOutbox.eid, EventoOutbox.evento, EventoOutbox.payload)
+                .where(
+                    EventoOutbox.eid > desde_eid,
+                    EventoOutbox.rooms.overlap(rooms),
+                )
+                .order_by(EventoOutbox.eid.asc())
+                .limit(REENVIO_MAX + 1)
+            )
+            return [(eid, evento, con_eid(payload, eid)) for eid, evento, payload in q.all()]
+
+
+def con_eid(payload, eid: int):
+    """El payload tal como sale por el socket (con su eid)."""
+    return {**payload, "eid": eid} if isinstance(payload, dict) else payload
+
+
+bitacora = BitacoraEventos()
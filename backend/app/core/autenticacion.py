@@ -0,0 +1,177 @@
+# app/core/autenticacion.py
+"""
+Verificación de JWT compartida (cookie auth_token / Authorization: Bearer)
+y de tokens de sesión web (sesiones_web.token_sesion).
+
+- Firma + expiración se validan una vez por token; el usuario verificado
+  (id, teléfono) queda en una caché LRU + TTL, así las peticiones
+  siguientes con el mismo token no leen usuarios.
+- La entrada nunca vive más que el propio JWT (exp).
+- Tokens de sesión web: misma idea (usuario_id, expiración), sin tocar
+  sesiones_web mientras la entrada viva; los tokens desconocidos también
+  se recuerdan un rato (caché negativa) para no consultar en cada intento.
+- Se invalida al eliminar el usuario o cerrar su sesión, en todos los
+  workers (canal "auth:invalidar", ver app/invalidacion.py).
+"""
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+import jwt
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import config
+from app.db import crud
+from app.db.modelos import Usuario
+from app.invalidacion import CanalInvalidacion
+
+logger = logging.getLogger("app.autenticacion")
+
+CACHE_TTL_SEG = 60
+CACHE_MAX_TOKENS = 10000
+SESION_TTL_SEG = 300
+SESION_NEGATIVA_TTL_SEG = 30
+CACHE_MAX_SESIONES = 10000
+
+
+@dataclass(frozen=True)
+class UsuarioVerificado:
+    """Lo que los endpoints usan del usuario autenticado."""
+    id: uuid.UUID
+    telefono: str
+
+
+@dataclass(frozen=True)
+class SesionVerificada:
+    """Lo que los endpoints usan de una sesión web activa."""
+    usuario_id: uuid.UUID
+    fecha_expiracion: Optional[datetime]
+
+
+# { token: (expira_en, UsuarioVerificado) }
+_cache_tokens: "OrderedDict[str, tuple[float, UsuarioVerificado]]" = OrderedDict()
+# { token_sesion: (expira_en, SesionVerificada | None) }  None = no existe / inactiva
+_cache_sesiones: "OrderedDict[str, tuple[float, Optional[SesionVerificada]]]" = OrderedDict()
+
+
+def invalidar_token(token: Optional[str]) -> None:
+    if token:
+        _cache_tokens.pop(token, None)
+
+
+def invalidar_usuario(usuario_id) -> None:
+    """Olvida todos los tokens (JWT y de sesión web) cacheados de un usuario."""
+    uid = str(usuario_id)
+    for token in [t for t, (_, u) in _cache_tokens.items() if str(u.id) == uid]:
+        del _cache_tokens[token]
+    for token in [t for t, (_, s) in _cache_sesiones.items() if s and str(s.usuario_id) == uid]:
+        del _cache_sesiones[token]
+
+
+def _aplicar_invalidacion(claves: list) -> None:
+    """claves: "u:<usuario_id>" (todos sus tokens) o "s:<token_sesion>"."""
+    for clave in claves:
+        tipo, _, valor = clave.partition(":")
+        if tipo == "u":
+            invalidar_usuario(valor)
+        elif tipo == "s":
+            _cache_sesiones.pop(valor, None)
+
+
+def _vaciar_caches() -> None:
+    _cache_sesiones.clear()
+    _cache_tokens.clear()
+
+
+canal_auth = CanalInvalidacion("auth:invalidar", _aplicar_invalidacion, _vaciar_caches)
+
+
+async def invalidar_en_todos(usuario_id=None, token_sesion: Optional[str] = None) -> None:
+    """
+    Invalida aquí y anuncia a los demás workers (si hay Redis).
+    Si el anuncio falla, los otros workers lo ven al vencer su TTL.
+    """
+    claves = []
+    if usuario_id:
+        claves.append(f"u:{usuario_id}")
+    if token_sesion:
+        claves.append(f"s:{token_sesion}")
+    await canal_auth.anunciar(claves)
+
+
+def _guardar_sesion(token_sesion: str, expira: float, valor: Optional[SesionVerificada]):
+    _cache_sesiones[token_sesion] = (expira, valor)
+    _cache_sesiones.move_to_end(token_sesion)
+    while len(_cache_sesiones) > CACHE_MAX_SESIONES:
+        _cache_sesiones.popitem(last=False)
+
+
+async def verificar_sesion_web(token_sesion: Optional[str], sesion: AsyncSession) -> Optional[SesionVerificada]:
+    """token_sesion → sesión activa, o None (inexistente, cerrada o expirada)."""
+    if not token_sesion:
+        return None
+
+    ahora = time.time()
+    entrada = _cache_sesiones.get(token_sesion)
+    if entrada and entrada[0] > ahora:
+        _cache_sesiones.move_to_end(token_sesion)
+        return entrada[1]
+
+    ses = await crud.validar_sesion_web(sesion, token_sesion)
+    if not ses:
+        _guardar_sesion(token_sesion, ahora + SESION_NEGATIVA_TTL_SEG, None)
+        return None
+
+    verificada = SesionVerificada(usuario_id=ses.usuario_id, fecha_expiracion=ses.fecha_expiracion)
+
+    # Nunca más allá de la expiración de la sesión (UTC sin zona en BD)
+    expira = ahora + SESION_TTL_SEG
+    if ses.fecha_expiracion:
+        expira = min(expira, ses.fecha_expiracion.replace(tzinfo=timezone.utc).timestamp())
+    _guardar_sesion(token_sesion, expira, verificada)
+
+    return verificada
+
+
+async def verificar_token(token: Optional[str], sesion: AsyncSession) -> UsuarioVerificado:
+    """JWT → usuario existente, o HTTPException 401 / 404."""
+    if not token:
+        raise HTTPException(status_code=401, detail="No autenticado (falta token)")
+
+    ahora = time.time()
+    entrada = _cache_tokens.get(token)
+    if entrada and entrada[0] > ahora:
+        _cache_tokens.move_to_end(token)
+        return entrada[1]
+
+    try:
+        payload = jwt.decode(token, config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expirado")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Token inválido")
+
+    user_id = payload.get("sub")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Token inválido (sin sub)")
+
+    usuario = await sesion.get(Usuario, user_id)
+    if not usuario:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    verificado = UsuarioVerificado(id=usuario.id, telefono=usuario.telefono)
+
+    expira = ahora + CACHE_TTL_SEG
+    if payload.get("exp"):
+        expira = min(expira, float(payload["exp"]))
+    _cache_tokens[token] = (expira, verificado)
+    _cache_tokens.move_to_end(token)
+    while len(_cache_tokens) > CACHE_MAX_TOKENS:
+        _cache_tokens.popitem(last=False)
+
+    return verificado
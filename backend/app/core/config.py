@@ -43,6 +43,10 @@ class Config:
     ALEMBIC_URL = os.getenv("ALEMBIC_URL", DATABASE_URL)
     REDIS_URL = os.getenv("REDIS_URL", "")
 
+    # Socket.IO entre workers: "redis" | "memoria" (vacío = redis si hay REDIS_URL)
+    SOCKETIO_MANAGER = os.getenv("SOCKETIO_MANAGER", "")
+    SOCKETIO_CANAL = os.getenv("SOCKETIO_CANAL", "biscochat-socketio")
+
     # Servicios externos
     NODE_SERVICE_URL = os.getenv("NODE_SERVICE_URL", "http://whatsapp:3001")
 
@@ -61,6 +65,13 @@ class Config:
     EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "fwmzjqchyduryztt")  # App Password Gmail sin espacios
     SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
     SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+    # "starttls" | "ssl" | "none" (vacío = según el puerto: 465 → ssl)
+    SMTP_TLS = os.getenv("SMTP_TLS", "")
+
+    # ================================
+    # Archivos adjuntos
+    # ================================
+    MAX_SUBIDA_MB = int(os.getenv("MAX_SUBIDA_MB", 100))
 
 
 # Instancia única de configuración
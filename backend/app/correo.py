@@ -0,0 +1,178 @@
+# app/correo.py
+"""
+Envío de correos (códigos 2FA) en segundo plano con aiosmtplib.
+
+- El handler solo encola: la respuesta HTTP no espera al servidor SMTP.
+- La cola es acotada (CORREO_COLA_MAX); si se llena, encolar() devuelve
+  False y el endpoint responde 503 en lugar de acumular sin límite.
+- CORREO_CONEXIONES trabajadores, cada uno con UNA conexión SMTP
+  autenticada que se reutiliza entre envíos y se cierra tras
+  CORREO_INACTIVO_SEG sin uso.
+- Reintentos con backoff exponencial (+ jitter); si la conexión se cae
+  se reabre. Un destinatario rechazado no se reintenta.
+- SMTP_TLS: "starttls" | "ssl" | "none" (vacío = según el puerto).
+  Para probar contra un sumidero local:
+      python -m aiosmtpd -n -l localhost:1025
+      SMTP_HOST=localhost SMTP_PORT=1025 SMTP_TLS=none (sin EMAIL_PASSWORD)
+"""
+import asyncio
+import logging
+import random
+from email.message import EmailMessage
+from typing import Optional
+
+import aiosmtplib
+
+from app.core.config import config
+
+logger = logging.getLogger("app.correo")
+
+CORREO_COLA_MAX = 500
+CORREO_CONEXIONES = 2
+CORREO_REINTENTOS = 4
+CORREO_BACKOFF_SEG = 1.0
+CORREO_BACKOFF_MAX_SEG = 30.0
+CORREO_INACTIVO_SEG = 60
+CORREO_TIMEOUT_SEG = 15
+CORREO_CIERRE_SEG = 10
+
+
+def _modo_tls() -> str:
+    modo = (config.SMTP_TLS or "").lower()
+    if modo in ("starttls", "ssl", "none"):
+        return modo
+    return "ssl" if config.SMTP_PORT == 465 else "starttls"
+
+
+class _ConexionSMTP:
+    """Una conexión autenticada, abierta a demanda y reutilizada."""
+
+    def __init__(self):
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+
+    async def _abrir(self) -> aiosmtplib.SMTP:
+        modo = _modo_tls()
+        smtp = aiosmtplib.SMTP(
+            hostname=config.SMTP_HOST,
+            port=config.SMTP_PORT,
+            use_tls=modo == "ssl",
+            start_tls=modo == "starttls",
+            timeout=CORREO_TIMEOUT_SEG,
+        )
+        await smtp.connect()
+        if config.EMAIL_PASSWORD:
+            await smtp.login(config.EMAIL_FROM, config.EMAIL_PASSWORD)
+        return smtp
+
+    async def enviar(self, msg: EmailMessage):
+        if self._smtp is None or not self._smtp.is_connected:
+            self._smtp = await self._abrir()
+        await self._smtp.send_message(msg)
+
+    async def cerrar(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except aiosmtplib.SMTPException:
+            smtp.close()
+
+    def descartar(self):
+        """Tras un error la conexión queda en estado dudoso: fuera."""
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            smtp.close()
+
+
+class ColaCorreo:
+    def __init__(self):
+        self._cola: Optional[asyncio.Queue] = None
+        self._trabajadores: list = []
+
+    def iniciar(self):
+        """Arranca los trabajadores (en el startup de la app)."""
+        if self._trabajadores:
+            return
+        self._cola = asyncio.Queue(maxsize=CORREO_COLA_MAX)
+        self._trabajadores = [
+            asyncio.create_task(self._trabajador(i)) for i in range(CORREO_CONEXIONES)
+        ]
+
+    def encolar(self, destino: str, asunto: str, cuerpo: str) -> bool:
+        """True si quedó en cola; False si la cola está llena o apagada."""
+        if self._cola is None:
+            return False
+
+        msg = EmailMessage()
+        msg["Subject"] = asunto
+        msg["From"] = config.EMAIL_FROM
+        msg["To"] = destino
+        msg.set_content(cuerpo)
+
+        try:
+            self._cola.put_nowait(msg)
+        except asyncio.QueueFull:
+            logger.warning("📭 Cola de correo llena (%d): %s descartado", CORREO_COLA_MAX, destino)
+            return False
+        return True
+
+    async def _entregar(self, conexion: _ConexionSMTP, msg: EmailMessage):
+        for intento in range(1, CORREO_REINTENTOS + 1):
+            try:
+                await conexion.enviar(msg)
+                logger.info("📨 Correo enviado a %s", msg["To"])
+                return
+            except aiosmtplib.SMTPRecipientsRefused as e:
+                logger.error("⚠️ Destinatario rechazado %s: %s", msg["To"], e)
+                return
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                conexion.descartar()
+                if intento == CORREO_REINTENTOS:
+                    logger.error("⚠️ Correo a %s descartado tras %d intentos: %s", msg["To"], intento, e)
+                    return
+                espera = min(CORREO_BACKOFF_SEG * 2 ** (intento - 1), CORREO_BACKOFF_MAX_SEG)
+                espera *= random.uniform(0.8, 1.2)
+                logger.warning("⚠️ Envío a %s falló (intento %d): %s; reintento en %.1f s", msg["To"], intento, e, espera)
+                await asyncio.sleep(espera)
+
+    async def _trabajador(self, n: int):
+        conexion = _ConexionSMTP()
+        try:
+            while True:
+                try:
+                    msg = await asyncio.wait_for(self._cola.get(), timeout=CORREO_INACTIVO_SEG)
+                except asyncio.TimeoutError:
+                    # inactiva: no mantenerla abierta (un QUIT fallido no tumba al trabajador)
+                    try:
+                        await conexion.cerrar()
+                    except Exception as e:
+                        logger.warning("⚠️ Cierre de conexión SMTP inactiva fallido (%d): %s", n, e)
+                        conexion.descartar()
+                    continue
+                try:
+                    await self._entregar(conexion, msg)
+                except Exception as e:
+                    logger.error("⚠️ Error inesperado en el trabajador de correo %d: %s", n, e)
+                    conexion.descartar()
+                finally:
+                    self._cola.task_done()
+        finally:
+            await conexion.cerrar()
+
+    async def cerrar(self):
+        """Al apagar: espera lo pendiente (hasta CORREO_CIERRE_SEG) y cierra."""
+        if not self._trabajadores:
+            return
+        try:
+            await asyncio.wait_for(self._cola.join(), timeout=CORREO_CIERRE_SEG)
+        except asyncio.TimeoutError:
+            logger.warning("📭 %d correos sin enviar al apagar", self._cola.qsize())
+        for t in self._trabajadores:
+            t.cancel()
+        await asyncio.gather(*self._trabajadores, return_exceptions=True)
+        self._trabajadores = []
+        self._cola = None
+
+
+cola_correo = ColaCorreo()
@@ -5,8 +5,10 @@ from datetime import datetime, timedelta
 from random import randint
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, func
+from sqlalchemy import select, delete, update, func, case, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
 from fastapi import HTTPException
 
 from ..db.modelos import (
@@ -23,6 +25,8 @@ from ..db.modelos import (
     MensajeOculto,
     Llamada,
     ParticipanteLlamada,
+    ResumenConversacion,
+    Adjunto,
 )
 
 # =========================================
@@ -151,6 +155,7 @@ async def agregar_miembro_conversacion(db: AsyncSession, conversacion_id: str, u
             existente.activo = True
             existente.fecha_salida = None
             await db.flush()
+        await resumen_asegurar_miembros(db, conversacion_id, [usuario_id])
         return existente
 
     miembro = MiembroConversacion(
@@ -162,44 +167,31 @@ async def agregar_miembro_conversacion(db: AsyncSession, conversacion_id: str, u
     db.add(miembro)
     await db.flush()
     await db.refresh(miembro)
+    await resumen_asegurar_miembros(db, conversacion_id, [usuario_id])
     return miembro
 
 
-# === MÉTODO FINAL CORREGIDO ===
-async def obtener_conversacion_entre(db: AsyncSession, u1: str, u2: str):
-    u1, u2 = str(u1), str(u2)
-
-    q_conv = await db.execute(
-        select(Conversacion.id)
-        .where(Conversacion.es_grupo == False)
-    )
-    ids = q_conv.scalars().all()
-
-    for cid in ids:
-        q = await db.execute(
-            select(MiembroConversacion.usuario_id, MiembroConversacion.activo)
-            .where(MiembroConversacion.conversacion_id == cid)
-        )
-        rows = q.all()
-
-        if len(rows) != 2:
-            continue
+def clave_par_directo(u1, u2) -> str:
+    """Clave canónica de un chat 1 a 1 (independiente del orden)."""
+    a, b = sorted((str(u1), str(u2)))
+    return f"{a}:{b}"
 
-        if not all(r[1] for r in rows):
-            continue
 
-        if {r[0] for r in rows} == {u1, u2}:
-            return await db.get(Conversacion, cid)
-
-    return None
+async def obtener_conversacion_entre(db: AsyncSession, u1: str, u2: str):
+    q = await db.execute(
+        select(Conversacion).where(Conversacion.par_directo == clave_par_directo(u1, u2))
+    )
+    return q.scalar_one_or_none()
 
 
-async def crear_conversacion(db: AsyncSession, titulo: str | None, creador_id: str, es_grupo=False):
+async def crear_conversacion(db: AsyncSession, titulo: str | None, creador_id: str, es_grupo=False,
+                             par_directo: str | None = None):
     conv = Conversacion(
         id=str(uuid.uuid4()),
         titulo=titulo,
         es_grupo=es_grupo,
-        creador_id=str(creador_id)
+        creador_id=str(creador_id),
+        par_directo=par_directo,
     )
     db.add(conv)
     await db.flush()
@@ -211,17 +203,48 @@ async def crear_conversacion(db: AsyncSession, titulo: str | None, creador_id: s
     )
     db.add(miembro)
     await db.flush()
+    await resumen_asegurar_miembros(db, conv.id, [creador_id])
 
     await db.refresh(conv)
     return conv
 
 
+async def obtener_o_crear_conversacion_directa(db: AsyncSession, creador_id: str, otro_id: str,
+                                              titulo: str | None):
+    """
+    Devuelve (conversación, creada). La unicidad de par_directo deduplica
+    creaciones concurrentes: quien pierde la carrera reusa la del otro.
+    """
+    existente = await obtener_conversacion_entre(db, creador_id, otro_id)
+    if existente:
+        return existente, False
+
+    try:
+        async with db.begin_nested():
+            conv = await crear_conversacion(
+                db,
+                titulo=titulo,
+                creador_id=creador_id,
+                es_grupo=False,
+                par_directo=clave_par_directo(creador_id, otro_id),
+            )
+            await agregar_miembro_conversacion(db, conv.id, otro_id)
+    except IntegrityError:
+        existente = await obtener_conversacion_entre(db, creador_id, otro_id)
+        if not existente:
+            raise
+        return existente, False
+
+    return conv, True
+
+
 # =========================================
 # ✉️ MENSAJES CRUD
 # =========================================
 async def enviar_mensaje(db: AsyncSession, conversacion_id, remitente_id, cuerpo,
                          url_adjunto=None, tipo_adjunto=None,
-                         mensaje_id_respuesta=None, mencionados_ids=None):
+                         mensaje_id_respuesta=None, mencionados_ids=None,
+                         cliente_id=None):
 
     q = await db.execute(
         select(MiembroConversacion).where(
@@ -239,7 +262,8 @@ async def enviar_mensaje(db: AsyncSession, conversacion_id, remitente_id, cuerpo
         cuerpo=cuerpo,
         url_adjunto=url_adjunto,
         tipo_adjunto=tipo_adjunto,
-        mensaje_id_respuesta=mensaje_id_respuesta
+        mensaje_id_respuesta=mensaje_id_respuesta,
+        cliente_id=cliente_id
     )
     db.add(msg)
     await db.flush()
@@ -261,6 +285,402 @@ async def obtener_mensajes_conversacion(db: AsyncSession, conversacion_id):
     return q.scalars().all()
 
 
+# =========================================
+# 🧾 RECIBOS (marcas de agua por miembro)
+# =========================================
+# Cada miembro guarda hasta qué Mensaje.seq tiene los mensajes entregados y
+# leídos. Los ✓ / ✓✓ y los no leídos se derivan comparando esas marcas con
+# Mensaje.seq: una fila por miembro en vez de una por mensaje y miembro.
+def _es_destinatario():
+    """El mensaje es de otro usuario y cae dentro de la membresía del miembro."""
+    return and_(
+        Mensaje.remitente_id.isnot(None),
+        Mensaje.remitente_id != MiembroConversacion.usuario_id,
+        or_(
+            MiembroConversacion.creado_en.is_(None),
+            Mensaje.creado_en >= MiembroConversacion.creado_en,
+        ),
+        or_(
+            MiembroConversacion.fecha_salida.is_(None),
+            Mensaje.creado_en <= MiembroConversacion.fecha_salida,
+        ),
+    )
+
+
+def _estado_recibo_sql():
+    return case(
+        (MiembroConversacion.leido_hasta >= Mensaje.seq, "leido"),
+        (MiembroConversacion.entregado_hasta >= Mensaje.seq, "entregado"),
+        else_="pendiente",
+    )
+
+
+def _no_leido_sql():
+    """Mensaje pendiente de leer para el miembro (sin filtrar ocultos)."""
+    return and_(
+        _es_destinatario(),
+        or_(
+            MiembroConversacion.leido_hasta.is_(None),
+            Mensaje.seq > MiembroConversacion.leido_hasta,
+        ),
+    )
+
+
+async def recibos_avanzar(db: AsyncSession, conversacion_id, usuarios_ids, mensaje_id=None, leido=False):
+    """
+    Sube la marca de entregado (y la de leído si `leido`) de esos miembros
+    hasta el mensaje indicado, o hasta el último de la conversación.
+    Las marcas nunca retroceden.
+
+    Devuelve los avances reales: [{usuario_id, estado, desde, hasta}]
+    con desde / hasta como seq (si avanza el leído no se repite el entregado).
+    """
+    usuarios_ids = [str(u) for u in usuarios_ids]
+    if not usuarios_ids:
+        return []
+
+    if mensaje_id is not None:
+        hasta = select(Mensaje.seq).where(Mensaje.id == str(mensaje_id))
+    else:
+        hasta = select(func.max(Mensaje.seq)).where(
+            Mensaje.conversacion_id == str(conversacion_id)
+        )
+    hasta = hasta.scalar_subquery()
+
+    def _mueve(marca):
+        return or_(marca.is_(None), marca < hasta)
+
+    # greatest() ignora NULL: una marca vacía toma directamente `hasta`
+    valores = {
+        "entregado_hasta": func.greatest(MiembroConversacion.entregado_hasta, hasta),
+        "recibos_actualizados_en": datetime.utcnow(),
+    }
+    mueve = _mueve(MiembroConversacion.entregado_hasta)
+    if leido:
+        valores["leido_hasta"] = func.greatest(MiembroConversacion.leido_hasta, hasta)
+        mueve = or_(mueve, _mueve(MiembroConversacion.leido_hasta))
+
+    # Autojoin para devolver también las marcas anteriores
+    antes = aliased(MiembroConversacion)
+    res = await db.execute(
+        update(MiembroConversacion)
+        .where(
+            MiembroConversacion.id == antes.id,
+            MiembroConversacion.conversacion_id == str(conversacion_id),
+            MiembroConversacion.usuario_id.in_(usuarios_ids),
+            mueve,
+        )
+        .values(**valores)
+        .returning(
+            MiembroConversacion.usuario_id,
+            antes.entregado_hasta,
+            antes.leido_hasta,
+            MiembroConversacion.entregado_hasta,
+            MiembroConversacion.leido_hasta,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    avances = []
+    for uid, entregado_antes, leido_antes, entregado, leido_ahora in res.all():
+        if leido and leido_ahora and (leido_antes is None or leido_ahora > leido_antes):
+            avances.append({"usuario_id": uid, "estado": "leido", "desde": leido_antes, "hasta": leido_ahora})
+        elif entregado and (entregado_antes is None or entregado > entregado_antes):
+            avances.append({"usuario_id": uid, "estado": "entregado", "desde": entregado_antes, "hasta": entregado})
+    return avances
+
+
+async def recibos_avisos(db: AsyncSession, conversacion_id, avances):
+    """
+    Agrupa los avances por remitente para notificarle:
+    { remitente_id: [{usuario_id, estado, hasta, mensaje_ids}] }
+    """
+    avisos = {}
+    for a in avances:
+        q = (
+            select(Mensaje.id, Mensaje.remitente_id)
+            .join(
+                MiembroConversacion,
+                (MiembroConversacion.conversacion_id == Mensaje.conversacion_id)
+                & (MiembroConversacion.usuario_id == a["usuario_id"])
+            )
+            .where(
+                Mensaje.conversacion_id == str(conversacion_id),
+                Mensaje.seq <= a["hasta"],
+                _es_destinatario(),
+            )
+        )
+        if a["desde"] is not None:
+            q = q.where(Mensaje.seq > a["desde"])
+
+        por_remitente = {}
+        for mid, remitente_id in (await db.execute(q)).all():
+            por_remitente.setdefault(str(remitente_id), []).append(str(mid))
+
+        for remitente_id, mensaje_ids in por_remitente.items():
+            avisos.setdefault(remitente_id, []).append({
+                "usuario_id": str(a["usuario_id"]),
+                "estado": a["estado"],
+                "hasta": a["hasta"],
+                "mensaje_ids": mensaje_ids,
+            })
+    return avisos
+
+
+async def recibos_estados(db: AsyncSession, conversacion_id=None, mensaje_id=None, remitente_id=None, cambiados_desde=None):
+    """
+    Estados derivados (mensaje, destinatario). Filas con:
+    mensaje_id, usuario_id, estado, miembro_id, marca (instante del estado:
+    el último movimiento de las marcas del miembro, o creado_en si pendiente).
+
+    `cambiados_desde`: solo destinatarios cuyas marcas se movieron después
+    de ese instante, y solo mensajes ya entregados / leídos (delta).
+    """
+    estado = _estado_recibo_sql()
+    marca = case(
+        (estado == "pendiente", Mensaje.creado_en),
+        else_=func.coalesce(MiembroConversacion.recibos_actualizados_en, Mensaje.creado_en),
+    )
+
+    q = (
+        select(
+            Mensaje.id.label("mensaje_id"),
+            MiembroConversacion.usuario_id.label("usuario_id"),
+            estado.label("estado"),
+            MiembroConversacion.id.label("miembro_id"),
+            marca.label("marca"),
+        )
+        .join(MiembroConversacion, MiembroConversacion.conversacion_id == Mensaje.conversacion_id)
+        .where(_es_destinatario())
+    )
+    if conversacion_id is not None:
+        q = q.where(Mensaje.conversacion_id == str(conversacion_id))
+    if mensaje_id is not None:
+        q = q.where(Mensaje.id == str(mensaje_id))
+    if remitente_id is not None:
+        q = q.where(Mensaje.remitente_id == str(remitente_id))
+    if cambiados_desde is not None:
+        q = q.where(
+            MiembroConversacion.recibos_actualizados_en > cambiados_desde,
+            MiembroConversacion.entregado_hasta >= Mensaje.seq,
+        )
+
+    res = await db.execute(q.order_by(Mensaje.creado_en.asc()))
+    return res.all()
+
+
+# =========================================
+# 📋 RESUMEN POR MIEMBRO (sidebar)
+# =========================================
+# Todas estas funciones escriben en la sesión actual: el commit lo hace
+# el endpoint, así el resumen queda en la misma transacción.
+PREVIEW_MAX = 200
+
+
+def _preview_sql(cuerpo, nombre_archivo):
+    """Texto corto del mensaje (archivo → nombre del archivo)."""
+    return func.left(func.coalesce(func.nullif(cuerpo, ""), nombre_archivo, ""), PREVIEW_MAX)
+
+
+async def resumen_asegurar_miembros(db: AsyncSession, conversacion_id, usuarios_ids):
+    """Crea la fila de resumen para cada miembro si aún no existe."""
+    filas = [
+        {"conversacion_id": str(conversacion_id), "usuario_id": str(uid), "no_leidos": 0}
+        for uid in usuarios_ids
+    ]
+    if not filas:
+        return
+
+    stmt = pg_insert(ResumenConversacion).values(filas).on_conflict_do_nothing(
+        index_elements=["conversacion_id", "usuario_id"]
+    )
+    await db.execute(stmt)
+
+
+async def resumen_registrar_mensaje(db: AsyncSession, msg: Mensaje):
+    """
+    Propaga un mensaje nuevo a los resúmenes de los miembros activos.
+    Suma un no leído a quien lo tenga por debajo de su marca de leído.
+    """
+    await db.flush()
+
+    no_leido = _no_leido_sql()
+
+    origen = (
+        select(
+            MiembroConversacion.conversacion_id,
+            MiembroConversacion.usuario_id,
+            Mensaje.id,
+            _preview_sql(Mensaje.cuerpo, Mensaje.nombre_archivo),
+            Mensaje.creado_en,
+            case((no_leido, 1), else_=0),
+            func.coalesce(Mensaje.creado_en, func.now()),
+        )
+        .join(Mensaje, Mensaje.conversacion_id == MiembroConversacion.conversacion_id)
+        .where(
+            Mensaje.id == msg.id,
+            MiembroConversacion.activo.is_(True),
+        )
+    )
+
+    stmt = pg_insert(ResumenConversacion).from_select(
+        [
+            "conversacion_id",
+            "usuario_id",
+            "ultimo_mensaje_id",
+            "ultimo_mensaje_preview",
+            "ultimo_mensaje_en",
+            "no_leidos",
+            "ultima_actividad",
+        ],
+        origen,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["conversacion_id", "usuario_id"],
+        set_={
+            "ultimo_mensaje_id": stmt.excluded.ultimo_mensaje_id,
+            "ultimo_mensaje_preview": stmt.excluded.ultimo_mensaje_preview,
+            "ultimo_mensaje_en": stmt.excluded.ultimo_mensaje_en,
+            "no_leidos": ResumenConversacion.no_leidos + stmt.excluded.no_leidos,
+            "ultima_actividad": stmt.excluded.ultima_actividad,
+        },
+    )
+    await db.execute(stmt)
+
+
+async def resumen_actualizar_preview(db: AsyncSession, mensaje_id, cuerpo: str):
+    """Editar / borrar para todos: refresca el preview donde sea el último mensaje."""
+    await db.execute(
+        update(ResumenConversacion)
+        .where(ResumenConversacion.ultimo_mensaje_id == str(mensaje_id))
+        .values(ultimo_mensaje_preview=(cuerpo or "")[:PREVIEW_MAX])
+    )
+
+
+async def resumen_marcar_leido(db: AsyncSession, conversacion_id, usuario_id):
+    await db.execute(
+        update(ResumenConversacion)
+        .where(
+            ResumenConversacion.conversacion_id == str(conversacion_id),
+            ResumenConversacion.usuario_id == str(usuario_id),
+        )
+        .values(no_leidos=0)
+    )
+
+
+async def resumen_recalcular(db: AsyncSession, conversacion_id, usuario_id):
+    """Recalcula desde cero el resumen de un miembro (p. ej. tras ocultar mensajes)."""
+    await db.flush()
+    conversacion_id, usuario_id = str(conversacion_id), str(usuario_id)
+
+    q_ultimo = await db.execute(
+        select(Mensaje.id, Mensaje.creado_en, _preview_sql(Mensaje.cuerpo, Mensaje.nombre_archivo))
+        .outerjoin(
+            MensajeOculto,
+            (MensajeOculto.mensaje_id == Mensaje.id)
+            & (MensajeOculto.usuario_id == usuario_id)
+        )
+        .where(
+            Mensaje.conversacion_id == conversacion_id,
+            MensajeOculto.mensaje_id.is_(None),
+        )
+        .order_by(Mensaje.creado_en.desc())
+        .limit(1)
+    )
+    ultimo = q_ultimo.first()
+
+    q_no_leidos = await db.execute(
+        select(func.count())
+        .select_from(Mensaje)
+        .join(
+            MiembroConversacion,
+            (MiembroConversacion.conversacion_id == Mensaje.conversacion_id)
+            & (MiembroConversacion.usuario_id == usuario_id)
+        )
+        .outerjoin(
+            MensajeOculto,
+            (MensajeOculto.mensaje_id == Mensaje.id)
+            & (MensajeOculto.usuario_id == usuario_id)
+        )
+        .where(
+            Mensaje.conversacion_id == conversacion_id,
+            MensajeOculto.mensaje_id.is_(None),
+            _no_leido_sql(),
+        )
+    )
+
+    valores = {
+        "ultimo_mensaje_id": ultimo[0] if ultimo else None,
+        "ultimo_mensaje_en": ultimo[1] if ultimo else None,
+        "ultimo_mensaje_preview": ultimo[2] if ultimo else None,
+        "no_leidos": q_no_leidos.scalar_one(),
+    }
+
+    stmt = pg_insert(ResumenConversacion).values(
+        conversacion_id=conversacion_id,
+        usuario_id=usuario_id,
+        ultima_actividad=func.now(),
+        **valores,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["conversacion_id", "usuario_id"],
+        set_=valores,
+    )
+    await db.execute(stmt)
+
+
+async def resumen_eliminar_miembro(db: AsyncSession, conversacion_id, usuario_id):
+    await db.execute(
+        delete(ResumenConversacion).where(
+            ResumenConversacion.conversacion_id == str(conversacion_id),
+            ResumenConversacion.usuario_id == str(usuario_id),
+        )
+    )
+
+
+# =========================================
+# 📎 ADJUNTOS (una copia por contenido)
+# =========================================
+async def adjunto_registrar(db: AsyncSession, sha256: str, tamano: int, mime, ruta: str):
+    """
+    Alta del contenido o toque si ya existía (conserva la primera ruta).
+    Las referencias las lleva el trigger trg_mensajes_referencias_adjunto;
+    el toque (actualizado_en) reinicia la gracia antes de purgarlo.
+    """
+    q = await db.execute(
+        pg_insert(Adjunto)
+        .values(sha256=sha256, tamano=tamano, mime=mime, ruta=ruta, referencias=0)
+        .on_conflict_do_update(
+            index_elements=[Adjunto.sha256],
+            set_={"actualizado_en": func.now()},
+        )
+        .returning(Adjunto)
+    )
+    return q.scalar_one()
+
+
+async def adjunto_accesible(db: AsyncSession, sha256: str, usuario_id):
+    """
+    El adjunto, solo si el usuario ya lo ve en algún mensaje (no borrado)
+    de una conversación de la que es miembro activo; si no, None.
+    """
+    q = await db.execute(
+        select(Adjunto)
+        .join(Mensaje, Mensaje.adjunto_sha256 == Adjunto.sha256)
+        .join(
+            MiembroConversacion,
+            and_(
+                MiembroConversacion.conversacion_id == Mensaje.conversacion_id,
+                MiembroConversacion.usuario_id == usuario_id,
+                MiembroConversacion.activo == True,
+            ),
+        )
+        .where(Adjunto.sha256 == sha256, Mensaje.borrado_en.is_(None))
+        .limit(1)
+    )
+    return q.scalar_one_or_none()
+
+
 # =========================================
 # 🔐 OTP
 # =========================================
@@ -289,6 +709,7 @@ async def verificar_otp(db: AsyncSession, telefono: str, codigo: str):
         select(CodigoOTP)
         .where(CodigoOTP.telefono == telefono, CodigoOTP.usado == False)
         .order_by(CodigoOTP.creado_en.desc())
+        .limit(1)  # ix_otp_telefono_pendiente
     )
     otp = q.scalar_one_or_none()
 
@@ -407,4 +828,4 @@ async def cerrar_sesion_web(db: AsyncSession, token_sesion: str):
 
     ses.activo = False
     await db.commit()
-    return True
+    return ses
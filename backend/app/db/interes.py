@@ -0,0 +1,101 @@
+# app/db/interes.py
+"""
+Índice de interés para la presencia: quién debe enterarse de que un
+usuario se conecta / desconecta.
+
+Interesados en X = miembros activos de alguna conversación activa de X
+                 ∪ usuarios que tienen a X entre sus contactos.
+
+- Una sola query por lote de sujetos (solo los que no están en caché).
+- Caché por sujeto (LRU + TTL); se invalida al cambiar membresías o
+  contactos, en todos los workers (canal "interes:invalidar", ver
+  app/invalidacion.py).
+"""
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+from sqlalchemy import select, union
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.modelos import Contacto, MiembroConversacion
+from app.invalidacion import CanalInvalidacion
+
+CACHE_TTL_SEG = 120
+CACHE_MAX_SUJETOS = 8192
+
+# { sujeto_id: (expira_en, frozenset(interesados)) }
+_cache_interes: "OrderedDict[str, tuple[float, frozenset]]" = OrderedDict()
+
+
+def _olvidar_interes(usuarios_ids: list) -> None:
+    for uid in usuarios_ids:
+        _cache_interes.pop(uid, None)
+
+
+canal_interes = CanalInvalidacion("interes:invalidar", _olvidar_interes, _cache_interes.clear)
+
+
+async def invalidar_interes(usuarios_ids: Iterable) -> None:
+    await canal_interes.anunciar(usuarios_ids)
+
+
+async def invalidar_interes_conversacion(sesion: AsyncSession, conversacion_id) -> None:
+    """Cambió la membresía de una conversación: afecta a todos sus miembros."""
+    q = await sesion.execute(
+        select(MiembroConversacion.usuario_id).where(
+            MiembroConversacion.conversacion_id == str(conversacion_id)
+        )
+    )
+    await invalidar_interes(q.scalars().all())
+
+
+async def interesados_en(sesion: AsyncSession, sujetos_ids: Iterable) -> dict:
+    """{ sujeto_id: frozenset(usuario_id interesados) }"""
+    ahora = time.monotonic()
+    sujetos = list(dict.fromkeys(str(u) for u in sujetos_ids))
+    resultado = {}
+    faltan = []
+
+    for uid in sujetos:
+        entrada = _cache_interes.get(uid)
+        if entrada and entrada[0] > ahora:
+            _cache_interes.move_to_end(uid)
+            resultado[uid] = entrada[1]
+        else:
+            faltan.append(uid)
+
+    if faltan:
+        yo = aliased(MiembroConversacion)
+        otro = aliased(MiembroConversacion)
+
+        por_conversacion = (
+            select(yo.usuario_id.label("sujeto"), otro.usuario_id.label("interesado"))
+            .join(otro, otro.conversacion_id == yo.conversacion_id)
+            .where(
+                yo.usuario_id.in_(faltan),
+                yo.activo.is_(True),
+                otro.activo.is_(True),
+                otro.usuario_id != yo.usuario_id,
+            )
+        )
+        por_contacto = (
+            select(Contacto.contacto_id.label("sujeto"), Contacto.usuario_id.label("interesado"))
+            .where(Contacto.contacto_id.in_(faltan))
+        )
+
+        encontrados = {uid: set() for uid in faltan}
+        for sujeto, interesado in (await sesion.execute(union(por_conversacion, por_contacto))).all():
+            encontrados[str(sujeto)].add(str(interesado))
+
+        expira = ahora + CACHE_TTL_SEG
+        for uid, interesados in encontrados.items():
+            resultado[uid] = frozenset(interesados)
+            _cache_interes[uid] = (expira, resultado[uid])
+            _cache_interes.move_to_end(uid)
+
+        while len(_cache_interes) > CACHE_MAX_SUJETOS:
+            _cache_interes.popitem(last=False)
+
+    return resultado
@@ -3,7 +3,8 @@ from __future__ import annotations
 import datetime
 import uuid
 from sqlalchemy import Integer  
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import BigInteger, FetchedValue, Sequence, text
+from sqlalchemy.dialects.postgresql import UUID, JSONB, ARRAY
 from sqlalchemy import (
     Boolean,
     Column,
@@ -134,12 +135,22 @@ class Conversacion(Base):
     # 👇 NUEVO CAMPO para guardar quién la creó
     creador_id = Column(UUID(as_uuid=True), ForeignKey("usuarios.id"), nullable=False)
 
+    # Chats 1 a 1: "<uuid menor>:<uuid mayor>" (único → un solo chat por pareja)
+    par_directo = Column(String(73), nullable=True)
+
+    # Último mensajes.seq asignado (lo incrementa el trigger trg_mensajes_seq)
+    ultimo_seq = Column(BigInteger, nullable=False, server_default=text("0"))
+
     # Relaciones
     creador = relationship("Usuario", backref="conversaciones_creadas", foreign_keys=[creador_id])
     miembros = relationship("MiembroConversacion", back_populates="conversacion", cascade="all, delete-orphan")
     mensajes = relationship("Mensaje", back_populates="conversacion", cascade="all, delete-orphan")
     llamadas = relationship("Llamada", back_populates="conversacion", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ux_conversaciones_par_directo", "par_directo", unique=True),
+    )
+
 
 
 class MiembroConversacion(Base):
@@ -157,6 +168,15 @@ class MiembroConversacion(Base):
     # 🆕 Fecha exacta cuando salió del grupo (para limitar historial)
     fecha_salida = Column(DateTime, nullable=True)
 
+    # 🧾 Marcas de agua de recibos: todo mensaje con seq <= marca está
+    #    entregado / leído para este miembro (sustituyen a EstadoMensaje).
+    #    Por seq y no por creado_en: dos mensajes del mismo instante no se
+    #    confunden y el orden es el de inserción.
+    entregado_hasta = Column(BigInteger, nullable=True)
+    leido_hasta = Column(BigInteger, nullable=True)
+    # Última vez que se movió alguna marca (para /estados?since=)
+    recibos_actualizados_en = Column(DateTime, nullable=True)
+
     usuario = relationship(
         "Usuario",
         back_populates="miembro_en_conversaciones",
@@ -231,6 +251,17 @@ class Mensaje(Base):
     creado_en = Column(DateTime, default=func.now())
     mensaje_id_respuesta = Column(UUID(as_uuid=True), ForeignKey("mensajes.id"), nullable=True)
 
+    # 🔢 Secuencia por conversación (1, 2, 3… sin huecos). La asigna el
+    # trigger BEFORE INSERT trg_mensajes_seq y vuelve por RETURNING.
+    seq = Column(BigInteger, FetchedValue(), nullable=False)
+
+    # Id generado por el cliente: un reintento con el mismo no duplica
+    cliente_id = Column(UUID(as_uuid=True), nullable=True)
+
+    # Contenido del adjunto (una sola copia por hash); el nombre visible
+    # sigue siendo nombre_archivo, propio de cada mensaje
+    adjunto_sha256 = Column(String(64), ForeignKey("adjuntos.sha256"), nullable=True)
+
     conversacion = relationship("Conversacion", back_populates="mensajes", foreign_keys=[conversacion_id])
     remitente = relationship("Usuario", back_populates="mensajes_enviados", foreign_keys=[remitente_id])
 
@@ -259,6 +290,37 @@ class Mensaje(Base):
 
     __table_args__ = (
         Index('ix_mensajes_conversacion_creado', 'conversacion_id', 'creado_en'),
+        Index('ux_mensajes_conversacion_seq', 'conversacion_id', 'seq', unique=True),
+        Index(
+            'ux_mensajes_remitente_cliente', 'remitente_id', 'cliente_id',
+            unique=True, postgresql_where=text('cliente_id IS NOT NULL')
+        ),
+        Index('ix_mensajes_adjunto_sha256', 'adjunto_sha256'),
+    )
+
+
+class Adjunto(Base):
+    """
+    Archivo guardado UNA vez por contenido (uploads/cas/<sha[:2]>/<sha>.<ext>).
+    referencias = mensajes que lo usan (trigger trg_mensajes_referencias_adjunto);
+    con 0 y sin tocarse en ADJUNTO_HUERFANO_GRACIA lo purga app/limpieza.py
+    (también lo subido por /upload_file que ningún mensaje llegó a usar).
+    """
+    __tablename__ = "adjuntos"
+
+    sha256 = Column(String(64), primary_key=True)
+    tamano = Column(BigInteger, nullable=False)
+    mime = Column(String(127), nullable=True)
+    ruta = Column(String(255), nullable=False)  # relativa a uploads/
+    referencias = Column(Integer, nullable=False, server_default=text("0"))
+    creado_en = Column(DateTime, default=func.now(), nullable=False)
+    actualizado_en = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index(
+            'ix_adjuntos_huerfanos', 'actualizado_en',
+            postgresql_where=text('referencias <= 0')
+        ),
     )
 
 
@@ -294,6 +356,10 @@ class MensajeOculto(Base):
 
 
 class EstadoMensaje(Base):
+    """
+    Histórico: un estado por mensaje y destinatario. Ya no se escribe; los
+    recibos se derivan de MiembroConversacion.entregado_hasta / leido_hasta.
+    """
     __tablename__ = "estados_mensaje"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -320,6 +386,90 @@ class EstadoMensaje(Base):
 
 
 
+# -----------------------------
+# RESUMEN POR MIEMBRO (sidebar /chats)
+# -----------------------------
+class ResumenConversacion(Base):
+    """
+    Modelo de lectura mantenido en la misma transacción que los mensajes:
+    una fila por (conversación, miembro) con el último mensaje visible,
+    los no leídos y la última actividad.
+    """
+    __tablename__ = "resumenes_conversacion"
+
+    conversacion_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("conversaciones.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    usuario_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("usuarios.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+
+    ultimo_mensaje_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("mensajes.id", ondelete="SET NULL"),
+        nullable=True
+    )
+    ultimo_mensaje_preview = Column(String(200), nullable=True)
+    ultimo_mensaje_en = Column(DateTime, nullable=True)
+
+    no_leidos = Column(Integer, default=0, nullable=False)
+    ultima_actividad = Column(DateTime, default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_resumen_usuario_actividad", "usuario_id", "ultima_actividad"),
+    )
+
+
+# -----------------------------
+# OUTBOX DE EVENTOS SOCKET.IO
+# -----------------------------
+class EventoOutbox(Base):
+    """
+    Evento Socket.IO escrito en la misma transacción que el cambio que lo
+    provoca; el despachador (app/outbox.py) lo publica y marca enviado_en.
+    """
+    __tablename__ = "eventos_outbox"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+
+    # Sin FK: el evento puede sobrevivir a la conversación (p. ej. al borrarla)
+    conversacion_id = Column(UUID(as_uuid=True), nullable=True)
+
+    evento = Column(String(64), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    rooms = Column(ARRAY(String(100)), nullable=False)
+
+    creado_en = Column(DateTime, default=func.now(), nullable=False)
+    enviado_en = Column(DateTime, nullable=True)
+
+    # Orden de PUBLICACIÓN (lo asigna el despachador bajo el advisory lock).
+    # id sale al insertar y no sigue el orden de commit: el reenvío usa eid.
+    # Dentro de una misma conversación sí: trg_eventos_outbox_orden pide el
+    # id bajo un lock por conversación que dura hasta el commit.
+    eid = Column(BigInteger, nullable=True)
+
+    # Emits fallidos; al llegar a OUTBOX_MAX_INTENTOS se aparta (fallido_en)
+    # para no bloquear a los siguientes
+    intentos = Column(Integer, nullable=False, server_default=text("0"))
+    fallido_en = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index(
+            "ix_eventos_outbox_pendientes",
+            "id",
+            postgresql_where=text("enviado_en IS NULL"),
+        ),
+        Index("ux_eventos_outbox_eid", "eid", unique=True),
+    )
+
+
+EVENTOS_OUTBOX_EID_SEQ = Sequence("eventos_outbox_eid_seq", metadata=EventoOutbox.metadata)
+
+
 # -----------------------------
 # LLAMADAS
 # -----------------------------
@@ -405,6 +555,12 @@ class CodigoOTP(Base):
 
     __table_args__ = (
         Index('ix_otp_telefono', 'telefono'),
+        # verificar_otp: último código sin usar del teléfono
+        Index(
+            'ix_otp_telefono_pendiente', 'telefono', creado_en.desc(),
+            postgresql_where=text('usado = false')
+        ),
+        Index('ix_otp_expiracion', 'expiracion'),  # limpieza por lotes
     )
 
 
@@ -418,6 +574,10 @@ class SesionQR(Base):
     creado_en = Column(DateTime, default=func.now())
     expiracion = Column(DateTime, nullable=False)  # p. ej. ahora()+2min
 
+    __table_args__ = (
+        Index('ix_sesiones_qr_expiracion', 'expiracion'),
+    )
+
 
 class SesionWeb(Base):
     __tablename__ = "sesiones_web"
@@ -435,4 +595,13 @@ class SesionWeb(Base):
 
     __table_args__ = (
         Index('ix_sesion_web_usuario', 'usuario_id'),
+        # Limpieza por lotes: activas por vencer / inactivas por borrar
+        Index(
+            'ix_sesion_web_expiracion_activa', 'fecha_expiracion',
+            postgresql_where=text('activo')
+        ),
+        Index(
+            'ix_sesion_web_inicio_inactiva', 'fecha_inicio',
+            postgresql_where=text('NOT activo')
+        ),
     )
@@ -0,0 +1,107 @@
+# app/db/nombres.py
+"""
+Nombre visible de un usuario para otro (alias > teléfono), resuelto por lotes.
+
+- Una sola query por lote: contactos del observador con contacto_id IN (...).
+- Memo por petición: cada ResolutorNombres recuerda lo que ya resolvió.
+- Caché por observador (LRU + TTL) entre peticiones; contactos.py la
+  invalida al crear, renombrar o eliminar un contacto, en todos los
+  workers (canal "nombres:invalidar", ver app/invalidacion.py).
+"""
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.modelos import Contacto, Usuario
+from app.invalidacion import CanalInvalidacion
+
+CACHE_TTL_SEG = 300
+CACHE_MAX_OBSERVADORES = 2048
+
+# { observador_id: (expira_en, { objetivo_id: alias | None }) }
+_cache_alias: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+
+def _olvidar_alias(observadores_ids: list) -> None:
+    for oid in observadores_ids:
+        _cache_alias.pop(oid, None)
+
+
+canal_alias = CanalInvalidacion("nombres:invalidar", _olvidar_alias, _cache_alias.clear)
+
+
+async def invalidar_alias(observador_id) -> None:
+    """Olvida los alias cacheados de un observador (su agenda cambió)."""
+    await canal_alias.anunciar([observador_id])
+
+
+def _cache_de(observador_id: str) -> dict:
+    ahora = time.monotonic()
+    entrada = _cache_alias.get(observador_id)
+
+    if entrada and entrada[0] > ahora:
+        _cache_alias.move_to_end(observador_id)
+        return entrada[1]
+
+    aliases: dict = {}
+    _cache_alias[observador_id] = (ahora + CACHE_TTL_SEG, aliases)
+    _cache_alias.move_to_end(observador_id)
+    while len(_cache_alias) > CACHE_MAX_OBSERVADORES:
+        _cache_alias.popitem(last=False)
+    return aliases
+
+
+class ResolutorNombres:
+    """Resuelve alias / nombres visibles de varios usuarios para un observador."""
+
+    def __init__(self, sesion: AsyncSession, observador_id):
+        self.sesion = sesion
+        self.observador_id = str(observador_id)
+        self._memo: dict = {}
+
+    async def aliases(self, objetivos_ids: Iterable) -> dict:
+        """{ objetivo_id: alias | None } con una query como máximo."""
+        ids = {str(i) for i in objetivos_ids}
+        faltan = ids - self._memo.keys()
+
+        if faltan:
+            cache = _cache_de(self.observador_id)
+            for uid in list(faltan):
+                if uid in cache:
+                    self._memo[uid] = cache[uid]
+                    faltan.discard(uid)
+
+        if faltan:
+            q = await self.sesion.execute(
+                select(Contacto.contacto_id, Contacto.alias).where(
+                    Contacto.usuario_id == self.observador_id,
+                    Contacto.contacto_id.in_(faltan),
+                )
+            )
+            encontrados = {str(cid): (alias or None) for cid, alias in q.all()}
+
+            cache = _cache_de(self.observador_id)
+            for uid in faltan:
+                alias = encontrados.get(uid)
+                self._memo[uid] = alias
+                cache[uid] = alias
+
+        return {uid: self._memo[uid] for uid in ids}
+
+    async def alias(self, objetivo_id) -> Optional[str]:
+        return (await self.aliases([objetivo_id]))[str(objetivo_id)]
+
+    async def nombres(self, usuarios: Iterable[Usuario]) -> dict:
+        """{ usuario_id: alias > teléfono > "Usuario" }"""
+        usuarios = [u for u in usuarios if u is not None]
+        aliases = await self.aliases(u.id for u in usuarios)
+        return {
+            str(u.id): aliases[str(u.id)] or u.telefono or "Usuario"
+            for u in usuarios
+        }
+
+    async def nombre(self, usuario: Usuario) -> str:
+        return (await self.nombres([usuario]))[str(usuario.id)]
@@ -0,0 +1,74 @@
+# app/invalidacion.py
+"""
+Invalidación de cachés por proceso entre workers (Redis pub/sub).
+
+Cada caché declara un CanalInvalidacion con:
+- aplicar(claves): olvida esas claves en ESTE worker.
+- vaciar(): lo olvida todo (el canal se cayó y pudo perderse un aviso).
+
+anunciar() aplica aquí y publica; escuchar() es la tarea de fondo que,
+en cada worker, aplica lo que publican los demás (arranca en el startup
+de main.py). Sin REDIS_URL todo queda en el proceso y los demás workers
+lo ven al vencer su TTL, como antes.
+"""
+import asyncio
+import json
+import logging
+from typing import Callable, Iterable
+
+from app.core.config import config
+
+logger = logging.getLogger("app.invalidacion")
+
+_redis = None
+
+
+def _cliente_redis():
+    global _redis
+    if _redis is None and config.REDIS_URL:
+        import redis.asyncio as aioredis
+        _redis = aioredis.from_url(config.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+class CanalInvalidacion:
+    def __init__(self, nombre: str, aplicar: Callable[[list], None], vaciar: Callable[[], None]):
+        self.nombre = nombre
+        self._aplicar = aplicar
+        self._vaciar = vaciar
+
+    async def anunciar(self, claves: Iterable) -> None:
+        """Invalida aquí y avisa a los demás workers (si hay Redis)."""
+        claves = [str(c) for c in claves]
+        if not claves:
+            return
+        self._aplicar(claves)
+
+        redis = _cliente_redis()
+        if redis is None:
+            return
+        try:
+            await redis.publish(self.nombre, json.dumps(claves))
+        except Exception as e:
+            logger.warning("[%s] invalidación no anunciada: %s", self.nombre, e)
+
+    async def escuchar(self):
+        """Tarea de fondo: aplica las invalidaciones de los otros workers."""
+        redis = _cliente_redis()
+        if redis is None:
+            return
+        while True:
+            try:
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(self.nombre)
+                async for msg in pubsub.listen():
+                    if msg.get("type") != "message":
+                        continue
+                    self._aplicar(json.loads(msg["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Lo cacheado pudo quedar viejo mientras no escuchábamos
+                logger.warning("[%s] canal de invalidación caído: %s", self.nombre, e)
+                self._vaciar()
+                await asyncio.sleep(1)
@@ -0,0 +1,179 @@
+# app/limpieza.py
+"""
+Limpieza periódica de codigos_otp, sesiones_qr, sesiones_web y de los
+adjuntos sin referencias (fila + archivo en uploads/cas).
+
+- Antes solo crecían: la expiración se aplicaba al leer, fila por fila.
+- Cada regla se aplica en lotes acotados (LIMPIEZA_LOTE filas por
+  transacción, elegidas por ctid con SKIP LOCKED) para no bloquear las
+  tablas ni chocar con el login en curso.
+- Los índices parciales (migración e8b3f7a1c926) hacen que cada lote
+  lea solo las filas candidatas.
+- Cada pasada registra las filas recuperadas por regla.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.db.sesion import SessionLocal
+
+logger = logging.getLogger("app.limpieza")
+
+LIMPIEZA_LOTE = 1000
+LIMPIEZA_PAUSA_LOTE_SEG = 0.05
+LIMPIEZA_INTERVALO_SEG = 600
+OTP_RETENCION = timedelta(hours=1)
+QR_RETENCION = timedelta(days=1)
+SESION_WEB_RETENCION = timedelta(days=30)
+ADJUNTO_HUERFANO_GRACIA = timedelta(days=1)
+UPLOAD_ROOT = "uploads"
+
+# (nombre, SQL) — :ahora / :limite / :lote se completan en cada pasada.
+# Todas las columnas de fecha están en UTC sin zona (datetime.utcnow()).
+_REGLAS = (
+    (
+        "otp_borrados",
+        """
+        DELETE FROM codigos_otp WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM codigos_otp
+            WHERE expiracion < :limite_otp
+            LIMIT :lote FOR UPDATE SKIP LOCKED
+        ))
+        """,
+    ),
+    (
+        "qr_expirados",
+        """
+        UPDATE sesiones_qr SET estado = 'expirado' WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM sesiones_qr
+            WHERE expiracion < :ahora AND estado = 'pendiente'
+            LIMIT :lote FOR UPDATE SKIP LOCKED
+        ))
+        """,
+    ),
+    (
+        "qr_borrados",
+        """
+        DELETE FROM sesiones_qr WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM sesiones_qr
+            WHERE expiracion < :limite_qr
+            LIMIT :lote FOR UPDATE SKIP LOCKED
+        ))
+        """,
+    ),
+    (
+        "web_desactivadas",
+        """
+        UPDATE sesiones_web SET activo = false WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM sesiones_web
+            WHERE activo AND fecha_expiracion < :ahora
+            LIMIT :lote FOR UPDATE SKIP LOCKED
+        ))
+        """,
+    ),
+    (
+        "web_borradas",
+        """
+        DELETE FROM sesiones_web WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM sesiones_web
+            WHERE NOT activo AND fecha_inicio < :limite_web
+            LIMIT :lote FOR UPDATE SKIP LOCKED
+        ))
+        """,
+    ),
+)
+
+
+# Adjuntos sin mensajes que los usen. La condición se repite fuera del
+# subselect para re-evaluarla sobre la fila bloqueada (pudo referenciarse).
+_SQL_ADJUNTOS_HUERFANOS = """
+    DELETE FROM adjuntos WHERE sha256 = ANY(ARRAY(
+        SELECT sha256 FROM adjuntos
+        WHERE referencias <= 0 AND actualizado_en < :limite_adjuntos
+        LIMIT :lote FOR UPDATE SKIP LOCKED
+    ))
+    AND referencias <= 0
+    AND NOT EXISTS (SELECT 1 FROM mensajes m WHERE m.adjunto_sha256 = adjuntos.sha256)
+    RETURNING ruta
+"""
+
+
+def _borrar_archivos(rutas: list):
+    for ruta in rutas:
+        try:
+            os.remove(os.path.join(UPLOAD_ROOT, ruta))
+        except FileNotFoundError:
+            pass
+
+
+class Limpieza:
+    async def _aplicar(self, sql: str, params: dict) -> int:
+        """Repite la regla lote a lote hasta que un lote salga incompleto."""
+        params = {k: v for k, v in params.items() if f":{k}" in sql}
+        total = 0
+        while True:
+            async with SessionLocal() as db:
+                r = await db.execute(text(sql), params)
+                await db.commit()
+            total += r.rowcount
+            if r.rowcount < LIMPIEZA_LOTE:
+                return total
+            await asyncio.sleep(LIMPIEZA_PAUSA_LOTE_SEG)
+
+    async def _purgar_adjuntos(self, limite: datetime) -> int:
+        """
+        Como _aplicar, pero cada lote borra también sus archivos ANTES del
+        commit: una subida concurrente del mismo contenido espera el lock de
+        la fila y, al no encontrar el archivo, lo vuelve a colocar.
+        """
+        total = 0
+        while True:
+            async with SessionLocal() as db:
+                r = await db.execute(
+                    text(_SQL_ADJUNTOS_HUERFANOS),
+                    {"limite_adjuntos": limite, "lote": LIMPIEZA_LOTE},
+                )
+                rutas = [ruta for (ruta,) in r.all()]
+                await asyncio.to_thread(_borrar_archivos, rutas)
+                await db.commit()
+            total += len(rutas)
+            if len(rutas) < LIMPIEZA_LOTE:
+                return total
+            await asyncio.sleep(LIMPIEZA_PAUSA_LOTE_SEG)
+
+    async def barrer(self) -> dict:
+        """Una pasada completa. Devuelve { regla: filas }."""
+        ahora = datetime.utcnow()
+        params = {
+            "ahora": ahora,
+            "limite_otp": ahora - OTP_RETENCION,
+            "limite_qr": ahora - QR_RETENCION,
+            "limite_web": ahora - SESION_WEB_RETENCION,
+            "lote": LIMPIEZA_LOTE,
+        }
+
+        recuperadas = {}
+        for nombre, sql in _REGLAS:
+            recuperadas[nombre] = await self._aplicar(sql, params)
+        recuperadas["adjuntos_borrados"] = await self._purgar_adjuntos(ahora - ADJUNTO_HUERFANO_GRACIA)
+
+        logger.info(
+            "[limpieza] filas recuperadas: %s",
+            ", ".join(f"{k}={v}" for k, v in recuperadas.items()),
+        )
+        return recuperadas
+
+    async def bucle(self):
+        """Tarea de fondo: una pasada cada LIMPIEZA_INTERVALO_SEG."""
+        while True:
+            try:
+                await self.barrer()
+            except Exception as e:
+                logger.warning("[limpieza] pasada fallida: %s", e)
+            await asyncio.sleep(LIMPIEZA_INTERVALO_SEG)
+
+
+limpieza = Limpieza()
@@ -2,17 +2,20 @@
 # app/main.py — versión revisada y completa
 # ================================================================
 import asyncio
+import base64
+import io
 import platform
 import uuid
 import time
 import random
 import logging
 import re
-import smtplib
 import phonenumbers
+import qrcode
+import qrcode.image.svg
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
-from email.mime.text import MIMEText
 from pydantic import EmailStr
 from uuid import UUID as UUID_t
 
@@ -62,6 +65,9 @@ import jwt as jwt_lib
 # -----------------------------
 from app.db.sesion import SessionLocal
 from app.core.config import config
+from app.core.autenticacion import invalidar_token
+from app.almacen_temporal import AlmacenExpirable
+from app.correo import cola_correo
 from app.db import crud
 from app.db.modelos import Conversacion, MiembroConversacion, Usuario
 
@@ -93,6 +99,8 @@ from app.core.config import config
 
 TTL_TOKEN = 600
 TOKEN_RENEW_WINDOW = 120
+TTL_CODIGO_CORREO = 300
+QR_HILOS = 2  # hilos dedicados a dibujar QR (fuera del event loop)
 
 # ================================================================
 # Importar rutas y servicios
@@ -127,8 +135,9 @@ from app.db.modelos import Conversacion, MiembroConversacion, Usuario
 # ================================================================
 app = FastAPI(title="BiscoChat Backend", version="3.4")
 
-from app.api.files import router as files_router
+from app.api.files import LimiteSubida, router as files_router
 app.include_router(files_router, prefix="/api", tags=["files"])
+app.add_middleware(LimiteSubida)
 
 from fastapi.staticfiles import StaticFiles
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
@@ -166,6 +175,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Next-Seq"],
 )
 
 # ================================================================
@@ -273,9 +283,19 @@ def set_auth_cookie(request: Request, response: RedirectResponse, jwt_token: str
     )
 
 # ================================================================
-# Tokens QR en memoria
+# Tokens QR (Redis con TTL nativo; en memoria si no hay REDIS_URL)
 # ================================================================
-db_tokens: dict = {}
+tokens_qr = AlmacenExpirable("qr:token:", TTL_TOKEN)
+
+
+async def publicar_estado_qr(token: str, estado: str):
+    """Avisa a la página de login que espera este token (room qr:{token})."""
+    from app.realtime import difundir, QR_ROOM
+    try:
+        await difundir("estado_qr", {"token": token, "estado": estado}, rooms=[QR_ROOM(token)])
+    except Exception as e:
+        # La página sigue teniendo /verificar_estado_qr como respaldo
+        logger.warning(f"⚠ No se pudo publicar el estado del QR {token}: {e}")
 
 # ================================================================
 # Página principal (Login con QR)
@@ -292,44 +312,47 @@ def home(request: Request):
 # ================================================================
 # Generar token QR
 # ================================================================
+_hilos_qr = ThreadPoolExecutor(max_workers=QR_HILOS, thread_name_prefix="qr")
+
+
+def dibujar_qr(contenido: str, formato: str = "png") -> tuple[str, str]:
+    """
+    QR → (mime, base64). Se ejecuta en _hilos_qr: PIL y el cálculo de la
+    matriz no bloquean los sockets ni las demás peticiones del worker.
+    "svg" = un solo <path>, sin PIL y mucho más liviano que el PNG.
+    """
+    buf = io.BytesIO()
+    if formato == "svg":
+        qrcode.make(contenido, image_factory=qrcode.image.svg.SvgPathImage).save(buf)
+        mime = "image/svg+xml"
+    else:
+        qrcode.make(contenido).save(buf, format="PNG")
+        mime = "image/png"
+    return mime, base64.b64encode(buf.getvalue()).decode("ascii")
+
+
 @app.get("/generar_token_qr")
-async def generar_token_qr(request: Request):
-    ahora = time.time()
-    expirados = [t for t, d in db_tokens.items() if (ahora - d["creacion"]) > TTL_TOKEN]
-    for t in expirados:
-        del db_tokens[t]
+async def generar_token_qr(request: Request, formato: str = Query("png", pattern="^(png|svg)$")):
     token = str(uuid.uuid4())
-    expira = datetime.now(timezone.utc) + timedelta(seconds=TTL_TOKEN)
-    db_tokens[token] = {
-    "creacion": ahora,
-    "expira": expira,
-    "estado": "pendiente",
-    "usuario_id": None,
-}
+    await tokens_qr.guardar(token, {"estado": "pendiente", "usuario_id": None})
     base = str(request.base_url)
     if "ngrok" in base and base.startswith("http://"):
         base = base.replace("http://", "https://")
     if not base.endswith("/"):
         base += "/"
     qr_url = f"{base}simular_escaneo/{token}"
-    import qrcode, io, base64
-    img = qrcode.make(qr_url)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    qr_base64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-    return {"token": token, "qr_code": qr_base64}
+    loop = asyncio.get_running_loop()
+    mime, qr_base64 = await loop.run_in_executor(_hilos_qr, dibujar_qr, qr_url, formato)
+    return {"token": token, "qr_code": qr_base64, "mime": mime}
 
 # ================================================================
 # Verificar estado QR
 # ================================================================
 @app.get("/verificar_estado_qr/{token}")
-def verificar_estado_qr(token: str):
-    token_data = db_tokens.get(token)
+async def verificar_estado_qr(token: str):
+    token_data = await tokens_qr.obtener(token)
     if not token_data:
         raise HTTPException(status_code=404, detail="Token no encontrado o expirado")
-    if (time.time() - token_data["creacion"]) > TTL_TOKEN:
-        del db_tokens[token]
-        raise HTTPException(status_code=404, detail="Token expirado")
     return {
         "estado": token_data["estado"],
         "usuario_id": token_data["usuario_id"],
@@ -340,8 +363,8 @@ def verificar_estado_qr(token: str):
 # Simular escaneo
 # ================================================================
 @app.get("/simular_escaneo/{token}", response_class=HTMLResponse)
-def simular_escaneo(request: Request, token: str):
-    if token not in db_tokens:
+async def simular_escaneo(request: Request, token: str):
+    if not await tokens_qr.obtener(token):
         raise HTTPException(status_code=404, detail="Token inválido o expirado")
     return templates.TemplateResponse("qr_validacion.html", {"request": request, "token": token})
 
@@ -358,8 +381,10 @@ def qr_escaneo_exitoso(request: Request):
 # ================================================================
 @app.post("/cerrar_sesion/{token}")
 async def cerrar_sesion(token: str):
-    if token in db_tokens:
-        db_tokens.pop(token)
+    token_data = await tokens_qr.obtener(token)
+    if token_data:
+        await tokens_qr.borrar(token)
+        invalidar_token(token_data.get("jwt"))
         logger.info(f"🔒 Token {token} eliminado manualmente al cerrar sesión.")
     return JSONResponse(content={"mensaje": "Sesión cerrada correctamente."})
 
@@ -423,17 +448,18 @@ def validar_numero_api(numero: str):
 # ================================================================
 @app.post("/validar_escaneo/{token}")
 async def validar_escaneo(request: Request, token: str, validacion: ValidacionTelefono):
-    token_data = db_tokens.get(token)
+    token_data = await tokens_qr.obtener(token)
 
     # 🔒 Si el token ya fue usado o pertenece a otro usuario → reiniciarlo
     if token_data and token_data.get("estado") == "autenticado":
         logger.info(f"♻ Reiniciando token usado previamente: {token}")
         usuario_anterior = token_data.get("usuario_id")
-        db_tokens.pop(token, None)
-        for t, d in list(db_tokens.items()):
-            if d.get("usuario_id") == usuario_anterior:
-                db_tokens.pop(t, None)
-                logger.info(f"🧹 Token anterior del usuario {usuario_anterior} eliminado.")
+        anteriores = await tokens_qr.claves_de(usuario_anterior) if usuario_anterior else []
+        await tokens_qr.borrar(token, *anteriores)
+        if usuario_anterior:
+            await tokens_qr.borrar_indice(usuario_anterior)
+        for _ in anteriores:
+            logger.info(f"🧹 Token anterior del usuario {usuario_anterior} eliminado.")
         token_data = None
 
     if not token_data:
@@ -512,6 +538,10 @@ async def validar_escaneo(request: Request, token: str, validacion: ValidacionTe
     token_data["estado"] = "pendiente_correo"
     token_data["usuario_id"] = str(usuario_bd.id)
     token_data["jwt"] = generar_jwt(usuario_bd.id)
+    if not await tokens_qr.actualizar(token, token_data):
+        raise HTTPException(status_code=404, detail="Token inválido o expirado")
+    await tokens_qr.indexar(token_data["usuario_id"], token)
+    await publicar_estado_qr(token, "pendiente_correo")
 
     # RESPUESTA: indicar que ahora se debe validar correo
     return JSONResponse(
@@ -531,27 +561,8 @@ class ValidacionCorreo(BaseModel):
     email: EmailStr
     codigo: str | None = None  # Código de 6 dígitos enviado por correo
 
-# Almacenamiento temporal de códigos por email
-db_email_codes: dict = {}  # clave: email, valor: {codigo: str, expira: datetime}
-
-def enviar_correo(email_destino: str, mensaje: str) -> None:
-    """
-    Envía un correo con el mensaje especificado usando SMTP Gmail.
-    """
-    msg = MIMEText(mensaje)
-    msg["Subject"] = "Tu código de verificación"
-    msg["From"] = config.EMAIL_FROM
-    msg["To"] = email_destino
-
-    try:
-        with smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT) as server:
-            server.starttls()
-            server.login(config.EMAIL_FROM, config.EMAIL_PASSWORD)
-            server.send_message(msg)
-        logger.info(f"📨 Código enviado a {email_destino} por correo.")
-    except Exception as e:
-        logger.error(f"⚠️ Error enviando correo a {email_destino}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error enviando correo: {str(e)}")
+# Códigos por email (expiran solos a los TTL_CODIGO_CORREO segundos)
+codigos_correo = AlmacenExpirable("qr:correo:", TTL_CODIGO_CORREO)  # email → {codigo, token}
 
 # ================================================================
 # ✅ Enviar código de verificación por correo
@@ -559,27 +570,26 @@ def enviar_correo(email_destino: str, mensaje: str) -> None:
 @app.post("/enviar_codigo_correo/{token}")
 async def enviar_codigo_correo(token: str, validacion: ValidacionCorreo):
     # 🔹 Verificar si el token existe y está en estado pendiente
-    token_data = db_tokens.get(token)
+    token_data = await tokens_qr.obtener(token)
     if not token_data or token_data.get("estado") != "pendiente_correo":
         raise HTTPException(status_code=401, detail="Token inválido o no autorizado")
 
     # 🔹 Generar un código de 6 dígitos
     codigo = f"{random.randint(0, 999999):06d}"
-    expiracion = datetime.now(timezone.utc) + timedelta(minutes=5)
 
-    # Guardar el código temporalmente en memoria
-    db_email_codes[validacion.email] = {
+    # Guardar el código temporalmente (TTL de 5 minutos)
+    await codigos_correo.guardar(validacion.email, {
         "codigo": codigo,
-        "expira": expiracion,
         "token": token
-    }
+    })
 
-    try:
-        # 🔹 Enviar correo (debes tener configurada la función enviar_correo)
-        enviar_correo(validacion.email, f"Tu código de verificación es: {codigo}")
-    except Exception as e:
-        print("❌ Error al enviar correo:", e)
-        raise HTTPException(status_code=500, detail="Error al enviar el correo. Verifica configuración SMTP.")
+    # 🔹 Encolar el correo (lo envía app.correo en segundo plano)
+    if not cola_correo.encolar(
+        validacion.email,
+        "Tu código de verificación",
+        f"Tu código de verificación es: {codigo}",
+    ):
+        raise HTTPException(status_code=503, detail="Servicio de correo saturado. Intenta en unos segundos.")
 
     # 🔹 Responder correctamente
     return {"mensaje": "Código enviado al correo.", "email": validacion.email}
@@ -591,28 +601,27 @@ async def enviar_codigo_correo(token: str, validacion: ValidacionCorreo):
 @app.post("/validar_codigo_correo/{token}")
 async def validar_codigo_correo(token: str, validacion: ValidacionCorreo, request: Request):
     # 🔹 Buscar el registro del correo y token
-    registro = db_email_codes.get(validacion.email)
-    token_data = db_tokens.get(token)
+    registro = await codigos_correo.obtener(validacion.email)
+    token_data = await tokens_qr.obtener(token)
 
+    # Sin registro = nunca pedido o ya expirado (TTL)
     if not registro or not token_data:
         raise HTTPException(status_code=401, detail="Código o token inválido")
 
     if token_data.get("estado") != "pendiente_correo":
         raise HTTPException(status_code=403, detail="Token ya usado o no válido para validación de correo.")
 
-    # 🔹 Verificar expiración
-    if datetime.now(timezone.utc) > registro["expira"]:
-        db_email_codes.pop(validacion.email, None)
-        raise HTTPException(status_code=410, detail="Código expirado")
-
     # 🔹 Verificar coincidencia del código
     if validacion.codigo != registro["codigo"]:
         raise HTTPException(status_code=422, detail="Código incorrecto")
 
     # 🔹 Si todo está correcto → limpiar código y actualizar token
-    db_email_codes.pop(validacion.email, None)
+    await codigos_correo.borrar(validacion.email)
     token_data["estado"] = "autenticado"
-    token_data["verificado_en"] = datetime.now(timezone.utc)
+    token_data["verificado_en"] = datetime.now(timezone.utc).isoformat()
+    if not await tokens_qr.actualizar(token, token_data):
+        raise HTTPException(status_code=401, detail="Código o token inválido")
+    await publicar_estado_qr(token, "autenticado")
 
     # 🔹 Devolver respuesta JSON (para que JS redirija correctamente)
     return {"mensaje": "Verificación completa.", "token": token}
@@ -622,24 +631,12 @@ async def validar_codigo_correo(token: str, validacion: ValidacionCorreo, reques
 # ================================================================
 
 async def limpiar_tokens_expirados():
+    # Con Redis expiran solos; en memoria solo se recorren los vencidos
     while True:
         try:
-            # Usar SIEMPRE UTC con tzinfo
-            ahora = datetime.now(timezone.utc)
-
-            expirados = []
-            for t, data in list(db_tokens.items()):
-                exp = data.get("expira")
-                if isinstance(exp, datetime):
-                    # Si viene sin tz, forzamos UTC
-                    if exp.tzinfo is None:
-                        exp = exp.replace(tzinfo=timezone.utc)
-                    if exp < ahora:
-                        expirados.append(t)
-
-            for token in expirados:
-                db_tokens.pop(token, None)
-                logger.info(f"🧹 Token expirado eliminado: {token}")
+            borrados = await tokens_qr.purgar() + await codigos_correo.purgar()
+            if borrados:
+                logger.info(f"🧹 {borrados} tokens/códigos expirados eliminados")
         except Exception as e:
             logger.error(f"Error al limpiar tokens expirados: {e}")
 
@@ -650,12 +647,82 @@ async def limpiar_tokens_expirados():
 async def iniciar_limpieza_tokens():
     asyncio.create_task(limpiar_tokens_expirados())
 
+
+@app.on_event("startup")
+async def iniciar_cola_correo():
+    cola_correo.iniciar()
+
+
+@app.on_event("shutdown")
+async def cerrar_cola_correo():
+    try:
+        await cola_correo.cerrar()
+    except Exception as e:
+        logger.error(f"Error al cerrar la cola de correo: {e}")
+
+
+@app.on_event("startup")
+async def iniciar_invalidaciones_auth():
+    from app.core.autenticacion import canal_auth
+    asyncio.create_task(canal_auth.escuchar())
+
+
+@app.on_event("startup")
+async def iniciar_invalidaciones_nombres():
+    from app.db.nombres import canal_alias
+    asyncio.create_task(canal_alias.escuchar())
+
+
+@app.on_event("startup")
+async def iniciar_invalidaciones_interes():
+    from app.db.interes import canal_interes
+    asyncio.create_task(canal_interes.escuchar())
+
+
+@app.on_event("startup")
+async def iniciar_limpieza():
+    from app.limpieza import limpieza
+    asyncio.create_task(limpieza.bucle())
+
+
+@app.on_event("startup")
+async def iniciar_latidos_presencia():
+    from app.presencia import presencia, persistencia
+    from app.realtime import bucle_barrido_presencia
+    asyncio.create_task(presencia.bucle_latidos())
+    asyncio.create_task(persistencia.bucle())
+    asyncio.create_task(bucle_barrido_presencia())
+
+
+@app.on_event("shutdown")
+async def volcar_presencia_pendiente():
+    from app.presencia import persistencia
+    try:
+        await persistencia.volcar()
+    except Exception as e:
+        logger.error(f"Error al volcar presencia pendiente: {e}")
+
+
+@app.on_event("startup")
+async def iniciar_despachador_outbox():
+    from app.outbox import despachador
+    asyncio.create_task(despachador.bucle())
+
+
+@app.on_event("shutdown")
+async def vaciar_outbox_pendiente():
+    from app.outbox import despachador
+    try:
+        await despachador.vaciar()
+    except Exception as e:
+        logger.error(f"Error al vaciar el outbox: {e}")
+
 # ================================================================
 # Redirección al chat
 # ================================================================
 @app.get("/iniciar_sesion_con_token/{token}", response_class=RedirectResponse)
 async def iniciar_sesion_con_token(token: str, request: Request):
-    token_data = db_tokens.get(token)
+    token_data = await tokens_qr.obtener(token)
     if not token_data or token_data.get("estado") != "autenticado" or not token_data.get("jwt"):
         raise HTTPException(status_code=401, detail="Token inválido o no autenticado")
     base_url = str(request.base_url)
@@ -0,0 +1,229 @@
+# app/outbox.py
+"""
+Outbox transaccional para los eventos Socket.IO.
+
+- Los endpoints llaman a `encolar(...)` ANTES del commit: el evento queda en
+  eventos_outbox en la misma transacción que el mensaje / la membresía.
+- Al confirmar, la sesión despierta al despachador de este worker; además
+  sondea cada OUTBOX_SONDEO_SEG por si el aviso se perdió (caída, otro worker).
+- El despachador drena en lotes por id, publica en las rooms y marca
+  enviado_en. Un advisory lock de Postgres garantiza un único despachador
+  activo. Dentro de una conversación el id sigue el orden de commit: el
+  trigger trg_eventos_outbox_orden lo pide bajo un lock por conversación
+  (hasta el commit), así el orden por conversación se conserva.
+- Un evento cuyo emit falla suma un intento y el lote se corta ahí (para
+  no adelantar a los siguientes); a los OUTBOX_MAX_INTENTOS pasa a
+  fallido (fallido_en, "dead letter") y deja de bloquear la cola.
+- Entrega "al menos una vez": si cae entre el emit y la marca, se reenvía.
+- Cada payload sale con su "eid" y queda anotado en app.bitacora para
+  reenviar lo perdido cuando un cliente reconecta. eid NO es el id: el id
+  se asigna al insertar y una transacción lenta puede confirmar un id
+  menor después de uno mayor. eid sale de eventos_outbox_eid_seq al
+  publicar, bajo el advisory lock → crece en el orden en que se publica.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import bindparam, case, delete, event, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.bitacora import bitacora, con_eid
+from app.db.modelos import EVENTOS_OUTBOX_EID_SEQ, EventoOutbox
+from app.db.sesion import SessionLocal
+from app.realtime import difundir, USER_ROOM
+
+logger = logging.getLogger("app.outbox")
+
+OUTBOX_LOTE = 200
+OUTBOX_SONDEO_SEG = 2
+OUTBOX_LOCK = 0x0B15C0  # clave del advisory lock
+OUTBOX_ESPERA_LOCK_SEG = 0.05
+OUTBOX_REINTENTOS_LOCK = 20
+OUTBOX_RETENCION = timedelta(hours=24)
+OUTBOX_PURGA_SEG = 600
+OUTBOX_MAX_INTENTOS = 25
+
+
+def encolar(db: AsyncSession, evento: str, payload: dict, rooms: Iterable[str], conversacion_id=None):
+    """Añade el evento a la transacción actual (se publica tras el commit)."""
+    rooms = list(dict.fromkeys(rooms))
+    if not rooms:
+        return
+
+    db.add(EventoOutbox(
+        conversacion_id=str(conversacion_id) if conversacion_id else None,
+        evento=evento,
+        payload=jsonable_encoder(payload),
+        rooms=rooms,
+    ))
+    db.sync_session.info["outbox_pendiente"] = True
+
+
+def encolar_estados_actualizados(db: AsyncSession, conversacion_id, avisos: dict):
+    """
+    ✓✓ Recibos → remitentes.
+    avisos = { remitente_id: [{usuario_id, estado, hasta, mensaje_ids}] }
+    Un evento por remitente, lector y estado.
+    """
+    for remitente_id, lista in avisos.items():
+        for aviso in lista:
+            encolar(
+                db,
+                "estado_actualizado",
+                {
+                    "conversacion_id": str(conversacion_id),
+                    "usuario_id": aviso["usuario_id"],
+                    "estado": aviso["estado"],
+                    "hasta": aviso["hasta"],  # seq
+                    "mensaje_ids": aviso["mensaje_ids"],
+                },
+                [USER_ROOM(remitente_id)],
+                conversacion_id=conversacion_id,
+            )
+
+
+class DespachadorOutbox:
+    def __init__(self):
+        self._despertar = asyncio.Event()
+        self._ultima_purga = 0.0
+
+    def avisar(self):
+        self._despertar.set()
+
+    async def drenar(self) -> Optional[int]:
+        """
+        Publica un lote. Devuelve cuántos eventos leyó, o None si otro
+        worker tiene el lock (ya está drenando).
+        """
+        async with SessionLocal() as db:
+            libre = (await db.execute(select(func.pg_try_advisory_xact_lock(OUTBOX_LOCK)))).scalar()
+            if not libre:
+                return None
+
+            q = await db.execute(
+                select(EventoOutbox.id, EventoOutbox.evento, EventoOutbox.payload, EventoOutbox.rooms)
+                .where(EventoOutbox.enviado_en.is_(None), EventoOutbox.fallido_en.is_(None))
+                .order_by(EventoOutbox.id.asc())
+                .limit(OUTBOX_LOTE)
+            )
+            eventos = q.all()
+
+            # eids del lote, en orden (el lock serializa: siempre crecen)
+            eids = []
+            if eventos:
+                q_eids = await db.execute(
+                    select(EVENTOS_OUTBOX_EID_SEQ.next_value())
+                    .select_from(func.generate_series(1, len(eventos)))
+                )
+                eids = sorted(q_eids.scalars().all())
+
+            enviados = []
+            publicados = []
+            ev_id = None
+            try:
+                for (ev_id, evento, payload, rooms), eid in zip(eventos, eids):
+                    payload = con_eid(payload, eid)
+                    await difundir(evento, payload, rooms=rooms)
+                    enviados.append({"b_id": ev_id, "b_eid": eid})
+                    publicados.append((eid, evento, payload, rooms))
+            except Exception:
+                await self._anotar_fallo(db, ev_id)
+                raise
+            finally:
+                # Si un emit falla se marca lo ya publicado y el resto
+                # se reintenta en la próxima vuelta (con eids nuevos, mayores).
+                if enviados:
+                    await db.execute(
+                        update(EventoOutbox.__table__)
+                        .where(EventoOutbox.__table__.c.id == bindparam("b_id"))
+                        .values(enviado_en=func.now(), eid=bindparam("b_eid")),
+                        enviados,
+                    )
+                await db.commit()
+
+                try:
+                    await bitacora.anotar(publicados)
+                except Exception as e:
+                    logger.warning("[outbox] bitácora no actualizada: %s", e)
+
+            return len(eventos)
+
+    async def _anotar_fallo(self, db: AsyncSession, ev_id):
+        """+1 intento al evento que falló; al máximo, fuera de la cola."""
+        if ev_id is None:
+            return
+        res = await db.execute(
+            update(EventoOutbox)
+            .where(EventoOutbox.id == ev_id)
+            .values(
+                intentos=EventoOutbox.intentos + 1,
+                fallido_en=case(
+                    (EventoOutbox.intentos + 1 >= OUTBOX_MAX_INTENTOS, func.now()),
+                    else_=None,
+                ),
+            )
+            .returning(EventoOutbox.evento, EventoOutbox.intentos, EventoOutbox.fallido_en)
+            .execution_options(synchronize_session=False)
+        )
+        evento, intentos, fallido_en = res.one()
+        if fallido_en is not None:
+            logger.error("[outbox] evento %s (%s) descartado tras %d intentos", ev_id, evento, intentos)
+
+    async def purgar(self):
+        """Borra los eventos enviados (o fallidos) más antiguos que la retención."""
+        async with SessionLocal() as db:
+            await db.execute(
+                delete(EventoOutbox).where(
+                    or_(
+                        EventoOutbox.enviado_en < func.now() - OUTBOX_RETENCION,
+                        EventoOutbox.fallido_en < func.now() - OUTBOX_RETENCION,
+                    )
+                )
+            )
+            await db.commit()
+
+    async def vaciar(self):
+        """Drena todo lo pendiente (p. ej. al apagar)."""
+        for _ in range(OUTBOX_REINTENTOS_LOCK):
+            n = await self.drenar()
+            if n is None:
+                await asyncio.sleep(OUTBOX_ESPERA_LOCK_SEG)
+            elif n < OUTBOX_LOTE:
+                return
+
+    async def bucle(self):
+        """Tarea de fondo del despachador."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), timeout=OUTBOX_SONDEO_SEG)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+
+            try:
+                await self.vaciar()
+
+                if loop.time() - self._ultima_purga > OUTBOX_PURGA_SEG:
+                    self._ultima_purga = loop.time()
+                    await self.purgar()
+            except Exception as e:
+                logger.warning("[outbox] despacho fallido: %s", e)
+
+
+despachador = DespachadorOutbox()
+
+
+@event.listens_for(Session, "after_commit")
+def _despertar_tras_commit(session):
+    if session.info.pop("outbox_pendiente", False):
+        despachador.avisar()
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_tras_rollback(session):
+    session.info.pop("outbox_pendiente", None)
@@ -0,0 +1,304 @@
+# app/presencia.py
+"""
+Registro de presencia compartido entre workers.
+
+- Cada usuario tiene un CONJUNTO de sids (una pestaña / dispositivo cada uno).
+- Con REDIS_URL: un ZSET por usuario (sid → instante de expiración), así
+  todos los workers ven lo mismo y los sids de un worker caído caducan solos.
+- Sin Redis: el mismo registro en memoria (válido para un solo proceso).
+- Cada worker refresca periódicamente (latido) los sids que tiene conectados.
+- usuarios.en_linea / ultima_conexion se escriben en diferido: los cambios
+  se acumulan en memoria y se vuelcan en lotes (también al apagar).
+- Si un worker muere sin desconectar a nadie, sus sids caducan pero en la
+  BD siguen en_linea: el barrido (barrer_caidos) los pasa a offline y
+  devuelve a quién hay que anunciárselo.
+- POST /auth/marcar_online (sin socket) deja una marca con el mismo TTL:
+  el barrido respeta al usuario mientras la marca viva.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import Boolean, DateTime, column, func, select, update, values
+from sqlalchemy.dialects.postgresql import UUID
+
+from app.core.config import config
+from app.db.modelos import Usuario
+from app.db.sesion import SessionLocal
+
+logger = logging.getLogger("app.presencia")
+
+PRESENCIA_TTL_SEG = 60
+PRESENCIA_LATIDO_SEG = 20
+PERSISTENCIA_INTERVALO_SEG = 2
+PERSISTENCIA_LOTE = 500
+BARRIDO_INTERVALO_SEG = PRESENCIA_TTL_SEG
+_PREFIJO = "presencia:u:"
+_PREFIJO_HTTP = "presencia:http:"
+
+
+class _PresenciaMemoria:
+    def __init__(self):
+        self._sids: dict = {}   # { usuario_id: { sid: expira_en } }
+        self._http: dict = {}   # { usuario_id: expira_en } (marcar_online por HTTP)
+
+    def _vivos(self, uid: str) -> dict:
+        ahora = time.time()
+        sids = self._sids.get(uid, {})
+        for sid in [s for s, exp in sids.items() if exp <= ahora]:
+            del sids[sid]
+        if not sids:
+            self._sids.pop(uid, None)
+        return sids
+
+    async def conectar(self, uid: str, sid: str) -> int:
+        self._vivos(uid)
+        self._sids.setdefault(uid, {})[sid] = time.time() + PRESENCIA_TTL_SEG
+        return len(self._sids[uid])
+
+    async def desconectar(self, uid: str, sid: str) -> int:
+        self._sids.get(uid, {}).pop(sid, None)
+        return len(self._vivos(uid))
+
+    async def latido(self, pares: Iterable[tuple]):
+        expira = time.time() + PRESENCIA_TTL_SEG
+        for uid, sid in pares:
+            self._sids.setdefault(uid, {})[sid] = expira
+
+    async def sids_for(self, uids: Iterable[str]) -> dict:
+        return {uid: list(self._vivos(uid)) for uid in uids}
+
+    async def marcar_http(self, uid: str, activo: bool):
+        if activo:
+            self._http[uid] = time.time() + PRESENCIA_TTL_SEG
+        else:
+            self._http.pop(uid, None)
+
+    async def con_marca_http(self, uids: Iterable[str]) -> set:
+        ahora = time.time()
+        return {uid for uid in uids if self._http.get(uid, 0) > ahora}
+
+
+class _PresenciaRedis:
+    def __init__(self, url: str):
+        import redis.asyncio as aioredis
+        self._redis = aioredis.from_url(url, decode_responses=True)
+
+    async def conectar(self, uid: str, sid: str) -> int:
+        ahora = time.time()
+        clave = _PREFIJO + uid
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.zremrangebyscore(clave, "-inf", ahora)
+        pipe.zadd(clave, {sid: ahora + PRESENCIA_TTL_SEG})
+        pipe.expire(clave, PRESENCIA_TTL_SEG)
+        pipe.zcard(clave)
+        return (await pipe.execute())[-1]
+
+    async def desconectar(self, uid: str, sid: str) -> int:
+        clave = _PREFIJO + uid
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.zrem(clave, sid)
+        pipe.zremrangebyscore(clave, "-inf", time.time())
+        pipe.zcard(clave)
+        return (await pipe.execute())[-1]
+
+    async def latido(self, pares: Iterable[tuple]):
+        expira = time.time() + PRESENCIA_TTL_SEG
+        pipe = self._redis.pipeline(transaction=False)
+        for uid, sid in pares:
+            pipe.zadd(_PREFIJO + uid, {sid: expira})
+            pipe.expire(_PREFIJO + uid, PRESENCIA_TTL_SEG)
+        await pipe.execute()
+
+    async def sids_for(self, uids: Iterable[str]) -> dict:
+        uids = list(uids)
+        ahora = time.time()
+        pipe = self._redis.pipeline(transaction=False)
+        for uid in uids:
+            pipe.zrangebyscore(_PREFIJO + uid, ahora, "+inf")
+        return dict(zip(uids, await pipe.execute()))
+
+    async def marcar_http(self, uid: str, activo: bool):
+        if activo:
+            await self._redis.set(_PREFIJO_HTTP + uid, 1, ex=PRESENCIA_TTL_SEG)
+        else:
+            await self._redis.delete(_PREFIJO_HTTP + uid)
+
+    async def con_marca_http(self, uids: Iterable[str]) -> set:
+        uids = list(uids)
+        pipe = self._redis.pipeline(transaction=False)
+        for uid in uids:
+            pipe.exists(_PREFIJO_HTTP + uid)
+        return {uid for uid, existe in zip(uids, await pipe.execute()) if existe}
+
+
+class RegistroPresencia:
+    """Fachada: sids locales de este worker + almacén compartido con TTL."""
+
+    def __init__(self, redis_url: Optional[str] = None):
+        redis_url = redis_url or config.REDIS_URL
+        self._almacen = _PresenciaRedis(redis_url) if redis_url else _PresenciaMemoria()
+        self._locales: dict = {}   # { sid: usuario_id } conectados a ESTE worker
+
+    async def conectar(self, usuario_id, sid: str) -> bool:
+        """Registra el sid. True si es el primer dispositivo del usuario."""
+        uid = str(usuario_id)
+        self._locales[sid] = uid
+        return await self._almacen.conectar(uid, sid) == 1
+
+    async def desconectar(self, sid: str):
+        """
+        Quita el sid. Devuelve el usuario si era su último dispositivo
+        (→ pasa a offline), si no None.
+        """
+        uid = self._locales.pop(sid, None)
+        if uid is None:
+            return None
+        restantes = await self._almacen.desconectar(uid, sid)
+        return uid if restantes == 0 else None
+
+    async def sids_for(self, usuarios_ids: Iterable) -> dict:
+        """{ usuario_id: [sids] } de todos los workers, en una sola ida."""
+        uids = list(dict.fromkeys(str(u) for u in usuarios_ids))
+        if not uids:
+            return {}
+        return await self._almacen.sids_for(uids)
+
+    async def is_online(self, usuarios_ids: Iterable) -> dict:
+        """{ usuario_id: bool } por lote."""
+        return {uid: bool(sids) for uid, sids in (await self.sids_for(usuarios_ids)).items()}
+
+    async def marcar_http(self, usuario_id, activo: bool = True):
+        """
+        Presencia anunciada por HTTP (sin sid): vive PRESENCIA_TTL_SEG y no
+        cuenta como dispositivo, solo evita que el barrido lo pase a offline.
+        """
+        await self._almacen.marcar_http(str(usuario_id), activo)
+
+    async def caidos(self, usuarios_ids: Iterable) -> list:
+        """Los que ya no tienen ningún sid vivo en ningún worker ni marca HTTP."""
+        sin_sids = [uid for uid, online in (await self.is_online(usuarios_ids)).items() if not online]
+        if not sin_sids:
+            return []
+        marcados = await self._almacen.con_marca_http(sin_sids)
+        return [uid for uid in sin_sids if uid not in marcados]
+
+    async def latir(self):
+        if self._locales:
+            await self._almacen.latido([(uid, sid) for sid, uid in self._locales.items()])
+
+    async def bucle_latidos(self):
+        """Tarea de fondo: mantiene vivos los sids de este worker."""
+        while True:
+            await asyncio.sleep(PRESENCIA_LATIDO_SEG)
+            try:
+                await self.latir()
+            except Exception as e:
+                logger.warning("[presencia] latido fallido: %s", e)
+
+
+class PersistenciaPresencia:
+    """
+    Write-behind de usuarios.en_linea / ultima_conexion.
+    Conectar o desconectar no abre transacción: se anota y el bucle lo
+    vuelca cada PERSISTENCIA_INTERVALO_SEG con un UPDATE ... FROM (VALUES ...).
+    """
+
+    def __init__(self):
+        # { usuario_id: (en_linea, ultima_conexion | None) } — gana el último
+        self._pendientes: dict = {}
+        self._lock = asyncio.Lock()
+
+    def anotar(self, usuario_id, en_linea: bool, ultima_conexion: Optional[datetime] = None):
+        self._pendientes[str(usuario_id)] = (en_linea, ultima_conexion)
+
+    async def volcar(self):
+        async with self._lock:
+            if not self._pendientes:
+                return
+            lote, self._pendientes = self._pendientes, {}
+
+            filas = list(lote.items())
+            try:
+                async with SessionLocal() as db:
+                    for i in range(0, len(filas), PERSISTENCIA_LOTE):
+                        v = values(
+                            column("id", UUID(as_uuid=False)),
+                            column("en_linea", Boolean),
+                            column("ultima_conexion", DateTime),
+                            name="v",
+                        ).data([
+                            (uid, en_linea, ultima)
+                            for uid, (en_linea, ultima) in filas[i:i + PERSISTENCIA_LOTE]
+                        ])
+                        await db.execute(
+                            update(Usuario)
+                            .where(Usuario.id == v.c.id)
+                            .values(
+                                en_linea=v.c.en_linea,
+                                ultima_conexion=func.coalesce(v.c.ultima_conexion, Usuario.ultima_conexion),
+                            )
+                            .execution_options(synchronize_session=False)
+                        )
+                    await db.commit()
+            except Exception:
+                # Reencolar lo que no haya sido reemplazado por algo más nuevo
+                for uid, estado in lote.items():
+                    self._pendientes.setdefault(uid, estado)
+                raise
+
+    async def barrer_caidos(self, registro: RegistroPresencia) -> list:
+        """
+        en_linea=true en la BD sin ningún sid vivo (su worker cayó y los
+        sids caducaron): los pasa a offline. Devuelve los que ESTE worker
+        cambió; el UPDATE condicional hace que con varios workers barriendo
+        cada usuario se anuncie una sola vez.
+        """
+        caidos = []
+        desde = None
+        while True:
+            async with SessionLocal() as db:
+                q = select(Usuario.id).where(Usuario.en_linea.is_(True))
+                if desde is not None:
+                    q = q.where(Usuario.id > desde)
+                ids = [str(i) for i in (await db.execute(q.order_by(Usuario.id).limit(PERSISTENCIA_LOTE))).scalars()]
+                if not ids:
+                    return caidos
+                desde = ids[-1]
+
+                # Lo anotado aquí aún no se volcó: manda lo anotado
+                sin_sids = [uid for uid in await registro.caidos(ids) if uid not in self._pendientes]
+                if sin_sids:
+                    res = await db.execute(
+                        update(Usuario)
+                        .where(Usuario.id.in_(sin_sids), Usuario.en_linea.is_(True))
+                        .values(en_linea=False, ultima_conexion=datetime.utcnow())
+                        .returning(Usuario.id)
+                        .execution_options(synchronize_session=False)
+                    )
+                    cambiados = [str(i) for i in res.scalars()]
+                    await db.commit()
+
+                    # Reconectó entre la consulta y el UPDATE: vuelve a en_linea
+                    volvieron = set(cambiados) - set(await registro.caidos(cambiados))
+                    for uid in volvieron:
+                        self.anotar(uid, en_linea=True)
+                    caidos.extend(uid for uid in cambiados if uid not in volvieron)
+
+            if len(ids) < PERSISTENCIA_LOTE:
+                return caidos
+
+    async def bucle(self):
+        """Tarea de fondo: retraso máximo ≈ PERSISTENCIA_INTERVALO_SEG."""
+        while True:
+            await asyncio.sleep(PERSISTENCIA_INTERVALO_SEG)
+            try:
+                await self.volcar()
+            except Exception as e:
+                logger.warning("[presencia] volcado a BD fallido: %s", e)
+
+
+presencia = RegistroPresencia()
+persistencia = PersistenciaPresencia()
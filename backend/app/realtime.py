@@ -1,8 +1,51 @@
 # app/realtime.py
+import asyncio
+import logging
+import time
+import jwt
 import socketio
+from http.cookies import CookieError, SimpleCookie
+from typing import Iterable, Optional
+from uuid import UUID
 from datetime import datetime, timezone
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from app.core.config import config
 from app.db.sesion import SessionLocal
-from app.db.modelos import Usuario
+from app.db.modelos import MiembroConversacion, Usuario
+from app.db.interes import interesados_en
+from app.presencia import BARRIDO_INTERVALO_SEG, presencia, persistencia
+from app.bitacora import bitacora
+
+logger = logging.getLogger("app.realtime")
+
+
+# ================================================================
+#  MANAGER DE CLIENTES (fan-out entre workers)
+# ================================================================
+def crear_client_manager(tipo: str = None, url: str = None):
+    """
+    Con varios workers (gunicorn / UVICORN_WORKERS) cada proceso solo
+    conoce sus propios sockets. El manager Redis publica cada emit por
+    pub/sub y todos los workers lo entregan a sus sids / rooms (skip_sid
+    incluido). "memoria" = comportamiento de un solo proceso.
+    """
+    tipo = (tipo or config.SOCKETIO_MANAGER or ("redis" if config.REDIS_URL else "memoria")).lower()
+    url = url or config.REDIS_URL
+
+    if tipo == "redis":
+        if not url:
+            raise RuntimeError("SOCKETIO_MANAGER=redis requiere REDIS_URL")
+        logger.info("[socketio] manager Redis (canal %s)", config.SOCKETIO_CANAL)
+        return socketio.AsyncRedisManager(url, channel=config.SOCKETIO_CANAL)
+
+    if tipo == "memoria":
+        logger.warning("[socketio] manager en memoria: los emits no cruzan workers")
+        return socketio.AsyncManager()
+
+    raise ValueError(f"SOCKETIO_MANAGER desconocido: {tipo}")
+
 
 # ================================================================
 #  SERVIDOR SOCKET.IO
@@ -12,6 +55,7 @@ sio = socketio.AsyncServer(
     cors_allowed_origins="*",
     ping_timeout=25,
     ping_interval=10,
+    client_manager=crear_client_manager(),
 )
 
 app_sio = socketio.ASGIApp(sio)
@@ -21,33 +65,156 @@ app_sio = socketio.ASGIApp(sio)
 # ================================================================
 USER_ROOM = lambda uid: f"user:{uid}"
 CONV_ROOM = lambda cid: f"conv:{cid}"
+QR_ROOM = lambda token: f"qr:{token}"
 
-# Memoria local: estado de usuarios
-online_users = {}  
-# { usuario_id: { "sid": SID, "last_seen": datetime } }
+# Presencia (varios sids por usuario, compartida entre workers): app.presencia
 
 
 # ================================================================
-#  🔵 BROADCAST DE PRESENCIA
+#  📣 FAN-OUT: un evento → varias rooms / usuarios
 # ================================================================
+FANOUT_LENTO_MS = 100
+
+
+async def difundir(
+    evento: str,
+    payload,
+    rooms: Iterable[str] = (),
+    usuarios: Iterable = (),
+    skip_sid=None,
+) -> dict:
+    """
+    Punto único de fan-out. Junta rooms + USER_ROOM(usuarios) en UN emit:
+    el paquete se serializa una vez, cada sid lo recibe una sola vez
+    aunque esté en varias de las rooms (conv:X y user:Y) y los envíos
+    salen en paralelo. Con el manager Redis se publica una vez y cada
+    worker entrega a sus sids.
+
+    Devuelve { rooms, ms }.
+    """
+    destinos = list(dict.fromkeys([*rooms, *(USER_ROOM(u) for u in usuarios)]))
+    if not destinos:
+        return {"rooms": 0, "ms": 0.0}
+
+    inicio = time.perf_counter()
+    await sio.emit(evento, payload, to=destinos, skip_sid=skip_sid)
+    ms = (time.perf_counter() - inicio) * 1000
+
+    nivel = logging.WARNING if ms > FANOUT_LENTO_MS else logging.DEBUG
+    if logger.isEnabledFor(nivel):
+        # Contar sids recorre todas las rooms: solo si el log va a salir
+        sids = sum(1 for _ in sio.manager.get_participants("/", destinos))
+        logger.log(nivel, "[fanout] %s → %d rooms, %d sids locales, %.1f ms", evento, len(destinos), sids, ms)
+
+    return {"rooms": len(destinos), "ms": ms}
+
+
+# ================================================================
+#  🔵 BROADCAST DE PRESENCIA (solo a interesados, agrupado por tick)
+# ================================================================
+PRESENCIA_TICK_SEG = 0.5
+
+# Cambios pendientes de este tick: { usuario_id: (online, last_seen) }
+_presencia_pendiente: dict = {}
+_tick_presencia = None
+
+
 async def broadcast_user_status(usuario_id: str, online: bool):
-    payload = {
-        "usuario_id": str(usuario_id),
-        "online": online,
-        "last_seen": datetime.now(timezone.utc).isoformat(),
-    }
+    """
+    Encola el cambio; al cerrar el tick se emite UNA vez el estado final
+    de cada usuario (varios cambios dentro del tick = un solo aviso).
+    """
+    global _tick_presencia
+    _presencia_pendiente[str(usuario_id)] = (online, datetime.now(timezone.utc).isoformat())
 
-    await sio.emit("usuario_estado", payload)
-    print(f"📡 Estado usuario {usuario_id}: {'ONLINE' if online else 'OFFLINE'}")
+    if _tick_presencia is None or _tick_presencia.done():
+        _tick_presencia = asyncio.create_task(_cerrar_tick_presencia())
+
+
+async def _cerrar_tick_presencia():
+    # Sigue mientras lleguen cambios: lo encolado durante los awaits de un
+    # tick sale en el siguiente (mientras esta tarea vive no se crea otra)
+    while _presencia_pendiente:
+        await asyncio.sleep(PRESENCIA_TICK_SEG)
+
+        cambios = dict(_presencia_pendiente)
+        _presencia_pendiente.clear()
+
+        try:
+            await _anunciar_presencia(cambios)
+        except Exception as e:
+            logger.warning("[presencia] broadcast fallido: %s", e)
+
+
+async def _anunciar_presencia(cambios: dict):
+    async with SessionLocal() as db:
+        interesados = await interesados_en(db, cambios.keys())
+
+    # Solo a quien tenga algún dispositivo conectado
+    todos = set().union(*interesados.values())
+    conectados = await presencia.is_online(todos)
+
+    for uid, (online, last_seen) in cambios.items():
+        rooms = [USER_ROOM(i) for i in interesados.get(uid, ()) if conectados.get(i)]
+        if not rooms:
+            continue
+
+        await difundir(
+            "usuario_estado",
+            {"usuario_id": uid, "online": online, "last_seen": last_seen},
+            rooms=rooms
+        )
+        print(f"📡 Estado usuario {uid}: {'ONLINE' if online else 'OFFLINE'} → {len(rooms)} interesados")
+
+
+async def bucle_barrido_presencia():
+    """
+    Tarea de fondo: anuncia offline a los usuarios cuyo worker cayó
+    (sus sids caducaron sin pasar por disconnect).
+    """
+    while True:
+        await asyncio.sleep(BARRIDO_INTERVALO_SEG)
+        try:
+            for uid in await persistencia.barrer_caidos(presencia):
+                await broadcast_user_status(uid, online=False)
+        except Exception as e:
+            logger.warning("[presencia] barrido fallido: %s", e)
 
 
 # ================================================================
 #  🔵 CONEXIÓN SOCKET.IO
 # ================================================================
+def _usuario_del_token(environ: dict, auth) -> Optional[dict]:
+    """JWT del handshake (auth.token o cookie auth_token) → {usuario_auth, auth_exp}."""
+    token = auth.get("token") if isinstance(auth, dict) else None
+    if not token:
+        try:
+            cookies = SimpleCookie(environ.get("HTTP_COOKIE", ""))
+        except CookieError:
+            return None
+        token = cookies["auth_token"].value if "auth_token" in cookies else None
+    if not token:
+        return None
+
+    try:
+        payload = jwt.decode(token, config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+
+    if not payload.get("sub"):
+        return None
+    return {"usuario_auth": str(payload["sub"]), "auth_exp": payload.get("exp")}
+
+
 @sio.event
-async def connect(sid, environ):
+async def connect(sid, environ, auth=None):
     print(f"🟢 Cliente conectado SID={sid}")
 
+    # Autenticación una sola vez por conexión (la usan los eventos que escriben)
+    autenticado = _usuario_del_token(environ, auth)
+    if autenticado:
+        await sio.save_session(sid, autenticado)
+
 
 # ================================================================
 #  🔴 DESCONEXIÓN
@@ -64,25 +231,13 @@ async def disconnect(sid, reason=None):
     if not session or "usuario_id" not in session:
         return
 
-    uid = session["usuario_id"]
-    info = online_users.get(uid)
-
-    # Si el SID no coincide, no marcar offline
-    if not info or info.get("sid") != sid:
+    # Solo pasa a offline cuando se cierra su ÚLTIMO dispositivo
+    uid = await presencia.desconectar(sid)
+    if not uid:
         return
 
-    now = datetime.utcnow()
-
-    # Guardar en memoria
-    online_users[uid] = {"sid": None, "last_seen": now}
-
-    # Guardar en BD
-    async with SessionLocal() as db:
-        u = await db.get(Usuario, uid)
-        if u:
-            u.en_linea = False
-            u.ultima_conexion = now
-            await db.commit()
+    # Guardar en BD (diferido, en lote)
+    persistencia.anotar(uid, en_linea=False, ultima_conexion=datetime.utcnow())
 
     await broadcast_user_status(uid, online=False)
 
@@ -92,43 +247,189 @@ async def disconnect(sid, reason=None):
 # ================================================================
 @sio.event
 async def registrar_usuario(sid, data):
-    uid = data.get("usuario_id")
-    if not uid:
-        return
+    async with sio.session(sid) as sesion_sio:
+        # Si la conexión trae JWT, manda el usuario del token
+        autenticado = sesion_sio.get("usuario_auth")
+        uid = autenticado or data.get("usuario_id")
+        if not uid:
+            return
+
+        # Guardar sesión
+        sesion_sio["usuario_id"] = uid
 
-    # Guardar sesión
-    await sio.save_session(sid, {"usuario_id": uid})
     await sio.enter_room(sid, USER_ROOM(uid))
 
-    # Memoria
-    online_users[uid] = {
-        "sid": sid,
-        "last_seen": datetime.utcnow(),
-    }
+    # Reconexión: reenviar solo lo que se perdió mientras no estaba.
+    # Solo con JWT: el usuario_id del payload lo puede poner cualquiera
+    if autenticado and data.get("ultimo_eid") is not None:
+        await reenviar_perdidos(sid, autenticado, data["ultimo_eid"], data.get("conversaciones") or [])
+
+    # Presencia compartida (una pestaña más no vuelve a anunciarlo)
+    primero = await presencia.conectar(uid, sid)
 
     print(f"👤 Usuario {uid} registrado → room {USER_ROOM(uid)}")
 
-    # BD
-    async with SessionLocal() as db:
-        u = await db.get(Usuario, uid)
-        if u:
-            u.en_linea = True
-            await db.commit()
+    if not primero:
+        return
+
+    # BD (diferido, en lote)
+    persistencia.anotar(uid, en_linea=True)
 
     await broadcast_user_status(uid, online=True)
 
 
+# ================================================================
+#  ⏪ REENVÍO DE EVENTOS PERDIDOS (reconexión)
+# ================================================================
+async def reenviar_perdidos(sid, uid: str, ultimo_eid, conversaciones: list):
+    """
+    Un solo "eventos_perdidos" con lo dirigido a user:uid y a las
+    conversaciones que el cliente tenía abiertas, posterior a ultimo_eid.
+    Si el hueco no se puede cubrir → { resincronizar: true }.
+    """
+    try:
+        ultimo_eid = int(ultimo_eid)
+    except (TypeError, ValueError):
+        return
+
+    # Solo las conversaciones de las que es miembro
+    conversaciones = await _conversaciones_de(uid, conversaciones)
+    rooms = [USER_ROOM(uid)] + [CONV_ROOM(c) for c in conversaciones]
+    try:
+        eventos = await bitacora.perdidos(rooms, ultimo_eid)
+    except Exception as e:
+        logger.warning("[bitacora] reenvío fallido: %s", e)
+        eventos = None
+
+    if eventos is None:
+        await sio.emit("eventos_perdidos", {"resincronizar": True, "eventos": []}, to=sid)
+        return
+
+    if eventos:
+        await sio.emit(
+            "eventos_perdidos",
+            {
+                "resincronizar": False,
+                "eventos": [
+                    {"eid": eid, "evento": evento, "payload": payload}
+                    for eid, evento, payload in eventos
+                ],
+            },
+            to=sid,
+        )
+    print(f"⏪ Usuario {uid}: {len(eventos)} eventos reenviados desde eid {ultimo_eid}")
+
+
 # ================================================================
 #  💬 SUSCRIBIR A CONVERSACIÓN NORMAL (chat)
 # ================================================================
+async def _conversaciones_de(uid: str, conversaciones_ids: Iterable) -> list:
+    """De esos ids, los de conversaciones donde uid es miembro activo (1 query)."""
+    ids = set()
+    for c in conversaciones_ids or ():
+        try:
+            ids.add(UUID(str(c)))
+        except ValueError:
+            continue
+    if not ids:
+        return []
+
+    async with SessionLocal() as db:
+        q = await db.execute(
+            select(MiembroConversacion.conversacion_id).where(
+                MiembroConversacion.usuario_id == uid,
+                MiembroConversacion.conversacion_id.in_(ids),
+                MiembroConversacion.activo.is_(True),
+            )
+        )
+        return [str(c) for c in q.scalars().all()]
+
+
 @sio.event
 async def suscribir_conversacion(sid, data):
-    cid = str(data.get("conversacion_id"))
-    if not cid:
-        return
+    """
+    Entra en conv:{id} (y con eso en lo que se le reenvía al reconectar):
+    solo con JWT y siendo miembro de la conversación.
+    """
+    sesion_sio = await sio.get_session(sid)
+    uid = sesion_sio.get("usuario_auth")
+    if not uid:
+        return {"ok": False, "status": 401}
+
+    permitidas = await _conversaciones_de(uid, [(data or {}).get("conversacion_id")])
+    if not permitidas:
+        return {"ok": False, "status": 403}
 
+    cid = permitidas[0]
     await sio.enter_room(sid, CONV_ROOM(cid))
     print(f"💬 SID={sid} suscrito a conversación {cid}")
+    return {"ok": True}
+
+
+# ================================================================
+#  🔳 LOGIN QR: la página espera los cambios de estado de su token
+# ================================================================
+@sio.event
+async def suscribir_qr(sid, data):
+    """
+    data = { token }. La página de login entra en qr:{token} y recibe
+    "estado_qr" en cada transición (pendiente → pendiente_correo →
+    autenticado) en lugar de sondear /verificar_estado_qr.
+    Al regenerar el QR se sale de la room del token anterior.
+    """
+    token = str((data or {}).get("token") or "")
+    if not token:
+        return {"ok": False}
+
+    async with sio.session(sid) as sesion_sio:
+        anterior = sesion_sio.get("qr_token")
+        if anterior and anterior != token:
+            await sio.leave_room(sid, QR_ROOM(anterior))
+        sesion_sio["qr_token"] = token
+
+    await sio.enter_room(sid, QR_ROOM(token))
+    return {"ok": True}
+
+
+# ================================================================
+#  📨 ENVIAR MENSAJE POR SOCKET (con ack)
+# ================================================================
+@sio.event
+async def enviar_mensaje(sid, data):
+    """
+    data = { conversacion_id, cuerpo, mensaje_id_respuesta?, mencionados?, cliente_id? }
+    ack  = { ok: true, mensaje: {id, seq, creado_en, ...} }
+         | { ok: false, status, error }   (401 → reintentar por HTTP)
+    Misma lógica que POST /conversaciones/{id}/mensajes, sin cookie ni
+    lectura del usuario por mensaje: el JWT se validó al conectar.
+    """
+    from app.api.conversaciones import publicar_mensaje
+    from app.schemas.mensaje import MensajeCrear
+
+    sesion_sio = await sio.get_session(sid)
+    uid = sesion_sio.get("usuario_auth")
+    exp = sesion_sio.get("auth_exp")
+    if not uid or (exp and exp < time.time()):
+        return {"ok": False, "status": 401, "error": "No autenticado"}
+
+    try:
+        datos = dict(data or {})
+        conversacion_id = UUID(str(datos.pop("conversacion_id", None)))
+        payload = MensajeCrear.model_validate(datos)
+    except ValueError as e:
+        return {"ok": False, "status": 422, "error": str(e)}
+
+    async with SessionLocal() as db:
+        try:
+            mensaje = await publicar_mensaje(db, uid, conversacion_id, payload)
+        except HTTPException as e:
+            return {"ok": False, "status": e.status_code, "error": e.detail}
+        except Exception:
+            # Sin ack el cliente esperaría ACK_ENVIO_MS; así ve el error al momento
+            logger.exception("[SOCKET] enviar_mensaje falló (sid=%s, conv=%s)", sid, conversacion_id)
+            return {"ok": False, "status": 500, "error": "Error interno"}
+
+    return {"ok": True, "mensaje": jsonable_encoder(mensaje)}
 
 
 # ================================================================
@@ -151,18 +452,19 @@ async def emit_mensaje_guardado(mensaje_dict: dict):
         print("❌ Falta conversacion_id en emit_mensaje_guardado")
         return
 
-    await sio.emit(
+    await difundir(
         "mensaje_recibido",
         {
             "id": mensaje_dict.get("id"),
             "cuerpo": mensaje_dict.get("cuerpo"),
             "creado_en": mensaje_dict.get("creado_en"),
+            "seq": mensaje_dict.get("seq"),
             "conversacion_id": mensaje_dict.get("conversacion_id"),
             "usuario_id": mensaje_dict.get("usuario_id") 
                 or mensaje_dict.get("remitente_id"),
             "tipo": "mensaje",
         },
-        room=CONV_ROOM(str(cid))
+        rooms=[CONV_ROOM(str(cid))]
     )
 
 
@@ -170,10 +472,13 @@ async def emit_mensaje_guardado(mensaje_dict: dict):
 #  🔥🔥🔥 SEÑALIZACIÓN WEBRTC — LLAMADAS / VIDEOLLAMADAS
 # ================================================================
 
-# Obtener SID de un usuario
-def _get_sid_for_user(user_id: str):
-    info = online_users.get(str(user_id))
-    return info.get("sid") if info else None
+# Emitir a TODOS los dispositivos de un usuario (cualquier worker).
+# Devuelve False si no tiene ninguno conectado.
+async def _emit_a_dispositivos(evento: str, data, user_id: str) -> bool:
+    sids = (await presencia.sids_for([user_id])).get(str(user_id), [])
+    if sids:
+        await difundir(evento, data, rooms=sids)
+    return bool(sids)
 
 # 🔔 LLAMADA ENTRANTE (notificación 1 a 1) — VERSIÓN COMPATIBLE (REEMPLAZAR)
 @sio.event
@@ -232,14 +537,13 @@ async def incoming_call(sid, data):
 
         print("📡 incoming_call payload FINAL:", payload)
 
-        # 3️⃣ Emitir a LOS DOS sitios:
+        # 3️⃣ Emitir a LOS DOS sitios (un solo envío por sid aunque esté en ambos):
         # - room del usuario (user:ID) -> para clientes conectados en general
         # - room de la conversación (conv:ID) -> para clientes suscritos a la conversación
         room_user = USER_ROOM(to_uid)
         room_conv = CONV_ROOM(conv_id)
 
-        await sio.emit("incoming_call", payload, room=room_user)
-        await sio.emit("incoming_call", payload, room=room_conv)
+        await difundir("incoming_call", payload, rooms=[room_user, room_conv])
 
         print(f"📞 incoming_call enviado a {room_user} y {room_conv}")
 
@@ -288,12 +592,8 @@ async def rtc_offer(sid, data):
     if not to_uid:
         return
 
-    target = _get_sid_for_user(to_uid)
-    if not target:
+    if not await _emit_a_dispositivos("rtc_offer", data, to_uid):
         print(f"⚠️ rtc_offer: destino {to_uid} no disponible")
-        return
-
-    await sio.emit("rtc_offer", data, room=target)
 
 
 # 3️⃣ ANSWER
@@ -303,12 +603,8 @@ async def rtc_answer(sid, data):
     if not to_uid:
         return
 
-    target = _get_sid_for_user(to_uid)
-    if not target:
+    if not await _emit_a_dispositivos("rtc_answer", data, to_uid):
         print(f"⚠️ rtc_answer: destino {to_uid} no disponible")
-        return
-
-    await sio.emit("rtc_answer", data, room=target)
 
 
 # 4️⃣ ICE
@@ -318,12 +614,8 @@ async def rtc_ice_candidate(sid, data):
     if not to_uid:
         return
 
-    target = _get_sid_for_user(to_uid)
-    if not target:
+    if not await _emit_a_dispositivos("rtc_ice_candidate", data, to_uid):
         print(f"⚠️ rtc_ice_candidate: usuario {to_uid} no conectado")
-        return
-
-    await sio.emit("rtc_ice_candidate", data, room=target)
 
 
 # 5️⃣ LEAVE
@@ -46,6 +46,11 @@ class MensajeCrear(MensajeBase):
         description="Usuarios mencionados en el mensaje"
     )
 
+    cliente_id: Optional[UUID] = Field(
+        default=None,
+        description="Id generado por el cliente; reintentar con el mismo no duplica el mensaje"
+    )
+
 
 # ============================================================
 # LEER MENSAJE (AHORA COMPATIBLE CON REMITENTE_ID NULL)
@@ -67,6 +72,10 @@ class MensajeLeer(MensajeBase):
     )
 
     creado_en: datetime = Field(...)
+    seq: Optional[int] = Field(
+        None,
+        description="Posición del mensaje en su conversación (1, 2, 3… sin huecos)"
+    )
     editado_en: Optional[datetime] = None
     borrado_en: Optional[datetime] = None
     mensaje_id_respuesta: Optional[UUID] = None
@@ -0,0 +1,63 @@
+# bench/_comun.py
+"""
+Utilidades compartidas por los benchmarks de bench/.
+
+- Todo corre dentro de UNA transacción que se deshace al final: lo sembrado
+  no queda en la BD. Aun así, apuntar DATABASE_URL a una BD de pruebas con
+  las migraciones aplicadas (alembic upgrade head).
+- ContadorQueries cuenta las sentencias enviadas a Postgres.
+- medir() devuelve p50 / p95 en ms y queries por llamada.
+"""
+import statistics
+import time
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.sesion import engine
+
+
+@asynccontextmanager
+async def sesion_desechable():
+    """AsyncSession cuyos commits son savepoints de una transacción que se deshace."""
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        sesion = AsyncSession(bind=conn, expire_on_commit=False, join_transaction_mode="create_savepoint")
+        try:
+            yield sesion
+        finally:
+            await sesion.close()
+            await trans.rollback()
+
+
+class ContadorQueries:
+    def __init__(self):
+        self.n = 0
+
+    def _contar(self, *args):
+        self.n += 1
+
+    def __enter__(self):
+        event.listen(engine.sync_engine, "before_cursor_execute", self._contar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine.sync_engine, "before_cursor_execute", self._contar)
+
+
+async def medir(llamada, repeticiones: int) -> dict:
+    """Una llamada de calentamiento y `repeticiones` medidas."""
+    await llamada()
+    tiempos = []
+    with ContadorQueries() as contador:
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            await llamada()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return {
+        "p50": statistics.median(tiempos),
+        "p95": tiempos[int(0.95 * (len(tiempos) - 1))],
+        "queries": contador.n / repeticiones,
+    }
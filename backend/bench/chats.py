@@ -0,0 +1,99 @@
+# bench/chats.py
+"""
+GET /chats/{usuario_id} (obtener_chats) con cada vez más chats.
+
+Mide el camino actual, que lee la tabla resumenes_conversacion (el read
+model por miembro); las queries agrupadas que lo precedían ya no existen
+en el árbol. Las queries por llamada deben quedar constantes (resumen +
+miembros) y la latencia crecer solo con el tamaño de la respuesta, no
+con idas a la BD.
+
+    cd backend
+    python -m bench.chats                       # 10, 50, 100, 300 chats
+    python -m bench.chats --chats 100 1000 --repeticiones 50
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from app.api.conversaciones import obtener_chats
+from app.db.modelos import Conversacion, Mensaje, MiembroConversacion, ResumenConversacion, Usuario
+from bench._comun import medir, sesion_desechable
+
+MENSAJES_POR_CHAT = 3
+
+
+def _usuario() -> Usuario:
+    # telefono es único: prefijo propio para no chocar con datos reales
+    return Usuario(id=uuid.uuid4(), telefono=f"b{uuid.uuid4().hex[:15]}", verificado=True)
+
+
+async def _sembrar_chats(sesion, yo: Usuario, cuantos: int):
+    """Chats 1 a 1 de `yo` con usuarios nuevos, con mensajes y resumen."""
+    otros = [_usuario() for _ in range(cuantos)]
+    convs = [Conversacion(id=uuid.uuid4(), es_grupo=False, creador_id=yo.id) for _ in otros]
+    sesion.add_all(otros)
+    await sesion.flush()
+    sesion.add_all(convs)
+    await sesion.flush()
+
+    base = datetime.utcnow() - timedelta(days=1)
+    ultimos = []
+    for i, (otro, conv) in enumerate(zip(otros, convs)):
+        sesion.add_all([
+            MiembroConversacion(conversacion_id=conv.id, usuario_id=yo.id),
+            MiembroConversacion(conversacion_id=conv.id, usuario_id=otro.id),
+        ])
+        mensajes = [
+            Mensaje(
+                id=uuid.uuid4(),
+                conversacion_id=conv.id,
+                remitente_id=otro.id if j % 2 == 0 else yo.id,
+                cuerpo=f"mensaje {j} del chat {i}",
+                creado_en=base + timedelta(seconds=i * MENSAJES_POR_CHAT + j),
+            )
+            for j in range(MENSAJES_POR_CHAT)
+        ]
+        sesion.add_all(mensajes)
+        ultimos.append((conv, mensajes[-1]))
+    await sesion.flush()
+
+    sesion.add_all([
+        ResumenConversacion(
+            conversacion_id=conv.id,
+            usuario_id=yo.id,
+            ultimo_mensaje_id=msg.id,
+            ultimo_mensaje_preview=msg.cuerpo,
+            ultimo_mensaje_en=msg.creado_en,
+            no_leidos=1,
+            ultima_actividad=msg.creado_en,
+        )
+        for conv, msg in ultimos
+    ])
+    await sesion.flush()
+
+
+async def main(cantidades: list, repeticiones: int):
+    async with sesion_desechable() as sesion:
+        yo = _usuario()
+        sesion.add(yo)
+        await sesion.flush()
+
+        print(f"{'chats':>7} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8}")
+        sembrados = 0
+        for cantidad in sorted(cantidades):
+            await _sembrar_chats(sesion, yo, cantidad - sembrados)
+            sembrados = cantidad
+            sesion.expunge_all()
+
+            r = await medir(lambda: obtener_chats(str(yo.id), sesion), repeticiones)
+            print(f"{cantidad:>7} {r['p50']:>9.2f} {r['p95']:>9.2f} {r['queries']:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, nargs="+", default=[10, 50, 100, 300])
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.chats, args.repeticiones))
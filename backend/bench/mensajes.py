@@ -0,0 +1,102 @@
+# bench/mensajes.py
+"""
+GET /conversaciones/{id}/mensajes (listar_mensajes): página keyset frente
+a OFFSET, en conversaciones cada vez más largas.
+
+Con el cursor, la primera página y una página a mitad del historial deben
+costar lo mismo sea cual sea el tamaño (ix_mensajes_conversacion_creado);
+el OFFSET equivalente crece con la profundidad.
+
+    cd backend
+    python -m bench.mensajes                    # 1k, 10k, 100k mensajes
+    python -m bench.mensajes --mensajes 1000 500000 --repeticiones 50
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import Response
+from sqlalchemy import select, text
+from starlette.requests import Request
+
+from app.api.conversaciones import _codificar_cursor, listar_mensajes
+from app.core.seguridad import crear_token_acceso
+from app.db.modelos import Conversacion, Mensaje, MiembroConversacion, Usuario
+from bench._comun import medir, sesion_desechable
+
+PAGINA = 50
+
+# Inserción masiva: el trigger trg_mensajes_seq numera cada fila
+_SQL_SEMBRAR = text("""
+    INSERT INTO mensajes (id, conversacion_id, remitente_id, cuerpo, tipo, creado_en)
+    SELECT gen_random_uuid(), :conversacion_id, :remitente_id, 'mensaje ' || g, 'normal',
+           :base + g * interval '1 second'
+    FROM generate_series(:desde, :hasta) g
+""")
+
+
+def _peticion() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""})
+
+
+async def main(cantidades: list, repeticiones: int):
+    async with sesion_desechable() as sesion:
+        yo = Usuario(id=uuid.uuid4(), telefono=f"b{uuid.uuid4().hex[:15]}", verificado=True)
+        sesion.add(yo)
+        await sesion.flush()
+        conv = Conversacion(id=uuid.uuid4(), es_grupo=False, creador_id=yo.id)
+        sesion.add(conv)
+        await sesion.flush()
+        sesion.add(MiembroConversacion(conversacion_id=conv.id, usuario_id=yo.id, creado_en=datetime(2000, 1, 1)))
+        await sesion.flush()
+
+        token = crear_token_acceso(str(yo.id))
+        base = datetime(2001, 1, 1)
+
+        async def pagina(before=None):
+            return await listar_mensajes(
+                _peticion(), Response(), conv.id,
+                before=before, after=None, after_seq=None, limit=PAGINA,
+                auth_token=token, sesion=sesion,
+            )
+
+        async def por_offset(offset: int):
+            await sesion.execute(
+                select(Mensaje)
+                .where(Mensaje.conversacion_id == conv.id)
+                .order_by(Mensaje.creado_en.desc(), Mensaje.id.desc())
+                .offset(offset)
+                .limit(PAGINA)
+            )
+
+        print(f"{'mensajes':>9} {'1ª pág ms':>10} {'mitad keyset ms':>16} {'mitad offset ms':>16}")
+        sembrados = 0
+        for cantidad in sorted(cantidades):
+            await sesion.execute(_SQL_SEMBRAR, {
+                "conversacion_id": conv.id, "remitente_id": yo.id, "base": base,
+                "desde": sembrados + 1, "hasta": cantidad,
+            })
+            sembrados = cantidad
+            await sesion.execute(text("ANALYZE mensajes"))
+
+            # Cursor del mensaje que queda a mitad del historial
+            mitad = (await sesion.execute(
+                select(Mensaje)
+                .where(Mensaje.conversacion_id == conv.id, Mensaje.seq == cantidad // 2)
+            )).scalar_one()
+            cursor = _codificar_cursor(mitad)
+            sesion.expunge_all()
+
+            primera = await medir(lambda: pagina(), repeticiones)
+            keyset = await medir(lambda: pagina(before=cursor), repeticiones)
+            offset = await medir(lambda: por_offset(cantidad - cantidad // 2), repeticiones)
+            print(f"{cantidad:>9} {primera['p50']:>10.2f} {keyset['p50']:>16.2f} {offset['p50']:>16.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mensajes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.mensajes, args.repeticiones))
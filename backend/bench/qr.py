@@ -0,0 +1,90 @@
+# bench/qr.py
+"""
+/generar_token_qr: QR por segundo en un worker y retraso del event loop,
+antes (PNG dibujado en el loop) y después (dibujar_qr en _hilos_qr, PNG y SVG).
+
+"Retraso del loop" = cuánto se atrasa un sleep de LATIDO_MS mientras se
+dibuja: es lo que esperan los sockets y las demás peticiones del worker.
+
+    cd backend
+    python -m bench.qr
+    python -m bench.qr --segundos 10 --concurrencia 32
+"""
+import argparse
+import asyncio
+import base64
+import io
+import time
+import uuid
+
+import qrcode
+
+from app.main import _hilos_qr, dibujar_qr
+
+LATIDO_MS = 10
+
+
+def _contenido() -> str:
+    return f"https://chat.ejemplo/login_qr?token={uuid.uuid4()}"
+
+
+async def _antes():
+    # Lo que hacía el handler: todo dentro del event loop
+    buf = io.BytesIO()
+    qrcode.make(_contenido()).save(buf, format="PNG")
+    base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def _despues(formato: str):
+    async def llamada():
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_hilos_qr, dibujar_qr, _contenido(), formato)
+    return llamada
+
+
+async def _correr(llamada, segundos: float, concurrencia: int) -> dict:
+    fin = time.perf_counter() + segundos
+    hechas = 0
+    retrasos = []
+
+    async def cliente():
+        nonlocal hechas
+        while time.perf_counter() < fin:
+            await llamada()
+            hechas += 1
+            await asyncio.sleep(0)  # ceder como haría una petición real
+
+    async def latido():
+        while time.perf_counter() < fin:
+            inicio = time.perf_counter()
+            await asyncio.sleep(LATIDO_MS / 1000)
+            retrasos.append((time.perf_counter() - inicio) * 1000 - LATIDO_MS)
+
+    await asyncio.gather(latido(), *(cliente() for _ in range(concurrencia)))
+    retrasos.sort()
+    return {
+        "qr_s": hechas / segundos,
+        "retraso_p50": retrasos[len(retrasos) // 2] if retrasos else 0.0,
+        "retraso_max": retrasos[-1] if retrasos else 0.0,
+    }
+
+
+async def main(segundos: float, concurrencia: int):
+    casos = [
+        ("antes (PNG en el loop)", _antes),
+        ("después PNG (hilos)", _despues("png")),
+        ("después SVG (hilos)", _despues("svg")),
+    ]
+    print(f"{'modo':<24} {'QR/s':>8} {'retraso p50 ms':>15} {'retraso máx ms':>15}")
+    for nombre, llamada in casos:
+        await llamada()  # calentamiento
+        r = await _correr(llamada, segundos, concurrencia)
+        print(f"{nombre:<24} {r['qr_s']:>8.1f} {r['retraso_p50']:>15.2f} {r['retraso_max']:>15.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--segundos", type=float, default=5)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.segundos, args.concurrencia))
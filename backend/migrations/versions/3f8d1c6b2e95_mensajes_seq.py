@@ -0,0 +1,79 @@
+"""mensajes.seq: secuencia monótona por conversación
+
+Revision ID: 3f8d1c6b2e95
+Revises: a7c4e2f9d813
+Create Date: 2025-12-09 10:14:52.301877
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8d1c6b2e95'
+down_revision: Union[str, Sequence[str], None] = 'a7c4e2f9d813'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversaciones', sa.Column('ultimo_seq', sa.BigInteger(), server_default=sa.text('0'), nullable=False))
+    op.add_column('mensajes', sa.Column('seq', sa.BigInteger(), nullable=True))
+
+    # Numerar lo existente en el orden en que se listaba (creado_en, id)
+    op.execute(sa.text("""
+        UPDATE mensajes m
+        SET seq = n.seq
+        FROM (
+            SELECT id, row_number() OVER (
+                PARTITION BY conversacion_id ORDER BY creado_en, id
+            ) AS seq
+            FROM mensajes
+        ) n
+        WHERE m.id = n.id
+    """))
+    op.execute(sa.text("""
+        UPDATE conversaciones c
+        SET ultimo_seq = s.maximo
+        FROM (
+            SELECT conversacion_id, max(seq) AS maximo
+            FROM mensajes
+            GROUP BY conversacion_id
+        ) s
+        WHERE c.id = s.conversacion_id
+    """))
+
+    # El contador vive en la fila de la conversación: el UPDATE la bloquea
+    # hasta el commit (inserciones de una misma conversación en serie) y un
+    # rollback lo deshace, así no quedan huecos.
+    op.execute(sa.text("""
+        CREATE FUNCTION mensajes_asignar_seq() RETURNS trigger AS $$
+        BEGIN
+            UPDATE conversaciones
+            SET ultimo_seq = ultimo_seq + 1
+            WHERE id = NEW.conversacion_id
+            RETURNING ultimo_seq INTO NEW.seq;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    op.execute(sa.text("""
+        CREATE TRIGGER trg_mensajes_seq
+        BEFORE INSERT ON mensajes
+        FOR EACH ROW EXECUTE FUNCTION mensajes_asignar_seq()
+    """))
+
+    op.alter_column('mensajes', 'seq', nullable=False)
+    op.create_index('ux_mensajes_conversacion_seq', 'mensajes', ['conversacion_id', 'seq'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_mensajes_conversacion_seq', table_name='mensajes')
+    op.execute(sa.text("DROP TRIGGER trg_mensajes_seq ON mensajes"))
+    op.execute(sa.text("DROP FUNCTION mensajes_asignar_seq()"))
+    op.drop_column('mensajes', 'seq')
+    op.drop_column('conversaciones', 'ultimo_seq')
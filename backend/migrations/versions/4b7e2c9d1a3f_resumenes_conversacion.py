@@ -0,0 +1,80 @@
+"""resumenes_conversacion (sidebar por miembro)
+
+Revision ID: 4b7e2c9d1a3f
+Revises: 078aef2d2cdd
+Create Date: 2025-12-02 10:14:03.412907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7e2c9d1a3f'
+down_revision: Union[str, Sequence[str], None] = '078aef2d2cdd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('resumenes_conversacion',
+    sa.Column('conversacion_id', sa.UUID(), nullable=False),
+    sa.Column('usuario_id', sa.UUID(), nullable=False),
+    sa.Column('ultimo_mensaje_id', sa.UUID(), nullable=True),
+    sa.Column('ultimo_mensaje_preview', sa.String(length=200), nullable=True),
+    sa.Column('ultimo_mensaje_en', sa.DateTime(), nullable=True),
+    sa.Column('no_leidos', sa.Integer(), nullable=False),
+    sa.Column('ultima_actividad', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['conversacion_id'], ['conversaciones.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuarios.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['ultimo_mensaje_id'], ['mensajes.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('conversacion_id', 'usuario_id')
+    )
+    op.create_index('ix_resumen_usuario_actividad', 'resumenes_conversacion', ['usuario_id', 'ultima_actividad'], unique=False)
+
+    # Backfill: una fila por membresía con el último mensaje visible y los no leídos
+    op.execute(sa.text("""
+        INSERT INTO resumenes_conversacion (
+            conversacion_id, usuario_id,
+            ultimo_mensaje_id, ultimo_mensaje_preview, ultimo_mensaje_en,
+            no_leidos, ultima_actividad
+        )
+        SELECT
+            mc.conversacion_id,
+            mc.usuario_id,
+            um.id,
+            left(coalesce(nullif(um.cuerpo, ''), um.nombre_archivo, ''), 200),
+            um.creado_en,
+            coalesce(nl.total, 0),
+            coalesce(um.creado_en, mc.creado_en, now())
+        FROM miembros_conversacion mc
+        LEFT JOIN LATERAL (
+            SELECT m.id, m.cuerpo, m.nombre_archivo, m.creado_en
+            FROM mensajes m
+            WHERE m.conversacion_id = mc.conversacion_id
+              AND NOT EXISTS (
+                  SELECT 1 FROM mensajes_ocultos o
+                  WHERE o.mensaje_id = m.id AND o.usuario_id = mc.usuario_id
+              )
+            ORDER BY m.creado_en DESC
+            LIMIT 1
+        ) um ON true
+        LEFT JOIN LATERAL (
+            SELECT count(*) AS total
+            FROM estados_mensaje e
+            JOIN mensajes m2 ON m2.id = e.mensaje_id
+            WHERE e.usuario_id = mc.usuario_id
+              AND e.estado <> 'leido'
+              AND m2.conversacion_id = mc.conversacion_id
+        ) nl ON true
+        ON CONFLICT DO NOTHING
+    """))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_resumen_usuario_actividad', table_name='resumenes_conversacion')
+    op.drop_table('resumenes_conversacion')
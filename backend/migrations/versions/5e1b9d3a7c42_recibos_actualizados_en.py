@@ -0,0 +1,28 @@
+"""miembros_conversacion.recibos_actualizados_en (delta de /estados)
+
+Revision ID: 5e1b9d3a7c42
+Revises: d2a8f61c0b57
+Create Date: 2025-12-06 09:51:12.774031
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e1b9d3a7c42'
+down_revision: Union[str, Sequence[str], None] = 'd2a8f61c0b57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('miembros_conversacion', sa.Column('recibos_actualizados_en', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('miembros_conversacion', 'recibos_actualizados_en')
@@ -0,0 +1,54 @@
+"""conversaciones.par_directo (clave canónica de chats 1 a 1)
+
+Revision ID: 9c3f5a7e2b14
+Revises: 4b7e2c9d1a3f
+Create Date: 2025-12-03 18:42:51.093114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c3f5a7e2b14'
+down_revision: Union[str, Sequence[str], None] = '4b7e2c9d1a3f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('conversaciones', sa.Column('par_directo', sa.String(length=73), nullable=True))
+
+    # Backfill: chats no grupales con exactamente 2 miembros activos.
+    # Si hay duplicados de la misma pareja se queda la más antigua.
+    op.execute(sa.text("""
+        UPDATE conversaciones c
+        SET par_directo = p.par
+        FROM (
+            SELECT DISTINCT ON (par) conversacion_id, par
+            FROM (
+                SELECT
+                    mc.conversacion_id,
+                    min(mc.usuario_id::text COLLATE "C") || ':' || max(mc.usuario_id::text COLLATE "C") AS par,
+                    min(cv.creado_en) AS creado_en
+                FROM miembros_conversacion mc
+                JOIN conversaciones cv ON cv.id = mc.conversacion_id
+                WHERE cv.es_grupo IS NOT TRUE
+                GROUP BY mc.conversacion_id
+                HAVING count(*) = 2 AND bool_and(mc.activo)
+            ) pares
+            ORDER BY par, creado_en ASC NULLS LAST
+        ) p
+        WHERE c.id = p.conversacion_id
+    """))
+
+    op.create_index('ux_conversaciones_par_directo', 'conversaciones', ['par_directo'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_conversaciones_par_directo', table_name='conversaciones')
+    op.drop_column('conversaciones', 'par_directo')
@@ -0,0 +1,40 @@
+"""eventos_outbox (outbox transaccional de Socket.IO)
+
+Revision ID: a7c4e2f9d813
+Revises: 5e1b9d3a7c42
+Create Date: 2025-12-08 16:03:27.519840
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c4e2f9d813'
+down_revision: Union[str, Sequence[str], None] = '5e1b9d3a7c42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('eventos_outbox',
+    sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+    sa.Column('conversacion_id', sa.UUID(), nullable=True),
+    sa.Column('evento', sa.String(length=64), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('rooms', postgresql.ARRAY(sa.String(length=100)), nullable=False),
+    sa.Column('creado_en', sa.DateTime(), nullable=False),
+    sa.Column('enviado_en', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_eventos_outbox_pendientes', 'eventos_outbox', ['id'], unique=False, postgresql_where=sa.text('enviado_en IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_eventos_outbox_pendientes', table_name='eventos_outbox', postgresql_where=sa.text('enviado_en IS NULL'))
+    op.drop_table('eventos_outbox')
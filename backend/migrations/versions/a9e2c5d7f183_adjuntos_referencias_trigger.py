@@ -0,0 +1,67 @@
+"""adjuntos.referencias mantenidas por trigger en mensajes
+
+Revision ID: a9e2c5d7f183
+Revises: f1c7a3e9b246
+Create Date: 2025-12-15 16:48:51.602318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9e2c5d7f183'
+down_revision: Union[str, Sequence[str], None] = 'f1c7a3e9b246'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Cualquier alta / baja / cambio de adjunto en mensajes (endpoint, cascada
+    # ORM o DELETE a mano) ajusta el contador en la misma transacción.
+    op.execute(sa.text("""
+        CREATE FUNCTION mensajes_referencias_adjunto() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.adjunto_sha256 IS NOT NULL THEN
+                UPDATE adjuntos
+                SET referencias = referencias - 1, actualizado_en = now()
+                WHERE sha256 = OLD.adjunto_sha256;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.adjunto_sha256 IS NOT NULL THEN
+                UPDATE adjuntos
+                SET referencias = referencias + 1, actualizado_en = now()
+                WHERE sha256 = NEW.adjunto_sha256;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    op.execute(sa.text("""
+        CREATE TRIGGER trg_mensajes_referencias_adjunto
+        AFTER INSERT OR DELETE OR UPDATE OF adjunto_sha256 ON mensajes
+        FOR EACH ROW EXECUTE FUNCTION mensajes_referencias_adjunto()
+    """))
+
+    # Recontar: solo mensajes que lo usan; lo que no usa ninguno queda en 0
+    # y la limpieza lo purga pasada la gracia.
+    op.execute(sa.text("""
+        UPDATE adjuntos a
+        SET referencias = coalesce(u.n, 0)
+        FROM adjuntos a2
+        LEFT JOIN (
+            SELECT adjunto_sha256, count(*) AS n
+            FROM mensajes
+            WHERE adjunto_sha256 IS NOT NULL
+            GROUP BY adjunto_sha256
+        ) u ON u.adjunto_sha256 = a2.sha256
+        WHERE a.sha256 = a2.sha256
+    """))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.text("DROP TRIGGER trg_mensajes_referencias_adjunto ON mensajes"))
+    op.execute(sa.text("DROP FUNCTION mensajes_referencias_adjunto()"))
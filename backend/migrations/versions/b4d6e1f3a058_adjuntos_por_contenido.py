@@ -0,0 +1,52 @@
+"""adjuntos por contenido (sha256 + referencias)
+
+Revision ID: b4d6e1f3a058
+Revises: e8b3f7a1c926
+Create Date: 2025-12-13 18:02:27.114903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d6e1f3a058'
+down_revision: Union[str, Sequence[str], None] = 'e8b3f7a1c926'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('adjuntos',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('tamano', sa.BigInteger(), nullable=False),
+    sa.Column('mime', sa.String(length=127), nullable=True),
+    sa.Column('ruta', sa.String(length=255), nullable=False),
+    sa.Column('referencias', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('creado_en', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.Column('actualizado_en', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.create_index(
+        'ix_adjuntos_huerfanos', 'adjuntos', ['actualizado_en'],
+        unique=False, postgresql_where=sa.text('referencias <= 0')
+    )
+
+    # Los adjuntos anteriores siguen en uploads/<carpeta>/ sin hash (NULL)
+    op.add_column('mensajes', sa.Column('adjunto_sha256', sa.String(length=64), nullable=True))
+    op.create_foreign_key(
+        'fk_mensajes_adjunto_sha256', 'mensajes', 'adjuntos', ['adjunto_sha256'], ['sha256']
+    )
+    op.create_index('ix_mensajes_adjunto_sha256', 'mensajes', ['adjunto_sha256'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_mensajes_adjunto_sha256', table_name='mensajes')
+    op.drop_constraint('fk_mensajes_adjunto_sha256', 'mensajes', type_='foreignkey')
+    op.drop_column('mensajes', 'adjunto_sha256')
+    op.drop_index('ix_adjuntos_huerfanos', table_name='adjuntos')
+    op.drop_table('adjuntos')
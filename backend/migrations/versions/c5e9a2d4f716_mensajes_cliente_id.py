@@ -0,0 +1,34 @@
+"""mensajes.cliente_id (envío idempotente)
+
+Revision ID: c5e9a2d4f716
+Revises: 3f8d1c6b2e95
+Create Date: 2025-12-10 12:40:05.918263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e9a2d4f716'
+down_revision: Union[str, Sequence[str], None] = '3f8d1c6b2e95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('mensajes', sa.Column('cliente_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_index(
+        'ux_mensajes_remitente_cliente', 'mensajes', ['remitente_id', 'cliente_id'],
+        unique=True, postgresql_where=sa.text('cliente_id IS NOT NULL')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_mensajes_remitente_cliente', table_name='mensajes')
+    op.drop_column('mensajes', 'cliente_id')
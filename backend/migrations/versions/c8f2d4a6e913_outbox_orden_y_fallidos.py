@@ -0,0 +1,53 @@
+"""eventos_outbox: orden de commit por conversación e intentos / fallidos
+
+Revision ID: c8f2d4a6e913
+Revises: a9e2c5d7f183
+Create Date: 2025-12-16 10:22:37.184420
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8f2d4a6e913'
+down_revision: Union[str, Sequence[str], None] = 'a9e2c5d7f183'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('eventos_outbox', sa.Column('intentos', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.add_column('eventos_outbox', sa.Column('fallido_en', sa.DateTime(), nullable=True))
+
+    # El id se pide DESPUÉS de tomar un lock por conversación que dura hasta
+    # el commit: dos transacciones de la misma conversación no pueden tener
+    # ids en orden distinto al de sus commits, y el despachador (ORDER BY id)
+    # las publica en ese orden. Clave de dos enteros: (0x0B15, hash del id).
+    op.execute(sa.text("""
+        CREATE FUNCTION eventos_outbox_orden() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.conversacion_id IS NOT NULL THEN
+                PERFORM pg_advisory_xact_lock(2837, hashtext(NEW.conversacion_id::text));
+            END IF;
+            NEW.id := nextval(pg_get_serial_sequence('eventos_outbox', 'id'));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    op.execute(sa.text("""
+        CREATE TRIGGER trg_eventos_outbox_orden
+        BEFORE INSERT ON eventos_outbox
+        FOR EACH ROW EXECUTE FUNCTION eventos_outbox_orden()
+    """))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.text("DROP TRIGGER trg_eventos_outbox_orden ON eventos_outbox"))
+    op.execute(sa.text("DROP FUNCTION eventos_outbox_orden()"))
+    op.drop_column('eventos_outbox', 'fallido_en')
+    op.drop_column('eventos_outbox', 'intentos')
@@ -0,0 +1,105 @@
+"""recibos como marcas de agua en miembros_conversacion
+
+Revision ID: d2a8f61c0b57
+Revises: 9c3f5a7e2b14
+Create Date: 2025-12-05 11:27:40.618254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a8f61c0b57'
+down_revision: Union[str, Sequence[str], None] = '9c3f5a7e2b14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Posición de cada mensaje en su conversación: la misma numeración con la
+# que 3f8d1c6b2e95 rellena mensajes.seq (creado_en, id), así las marcas ya
+# quedan expresadas en seq y no dependen de que creado_en sea único.
+_POSICIONES = """
+    SELECT id, conversacion_id, creado_en, remitente_id,
+           row_number() OVER (PARTITION BY conversacion_id ORDER BY creado_en, id) AS pos
+    FROM mensajes
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('miembros_conversacion', sa.Column('entregado_hasta', sa.BigInteger(), nullable=True))
+    op.add_column('miembros_conversacion', sa.Column('leido_hasta', sa.BigInteger(), nullable=True))
+
+    # Conversión: la marca de cada miembro es la posición del mensaje más
+    # reciente que tenía entregado / leído en estados_mensaje.
+    op.execute(sa.text(f"""
+        UPDATE miembros_conversacion mc
+        SET entregado_hasta = w.entregado,
+            leido_hasta = w.leido
+        FROM (
+            SELECT
+                m.conversacion_id,
+                e.usuario_id,
+                max(m.pos) FILTER (WHERE e.estado IN ('enviado', 'entregado', 'leido')) AS entregado,
+                max(m.pos) FILTER (WHERE e.estado = 'leido') AS leido
+            FROM estados_mensaje e
+            JOIN ({_POSICIONES}) m ON m.id = e.mensaje_id
+            GROUP BY m.conversacion_id, e.usuario_id
+        ) w
+        WHERE mc.conversacion_id = w.conversacion_id
+          AND mc.usuario_id = w.usuario_id
+    """))
+
+    # Los no leídos del sidebar pasan a contarse contra la marca de leído
+    op.execute(sa.text(f"""
+        UPDATE resumenes_conversacion r
+        SET no_leidos = (
+            SELECT count(*)
+            FROM ({_POSICIONES}) m
+            JOIN miembros_conversacion mc
+              ON mc.conversacion_id = m.conversacion_id
+             AND mc.usuario_id = r.usuario_id
+            WHERE m.conversacion_id = r.conversacion_id
+              AND m.remitente_id IS NOT NULL
+              AND m.remitente_id <> mc.usuario_id
+              AND (mc.creado_en IS NULL OR m.creado_en >= mc.creado_en)
+              AND (mc.fecha_salida IS NULL OR m.creado_en <= mc.fecha_salida)
+              AND (mc.leido_hasta IS NULL OR m.pos > mc.leido_hasta)
+              AND NOT EXISTS (
+                  SELECT 1 FROM mensajes_ocultos o
+                  WHERE o.mensaje_id = m.id AND o.usuario_id = r.usuario_id
+              )
+        )
+    """))
+
+    op.execute(sa.text("DELETE FROM estados_mensaje"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Volver a materializar una fila por mensaje y destinatario
+    op.execute(sa.text(f"""
+        INSERT INTO estados_mensaje (id, mensaje_id, usuario_id, estado, creado_en)
+        SELECT
+            gen_random_uuid(),
+            m.id,
+            mc.usuario_id,
+            (CASE
+                WHEN mc.leido_hasta >= m.pos THEN 'leido'
+                WHEN mc.entregado_hasta >= m.pos THEN 'entregado'
+                ELSE 'pendiente'
+            END)::estado_mensaje,
+            m.creado_en
+        FROM ({_POSICIONES}) m
+        JOIN miembros_conversacion mc ON mc.conversacion_id = m.conversacion_id
+        WHERE m.remitente_id IS NOT NULL
+          AND m.remitente_id <> mc.usuario_id
+          AND (mc.creado_en IS NULL OR m.creado_en >= mc.creado_en)
+          AND (mc.fecha_salida IS NULL OR m.creado_en <= mc.fecha_salida)
+    """))
+
+    op.drop_column('miembros_conversacion', 'leido_hasta')
+    op.drop_column('miembros_conversacion', 'entregado_hasta')
@@ -0,0 +1,45 @@
+"""índices parciales para la limpieza de codigos_otp / sesiones_qr / sesiones_web
+
+Revision ID: e8b3f7a1c926
+Revises: c5e9a2d4f716
+Create Date: 2025-12-12 09:15:42.310857
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b3f7a1c926'
+down_revision: Union[str, Sequence[str], None] = 'c5e9a2d4f716'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_otp_telefono_pendiente', 'codigos_otp', ['telefono', sa.text('creado_en DESC')],
+        unique=False, postgresql_where=sa.text('usado = false')
+    )
+    op.create_index('ix_otp_expiracion', 'codigos_otp', ['expiracion'], unique=False)
+    op.create_index('ix_sesiones_qr_expiracion', 'sesiones_qr', ['expiracion'], unique=False)
+    op.create_index(
+        'ix_sesion_web_expiracion_activa', 'sesiones_web', ['fecha_expiracion'],
+        unique=False, postgresql_where=sa.text('activo')
+    )
+    op.create_index(
+        'ix_sesion_web_inicio_inactiva', 'sesiones_web', ['fecha_inicio'],
+        unique=False, postgresql_where=sa.text('NOT activo')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sesion_web_inicio_inactiva', table_name='sesiones_web')
+    op.drop_index('ix_sesion_web_expiracion_activa', table_name='sesiones_web')
+    op.drop_index('ix_sesiones_qr_expiracion', table_name='sesiones_qr')
+    op.drop_index('ix_otp_expiracion', table_name='codigos_otp')
+    op.drop_index('ix_otp_telefono_pendiente', table_name='codigos_otp')
@@ -0,0 +1,40 @@
+"""eventos_outbox.eid (orden de publicación para el reenvío)
+
+Revision ID: f1c7a3e9b246
+Revises: b4d6e1f3a058
+Create Date: 2025-12-15 10:21:08.447630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c7a3e9b246'
+down_revision: Union[str, Sequence[str], None] = 'b4d6e1f3a058'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('eventos_outbox', sa.Column('eid', sa.BigInteger(), nullable=True))
+
+    # Lo ya publicado conserva eid = id: los ultimo_eid que tienen los
+    # clientes siguen siendo comparables; la secuencia arranca después.
+    op.execute("UPDATE eventos_outbox SET eid = id WHERE enviado_en IS NOT NULL")
+    op.execute("CREATE SEQUENCE eventos_outbox_eid_seq")
+    op.execute(
+        "SELECT setval('eventos_outbox_eid_seq', "
+        "GREATEST((SELECT max(id) FROM eventos_outbox), 1))"
+    )
+    op.create_index('ux_eventos_outbox_eid', 'eventos_outbox', ['eid'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_eventos_outbox_eid', table_name='eventos_outbox')
+    op.execute("DROP SEQUENCE eventos_outbox_eid_seq")
+    op.drop_column('eventos_outbox', 'eid')
@@ -0,0 +1,9 @@
+# tests/conftest.py
+import os
+import sys
+
+# Para importar "app" corriendo pytest desde backend/ o desde la raíz
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Redis de pruebas compartido por los tests multi-worker (se omiten si no responde)
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
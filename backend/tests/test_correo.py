@@ -0,0 +1,132 @@
+# tests/test_correo.py
+"""
+ColaCorreo contra un servidor SMTP real en localhost (aiosmtpd), con
+SMTP_TLS=none y sin EMAIL_PASSWORD: entrega, reutilización de la
+conexión, reintento tras un error temporal y cierre por inactividad.
+
+Necesita aiosmtplib y aiosmtpd; si faltan, se omite:
+    pip install aiosmtpd
+    python -m pytest -q tests/test_correo.py
+"""
+import asyncio
+import socket
+from contextlib import contextmanager
+
+import pytest
+
+pytest.importorskip("aiosmtplib")
+pytest.importorskip("dotenv")
+controlador = pytest.importorskip("aiosmtpd.controller")
+
+from app import correo  # noqa: E402
+from app.core.config import config  # noqa: E402
+
+
+class _Buzon:
+    """Handler de aiosmtpd: guarda lo recibido; puede fallar los primeros DATA."""
+
+    def __init__(self, fallar: int = 0):
+        self.fallar = fallar
+        self.intentos = 0
+        self.recibidos = []   # (peer, rcpt_tos, contenido)
+
+    async def handle_DATA(self, server, session, envelope):
+        self.intentos += 1
+        if self.fallar:
+            self.fallar -= 1
+            return "451 Intente más tarde"
+        self.recibidos.append((session.peer, envelope.rcpt_tos, envelope.content))
+        return "250 OK"
+
+    def conexiones(self) -> int:
+        # Cada conexión sale de un puerto propio del cliente
+        return len({peer for peer, _, _ in self.recibidos})
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def _servidor(monkeypatch, fallar: int = 0):
+    buzon = _Buzon(fallar)
+    puerto = _puerto_libre()
+    servidor = controlador.Controller(buzon, hostname="127.0.0.1", port=puerto)
+    servidor.start()
+
+    monkeypatch.setattr(config, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(config, "SMTP_PORT", puerto)
+    monkeypatch.setattr(config, "SMTP_TLS", "none")
+    monkeypatch.setattr(config, "EMAIL_PASSWORD", "")
+    monkeypatch.setattr(config, "EMAIL_FROM", "bisco@localhost")
+    # Un solo trabajador: todos los envíos pasan por la misma conexión
+    monkeypatch.setattr(correo, "CORREO_CONEXIONES", 1)
+    monkeypatch.setattr(correo, "CORREO_BACKOFF_SEG", 0.01)
+    monkeypatch.setattr(correo, "CORREO_CIERRE_SEG", 3)
+    try:
+        yield buzon
+    finally:
+        servidor.stop()
+
+
+def test_entrega_y_reutiliza_la_conexion(monkeypatch):
+    with _servidor(monkeypatch) as buzon:
+        async def prueba():
+            cola = correo.ColaCorreo()
+            cola.iniciar()
+            for i in range(3):
+                assert cola.encolar(f"u{i}@localhost", "Código", f"Tu código es {i}")
+            await cola.cerrar()
+
+        asyncio.run(prueba())
+
+    assert [rcpt for _, rcpt, _ in buzon.recibidos] == [["u0@localhost"], ["u1@localhost"], ["u2@localhost"]]
+    assert b"Tu c" in buzon.recibidos[0][2]
+    assert buzon.conexiones() == 1
+
+
+def test_reintenta_tras_un_error_temporal(monkeypatch):
+    with _servidor(monkeypatch, fallar=1) as buzon:
+        async def prueba():
+            cola = correo.ColaCorreo()
+            cola.iniciar()
+            assert cola.encolar("u@localhost", "Código", "123456")
+            await cola.cerrar()
+
+        asyncio.run(prueba())
+
+    # 451 → se descarta la conexión, backoff y se entrega al segundo intento
+    assert buzon.intentos == 2
+    assert [rcpt for _, rcpt, _ in buzon.recibidos] == [["u@localhost"]]
+
+
+def test_cierre_inactivo_fallido_no_tumba_al_trabajador(monkeypatch):
+    monkeypatch.setattr(correo, "CORREO_INACTIVO_SEG", 0.2)
+    cerrar_original = correo._ConexionSMTP.cerrar
+    fallos = []
+
+    async def cerrar_que_falla(self):
+        if not fallos:
+            fallos.append(1)
+            raise OSError("conexión rota al cerrar")
+        await cerrar_original(self)
+
+    monkeypatch.setattr(correo._ConexionSMTP, "cerrar", cerrar_que_falla)
+
+    with _servidor(monkeypatch) as buzon:
+        async def prueba():
+            cola = correo.ColaCorreo()
+            cola.iniciar()
+            assert cola.encolar("a@localhost", "Código", "1")
+            await asyncio.sleep(0.6)   # vence la inactividad: el cierre falla
+            assert cola.encolar("b@localhost", "Código", "2")
+            await cola.cerrar()
+
+        asyncio.run(prueba())
+
+    assert fallos
+    assert [rcpt for _, rcpt, _ in buzon.recibidos] == [["a@localhost"], ["b@localhost"]]
+    # Tras cerrar por inactividad, el segundo envío abrió otra conexión
+    assert buzon.conexiones() == 2
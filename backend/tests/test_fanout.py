@@ -0,0 +1,114 @@
+# tests/test_fanout.py
+"""
+Fan-out entre workers: dos AsyncServer con el manager que arma
+crear_client_manager("redis") sobre el MISMO Redis y el mismo canal.
+
+Un cliente real conectado al worker B tiene que recibir lo que el worker
+A emite (vía difundir) a una room, y skip_sid se respeta aunque el sid
+viva en otro worker.
+
+Necesita Redis en TEST_REDIS_URL (por defecto redis://localhost:6379/15)
+y python-socketio[asyncio_client] + uvicorn; si falta algo, se omite:
+    docker run --rm -p 6379:6379 redis:7
+    python -m pytest -q tests/test_fanout.py
+"""
+import asyncio
+import socket
+import uuid
+
+import pytest
+
+socketio = pytest.importorskip("socketio")
+uvicorn = pytest.importorskip("uvicorn")
+pytest.importorskip("aiohttp")
+pytest.importorskip("redis")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("asyncpg")
+
+import redis.asyncio as aioredis  # noqa: E402
+
+from app import realtime  # noqa: E402
+from app.core.config import config  # noqa: E402
+from conftest import TEST_REDIS_URL  # noqa: E402
+
+SALA = "sala-prueba"
+ESPERA_SEG = 5
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _servidor() -> "socketio.AsyncServer":
+    sio = socketio.AsyncServer(
+        async_mode="asgi",
+        client_manager=realtime.crear_client_manager("redis", TEST_REDIS_URL),
+    )
+
+    @sio.event
+    async def unirse(sid, data):
+        await sio.enter_room(sid, SALA)
+        return True
+
+    return sio
+
+
+async def _levantar(sio) -> tuple:
+    puerto = _puerto_libre()
+    servidor = uvicorn.Server(uvicorn.Config(
+        socketio.ASGIApp(sio), host="127.0.0.1", port=puerto, log_level="warning", lifespan="off",
+    ))
+    tarea = asyncio.create_task(servidor.serve())
+    while not servidor.started:
+        await asyncio.sleep(0.05)
+    return servidor, tarea, f"http://127.0.0.1:{puerto}"
+
+
+async def _cliente(url: str) -> tuple:
+    cliente = socketio.AsyncClient()
+    recibidos = []
+    cliente.on("hola", lambda data: recibidos.append(data))
+    await cliente.connect(url)
+    assert await cliente.call("unirse", {}) is True
+    return cliente, recibidos
+
+
+def test_emit_en_a_llega_a_cliente_de_b_y_respeta_skip_sid(monkeypatch):
+    async def prueba():
+        redis = aioredis.from_url(TEST_REDIS_URL)
+        try:
+            await redis.ping()
+        except Exception:
+            pytest.skip(f"Redis no disponible en {TEST_REDIS_URL}")
+        finally:
+            await redis.aclose()
+
+        # Canal propio: no mezclar con un servidor de desarrollo en el mismo Redis
+        monkeypatch.setattr(config, "SOCKETIO_CANAL", f"test-fanout-{uuid.uuid4().hex}")
+        sio_a, sio_b = _servidor(), _servidor()
+        servidor_b, tarea_b, url_b = await _levantar(sio_b)
+        omitido, recibidos_omitido = await _cliente(url_b)
+        destino, recibidos_destino = await _cliente(url_b)
+
+        # El worker A no tiene ningún cliente: todo lo que llegue cruzó Redis
+        monkeypatch.setattr(realtime, "sio", sio_a)
+        try:
+            # B se suscribe al canal en segundo plano: reintentar hasta que entregue
+            limite = asyncio.get_running_loop().time() + ESPERA_SEG
+            while not recibidos_destino:
+                assert asyncio.get_running_loop().time() < limite, "el emit no cruzó de A a B"
+                await realtime.difundir("hola", {"n": 1}, rooms=[SALA], skip_sid=omitido.get_sid("/"))
+                await asyncio.sleep(0.2)
+
+            assert recibidos_destino[0] == {"n": 1}
+            await asyncio.sleep(0.5)  # margen por si el omitido lo recibiera tarde
+            assert recibidos_omitido == []
+        finally:
+            await omitido.disconnect()
+            await destino.disconnect()
+            servidor_b.should_exit = True
+            await tarea_b
+
+    asyncio.run(prueba())
@@ -0,0 +1,114 @@
+# tests/test_presencia.py
+"""
+Presencia con varios procesos: dos RegistroPresencia (dos workers)
+contra el MISMO Redis.
+
+Necesita un Redis accesible en TEST_REDIS_URL (por defecto
+redis://localhost:6379/15); si no lo hay, se omite:
+    docker run --rm -p 6379:6379 redis:7
+    python -m pytest -q tests/test_presencia.py
+"""
+import asyncio
+import uuid
+
+import pytest
+
+pytest.importorskip("redis")
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("asyncpg")
+
+import redis.asyncio as aioredis  # noqa: E402
+
+from app import presencia as modulo  # noqa: E402
+from app.presencia import RegistroPresencia  # noqa: E402
+from conftest import TEST_REDIS_URL as REDIS_URL  # noqa: E402
+
+
+def _correr(coro_fn):
+    """Cada prueba con su propio loop y sus propios clientes Redis."""
+    async def _envoltura():
+        cliente = aioredis.from_url(REDIS_URL, decode_responses=True)
+        try:
+            await cliente.ping()
+        except Exception:
+            pytest.skip(f"Redis no disponible en {REDIS_URL}")
+        uid = str(uuid.uuid4())
+        try:
+            await coro_fn(RegistroPresencia(REDIS_URL), RegistroPresencia(REDIS_URL), uid)
+        finally:
+            await cliente.delete(modulo._PREFIJO + uid, modulo._PREFIJO_HTTP + uid)
+            await cliente.aclose()
+
+    asyncio.run(_envoltura())
+
+
+def test_dispositivos_en_dos_workers():
+    async def prueba(worker_a, worker_b, uid):
+        assert await worker_a.conectar(uid, "sid-a") is True
+        assert await worker_b.conectar(uid, "sid-b") is False   # segundo dispositivo
+
+        # Cada worker ve los sids de los dos
+        for worker in (worker_a, worker_b):
+            assert sorted((await worker.sids_for([uid]))[uid]) == ["sid-a", "sid-b"]
+            assert await worker.is_online([uid]) == {uid: True}
+
+        # Cerrar uno no lo pasa a offline; cerrar el último sí
+        assert await worker_a.desconectar("sid-a") is None
+        assert await worker_b.is_online([uid]) == {uid: True}
+        assert await worker_b.desconectar("sid-b") == uid
+        assert await worker_a.caidos([uid]) == [uid]
+
+    _correr(prueba)
+
+
+def test_desconectar_sid_ajeno_no_hace_nada():
+    async def prueba(worker_a, worker_b, uid):
+        await worker_a.conectar(uid, "sid-a")
+        # El sid no es de B: no lo toca
+        assert await worker_b.desconectar("sid-a") is None
+        assert await worker_b.is_online([uid]) == {uid: True}
+
+    _correr(prueba)
+
+
+def test_sids_de_un_worker_caido_caducan(monkeypatch):
+    monkeypatch.setattr(modulo, "PRESENCIA_TTL_SEG", 1)
+
+    async def prueba(worker_a, worker_b, uid):
+        await worker_a.conectar(uid, "sid-a")   # A "muere": no vuelve a latir
+        await worker_b.conectar(uid, "sid-b")
+
+        await asyncio.sleep(0.6)
+        await worker_b.latir()
+        await asyncio.sleep(0.6)
+
+        # Solo sobrevive el sid del worker que sigue latiendo
+        assert (await worker_b.sids_for([uid]))[uid] == ["sid-b"]
+        assert await worker_b.caidos([uid]) == []
+
+        await asyncio.sleep(1.1)
+        # Sin latidos de nadie: el barrido lo encontraría como caído
+        assert await worker_b.caidos([uid]) == [uid]
+
+    _correr(prueba)
+
+
+def test_marca_http_protege_del_barrido(monkeypatch):
+    monkeypatch.setattr(modulo, "PRESENCIA_TTL_SEG", 1)
+
+    async def prueba(worker_a, worker_b, uid):
+        # marcar_online por HTTP en A, sin ningún socket
+        await worker_a.marcar_http(uid)
+        assert await worker_b.is_online([uid]) == {uid: False}   # no es un dispositivo
+        assert await worker_b.caidos([uid]) == []
+
+        await asyncio.sleep(1.1)
+        # La marca caduca como un sid sin latidos
+        assert await worker_b.caidos([uid]) == [uid]
+
+        # marcar_offline la quita antes de tiempo
+        await worker_a.marcar_http(uid)
+        await worker_a.marcar_http(uid, activo=False)
+        assert await worker_b.caidos([uid]) == [uid]
+
+    _correr(prueba)
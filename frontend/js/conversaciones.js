@@ -699,6 +699,11 @@ let currentChatUserId = null; // ID del otro usuario en el chat abierto
 let currentChatName = "";     // Alias del otro usuario (para responder)
 let typingTimeout = null;
 let estadosTicker = null;
+// Cursor para cargar mensajes más antiguos (cabecera X-Next-Cursor)
+let mensajesCursorAnterior = null;
+let cargandoMensajesAnteriores = false;
+// Mayor seq pintado en el chat abierto (para detectar eventos perdidos)
+let ultimoSeqAbierto = 0;
 const mensajesCache = new Map();
 const tickNodes = new Map();
 const currentUserId = document.getElementById("meta-usuario-id").content;
@@ -1827,14 +1832,38 @@ async function consultarEstado(mensajeId) {
 }
 
 
-// Refrescar checks de mis mensajes según estados en BD
-async function refrescarVistosDeMisMensajes() {
+// Rango de cada estado: los ✓ nunca retroceden
+const RANGO_TICKS = { enviado: 0, entregado: 1, leido: 2 };
+const tickEstados = new Map();   // mensaje_id -> estado pintado
+// Instante del servidor de la última sincronización (/estados?since=)
+let estadosSincronizadosEn = null;
+
+function aplicarEstadoTick(mid, estado) {
+  const tickNode = tickNodes.get(mid);
+  if (!tickNode) return;   // mensaje no es mío o no está pintado
+
+  // "enviado" desde el servidor = el destinatario estaba conectado
+  const modo = estado === "pendiente" ? "enviado"
+    : estado === "leido" ? "leido" : "entregado";
+
+  const actual = tickEstados.get(mid);
+  if (actual && RANGO_TICKS[actual] >= RANGO_TICKS[modo]) return;
+
+  tickEstados.set(mid, modo);
+  pintarTicks(tickNode, modo);
+}
+
+// Refrescar checks de mis mensajes según estados en BD.
+// Se llama al abrir el chat y, con `since`, al reconectar el socket;
+// el resto llega por el evento "estado_actualizado".
+async function refrescarVistosDeMisMensajes(since = null) {
   if (!currentChatId) return;
+  const chatId = currentChatId;
 
   try {
-    // 1) obtener todos los mensajes del chat actual
+    const qs = since ? `?since=${encodeURIComponent(since)}` : "";
     const resp = await fetch(
-      `${API}conversaciones/${currentChatId}/estados`,
+      `${API}conversaciones/${chatId}/estados${qs}`,
       { headers: baseHeaders }
     );
 
@@ -1844,41 +1873,17 @@ async function refrescarVistosDeMisMensajes() {
     }
 
     const data = await resp.json();
-    if (!data || typeof data !== "object") return;
-
-    // data = { mensaje_id : [{usuario_id, estado}, ...], ... }
-    for (const mid of Object.keys(data)) {
-
-      const estados = data[mid];
-      if (!Array.isArray(estados)) continue;
-
-      const tickNode = tickNodes.get(mid);
-      if (!tickNode) continue;   // mensaje no es mío
+    if (!data || !Array.isArray(data.estados)) return;
+    if (String(chatId) !== String(currentChatId)) return;
 
-      // solo estados de otras personas
-      const otros = estados.filter(
-        e => String(e.usuario_id) !== String(usuarioId)
-      );
-
-      if (otros.length === 0) continue;
-
-      const hayLeido = otros.some(e => e.estado === "leido");
-      const hayEntregado = otros.some(
-        e => e.estado === "entregado" || e.estado === "enviado"
-      );
-      const soloPendiente = otros.every(e => e.estado === "pendiente");
-
-      if (hayLeido) {
-        pintarTicks(tickNode, "leido");
-      }
-      else if (hayEntregado && !soloPendiente) {
-        pintarTicks(tickNode, "entregado");
-      }
-      else {
-        pintarTicks(tickNode, "enviado");
-      }
+    // data.estados = [{ mensaje_id, usuario_id, estado }, ...]
+    for (const e of data.estados) {
+      if (String(e.usuario_id) === String(usuarioId)) continue;
+      aplicarEstadoTick(e.mensaje_id, e.estado);
     }
 
+    estadosSincronizadosEn = data.ahora || estadosSincronizadosEn;
+
   } catch (e) {
     console.error("Error refrescando vistos:", e);
   }
@@ -2311,7 +2316,11 @@ async function openChat(chatId, otherName, otherUserId = null) {
   chatSection.style.display = "flex";
 
   tickNodes.clear();
+  tickEstados.clear();
+  estadosSincronizadosEn = null;
   if (estadosTicker) clearInterval(estadosTicker);
+  mensajesCursorAnterior = null;
+  ultimoSeqAbierto = 0;
 
   // ===============================================
   // 2️⃣ BLOQUEAR SI YA NO SOY MIEMBRO
@@ -2353,6 +2362,7 @@ async function openChat(chatId, otherName, otherUserId = null) {
     }
 
     let msgs = await r.json();
+    mensajesCursorAnterior = r.headers.get("X-Next-Cursor");
 
     for (const m of msgs) {
       const esMio = (m.remitente_id || m.usuario_id) === usuarioId;
@@ -2368,7 +2378,6 @@ async function openChat(chatId, otherName, otherUserId = null) {
     }
 
     refrescarVistosDeMisMensajes();
-    estadosTicker = setInterval(refrescarVistosDeMisMensajes, 4000);
 
     // Marcar leídos al abrir
     await fetch(`${API}conversaciones/${chatId}/marcar_leidos`, {
@@ -2390,6 +2399,91 @@ async function openChat(chatId, otherName, otherUserId = null) {
 
 
 
+// ====================================================
+// 🔢 RECUPERAR HUECO DE seq (eventos perdidos del chat abierto)
+// ====================================================
+async function recuperarHuecoSeq(chatId, desdeSeq) {
+  let seq = desdeSeq;
+
+  try {
+    while (seq != null && chatId === String(currentChatId)) {
+      const r = await fetch(
+        `${API}conversaciones/${chatId}/mensajes?after_seq=${seq}`,
+        { headers: baseHeaders }
+      );
+      if (!r.ok || chatId !== String(currentChatId)) return;
+
+      const msgs = await r.json();
+      for (const m of msgs) {
+        if (m.id && messagesDiv.querySelector(`[data-msg-id="${m.id}"]`)) continue;
+
+        const esMio = (m.remitente_id || m.usuario_id) === usuarioId;
+        renderMessageFromObj(m, esMio);
+
+        if (!esMio && m.id) registrarEstado(m.id, "entregado");
+      }
+
+      seq = r.headers.get("X-Next-Seq");
+    }
+  } catch (err) {
+    console.error("❌ Error recuperando mensajes perdidos:", err);
+  }
+}
+
+
+
+// ====================================================
+// ⬆️ CARGAR MENSAJES ANTERIORES (scroll hacia arriba)
+// ====================================================
+async function cargarMensajesAnteriores() {
+  if (!currentChatId || !mensajesCursorAnterior || cargandoMensajesAnteriores) return;
+
+  cargandoMensajesAnteriores = true;
+  const chatId = currentChatId;
+
+  try {
+    const r = await fetch(
+      `${API}conversaciones/${chatId}/mensajes?before=${encodeURIComponent(mensajesCursorAnterior)}`,
+      { headers: baseHeaders }
+    );
+    if (!r.ok || chatId !== currentChatId) return;
+
+    const msgs = await r.json();
+    mensajesCursorAnterior = r.headers.get("X-Next-Cursor");
+
+    // Los render* agregan al final: renderizamos y luego movemos al inicio
+    const alturaPrevia = messagesDiv.scrollHeight;
+    const primeroActual = messagesDiv.firstChild;
+    const totalPrevio = messagesDiv.childNodes.length;
+
+    for (const m of msgs) {
+      const esMio = (m.remitente_id || m.usuario_id) === usuarioId;
+      renderMessageFromObj(m, esMio);
+    }
+
+    const nuevos = Array.from(messagesDiv.childNodes).slice(totalPrevio);
+    for (const nodo of nuevos) {
+      messagesDiv.insertBefore(nodo, primeroActual);
+    }
+
+    messagesDiv.scrollTo({ top: messagesDiv.scrollHeight - alturaPrevia });
+
+    // ✓✓ de los mensajes propios recién pintados
+    if (msgs.some(m => (m.remitente_id || m.usuario_id) === usuarioId)) {
+      refrescarVistosDeMisMensajes();
+    }
+  } catch (err) {
+    console.error("❌ Error cargando mensajes anteriores:", err);
+  } finally {
+    cargandoMensajesAnteriores = false;
+  }
+}
+
+messagesDiv?.addEventListener("scroll", () => {
+  if (messagesDiv.scrollTop < 40) cargarMensajesAnteriores();
+});
+
+
 // ======================================================
 // 📌 ABRIR INFO DEL GRUPO – VERSIÓN FINAL 100% FUNCIONAL
 // ======================================================
@@ -2765,6 +2859,10 @@ function renderMessageFromObj(m, esMio) {
     if (!m) return;
     if (!messagesDiv) return;
 
+    if (m.seq && String(m.conversacion_id) === String(currentChatId)) {
+      ultimoSeqAbierto = Math.max(ultimoSeqAbierto, m.seq);
+    }
+
     // ========== BASE ==========
     const textOriginal = m.cuerpo || m.contenido || "";
     const editadoEn = m.editado_en || null;
@@ -2955,7 +3053,11 @@ function renderMessageFromObj(m, esMio) {
       ticks.className = "ticks";
       pintarTicks(ticks, "enviado");
       footer.appendChild(ticks);
-      if (m.id) tickNodes.set(m.id, ticks);
+      if (m.id) {
+        tickNodes.set(m.id, ticks);
+        // si se vuelve a pintar, conservar el estado que ya tenía
+        if (tickEstados.has(m.id)) pintarTicks(ticks, tickEstados.get(m.id));
+      }
     }
 
     wrap.appendChild(footer);
@@ -3250,30 +3352,38 @@ async function sendMessage() {
   const payload = {
     cuerpo: texto,
     mensaje_id_respuesta: replyTarget ? replyTarget.id : null,
-    mencionados: []
+    mencionados: [],
+    // mismo id en cualquier reintento → el servidor no lo duplica
+    cliente_id: crypto.randomUUID()
   };
 
   input.value = "";
   input.disabled = true;
 
   try {
-    const resp = await fetch(
-      `${API}conversaciones/${currentChatId}/mensajes`,
-      {
-        method: "POST",
-        headers: baseHeaders,
-        credentials: "include",
-        body: JSON.stringify(payload)
+    let creado = await enviarMensajePorSocket(currentChatId, payload);
+
+    // Sin socket / sin ack a tiempo → HTTP (mismo cliente_id)
+    if (!creado) {
+      const resp = await fetch(
+        `${API}conversaciones/${currentChatId}/mensajes`,
+        {
+          method: "POST",
+          headers: baseHeaders,
+          credentials: "include",
+          body: JSON.stringify(payload)
+        }
+      );
+
+      if (!resp.ok) {
+        console.error("Error al enviar:", resp.status, await resp.text());
+        showToast("No se pudo enviar el mensaje.", "#d94b4b");
+        return;
       }
-    );
 
-    if (!resp.ok) {
-      console.error("Error al enviar:", resp.status, await resp.text());
-      showToast("No se pudo enviar el mensaje.", "#d94b4b");
-      return;
+      creado = await resp.json();
     }
 
-    let creado = await resp.json();
     if (creado && creado.mensaje) creado = creado.mensaje;
 
     // 🔥 OBJETO FINAL PARA RENDER
@@ -3319,6 +3429,35 @@ async function sendMessage() {
 
 
 
+// ====================================================
+// 📨 ENVÍO POR SOCKET (ack) — null si hay que usar HTTP
+// ====================================================
+const ACK_ENVIO_MS = 5000;
+
+async function enviarMensajePorSocket(chatId, payload) {
+  if (!window.socket?.connected) return null;
+
+  try {
+    const ack = await window.socket
+      .timeout(ACK_ENVIO_MS)
+      .emitWithAck("enviar_mensaje", { ...payload, conversacion_id: String(chatId) });
+
+    if (ack?.ok) return ack.mensaje;
+
+    // 401 (token vencido en esta conexión) → HTTP renueva la cookie
+    if (ack?.status === 401) return null;
+
+    console.error("Error al enviar:", ack?.status, ack?.error);
+    throw new Error(ack?.error || "No se pudo enviar el mensaje.");
+  } catch (err) {
+    // Timeout: el mensaje pudo guardarse; el reintento HTTP usa el mismo cliente_id
+    if (err?.message === "operation has timed out") return null;
+    throw err;
+  }
+}
+
+
+
 // ====================================================
 // INDICADOR "ESCRIBIENDO..."
 // ====================================================
@@ -3438,27 +3577,60 @@ function scrollToBottom() {
 // ====================================================
 // SUBIR ARCHIVO AL CHAT (VERSIÓN FINAL 2025)
 // ====================================================
+const MAX_HASH_LOCAL = 64 * 1024 * 1024; // hasta aquí se calcula el SHA-256 antes de subir
+
+// SHA-256 en hex (solo en contexto seguro y archivos no enormes)
+async function sha256Archivo(file) {
+  if (!window.crypto?.subtle || file.size > MAX_HASH_LOCAL) return null;
+  try {
+    const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+    return [...new Uint8Array(digest)].map(b => b.toString(16).padStart(2, "0")).join("");
+  } catch (e) {
+    return null;
+  }
+}
+
 async function subirArchivoYEnviarMensaje(file) {
   if (!currentChatId || !file) return;
 
   try {
-    const formData = new FormData();
-    formData.append("file", file);                 // 👈 NOMBRE IGUAL QUE EN PY
-    formData.append("usuario_id", currentUserId);  // 👈 lo que espera el backend
-
     // 👉 Solo mandamos Authorization si tenemos token
     const uploadHeaders = {};
     if (typeof tokenValid === "string" && tokenValid) {
       uploadHeaders["Authorization"] = `Bearer ${tokenValid}`;
     }
 
-    const resp = await fetch(`${API}conversaciones/${currentChatId}/archivo`, {
+    const enviar = (formData) => fetch(`${API}conversaciones/${currentChatId}/archivo`, {
       method: "POST",
       headers: uploadHeaders,   // 👈 sin Content-Type
       body: formData,
       credentials: "include",   // 👈 manda la cookie auth_token también
     });
 
+    // 1) Si el servidor ya tiene este contenido, basta con su hash (no se sube nada)
+    let resp = null;
+    const sha256 = await sha256Archivo(file);
+    if (sha256) {
+      const porHash = new FormData();
+      porHash.append("sha256", sha256);
+      porHash.append("nombre_archivo", file.name);
+      porHash.append("usuario_id", currentUserId);
+      resp = await enviar(porHash);
+      if (resp.status === 404) {
+        const err = await resp.clone().json().catch(() => ({}));
+        if (err.detail === "adjunto_desconocido") resp = null;
+      }
+    }
+
+    // 2) Si no, subir el archivo
+    if (!resp) {
+      const formData = new FormData();
+      formData.append("file", file);                 // 👈 NOMBRE IGUAL QUE EN PY
+      formData.append("usuario_id", currentUserId);  // 👈 lo que espera el backend
+      formData.append("subida_id", crypto.randomUUID()); // 👈 para los "progreso_subida"
+      resp = await enviar(formData);
+    }
+
     if (!resp.ok) {
       console.error(
         "upload_file error:",
@@ -3681,6 +3853,48 @@ if (!window.socket) {
   window.mensajesRecibidosSet = new Set();  // evita duplicados
   window.estadoMensajesMap = new Map();     // controla ✓ estados
 
+  // ===========================================
+  // ⏪ EIDs (orden de publicación del servidor, crecen en orden) → reenvío al reconectar
+  // ===========================================
+  window.ultimoEid = null;
+  window.eidsVistos = new Set();
+
+  function anotarEid(data) {
+    if (!data || !data.eid) return;
+    eidsVistos.add(data.eid);
+    if (eidsVistos.size > 3000) eidsVistos.clear();
+    window.ultimoEid = Math.max(window.ultimoEid || 0, data.eid);
+  }
+
+  window.socket.onAny((_evento, data) => anotarEid(data));
+
+  // Lo que se perdió durante la desconexión, en orden: se pasa a los
+  // mismos handlers que si hubiera llegado en vivo (sin repetir).
+  window.socket.on("eventos_perdidos", async (p) => {
+    if (!p) return;
+
+    if (p.resincronizar) {
+      await loadChats();
+      if (currentChatId && ultimoSeqAbierto) {
+        await recuperarHuecoSeq(String(currentChatId), ultimoSeqAbierto);
+      }
+      return;
+    }
+
+    for (const ev of p.eventos || []) {
+      if (eidsVistos.has(ev.eid)) continue;
+      anotarEid(ev.payload);
+
+      for (const handler of window.socket.listeners(ev.evento)) {
+        try {
+          await handler(ev.payload);
+        } catch (err) {
+          console.error(`❌ Error reprocesando ${ev.evento}:`, err);
+        }
+      }
+    }
+  });
+
   // ===========================================
   // 🔵 ESTADO INICIAL DEL MENSAJE
   // ===========================================
@@ -3692,9 +3906,21 @@ if (!window.socket) {
     estados.forEach(est => {
       const key = `${mensaje_id}_${est.usuario_id}`;
       estadoMensajesMap.set(key, est.estado);
+      aplicarEstadoTick(mensaje_id, est.estado);
     });
+  });
 
-    refrescarVistosDeMisMensajes();
+  // ===========================================
+  // ✓✓ ESTADOS ACTUALIZADOS (entregado / leído)
+  // ===========================================
+  window.socket.on("estado_actualizado", (p) => {
+    if (!p || !Array.isArray(p.mensaje_ids)) return;
+    if (String(p.conversacion_id) !== String(currentChatId)) return;
+
+    p.mensaje_ids.forEach(mid => {
+      estadoMensajesMap.set(`${mid}_${p.usuario_id}`, p.estado);
+      aplicarEstadoTick(mid, p.estado);
+    });
   });
 
   //Responde SMS
@@ -3859,9 +4085,11 @@ console.log("🧩 Datos usuario cargados:", { usuarioId, usuarioNombre, usuarioT
 
     console.log("📤 Enviando registrar_usuario:", usuarioId);
 
-    // registrar usuario
+    // registrar usuario (+ último evento visto → el servidor reenvía lo perdido)
     window.socket.emit("registrar_usuario", {
       usuario_id: usuarioId,
+      ultimo_eid: window.ultimoEid,
+      conversaciones: currentChatId ? [String(currentChatId)] : [],
     });
 
     // si estaba chat abierto, re-suscribir
@@ -3869,6 +4097,11 @@ console.log("🧩 Datos usuario cargados:", { usuarioId, usuarioNombre, usuarioT
       window.socket.emit("suscribir_conversacion", {
         conversacion_id: currentChatId,
       });
+
+      // recuperar los ✓✓ que se movieron mientras estábamos desconectados
+      if (estadosSincronizadosEn) {
+        refrescarVistosDeMisMensajes(estadosSincronizadosEn);
+      }
     }
   });
 
@@ -3989,6 +4222,16 @@ socket.on("incoming_call", (data) => {
   });
 
 
+  // =========================================================
+  // 📤 EVENTO: progreso al guardar un archivo que subí
+  // =========================================================
+  window.socket.on("progreso_subida", (p) => {
+    if (!p || !p.total) return;
+    const pct = Math.min(100, Math.round((p.escritos / p.total) * 100));
+    showToast(pct < 100 ? `📤 Guardando archivo... ${pct}%` : "📤 Archivo guardado");
+  });
+
+
   // =========================================================
   // 🔵 EVENTO: alguien está escribiendo (VERSIÓN FINAL 2025)
   // =========================================================
@@ -4151,10 +4394,19 @@ socket.on("incoming_call", (data) => {
       return;
     }
 
+    // ======================================================
+    // 🔢 HUECO EN seq → traer exactamente el tramo perdido
+    // ======================================================
+    if (msg.seq && ultimoSeqAbierto && msg.seq > ultimoSeqAbierto + 1) {
+      await recuperarHuecoSeq(chatId, ultimoSeqAbierto);
+    }
+
     // ======================================================
     // 🏆 CHAT ABIERTO → RENDER instantáneo
     // ======================================================
-    renderMessageFromObj(msg, esMio);
+    if (!msg.id || !messagesDiv.querySelector(`[data-msg-id="${msg.id}"]`)) {
+      renderMessageFromObj(msg, esMio);
+    }
 
     // ======================================================
     // 📌 ENTREGADO SOLO (NO LEIDO)
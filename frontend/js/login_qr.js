@@ -7,7 +7,7 @@ const statusMessage = document.getElementById("status-message");
 const qrImage = document.getElementById("qr-image");
 
 const TTL = 600; // segundos de validez del QR
-const INTERVALO_VERIFICACION = 3000; // cada 3 segundos
+const INTERVALO_VERIFICACION = 3000; // respaldo: solo si el socket no está conectado
 const ESPERA_REGENERACION = 2000; // 2 segundos antes de regenerar
 
 let tokenGenerado = null;
@@ -32,6 +32,62 @@ if (API.startsWith("http://") && window.location.protocol === "https:") {
 // Asegurar formato correcto con / final
 if (!API.endsWith("/")) API += "/";
 
+// ======================================================
+// SOCKET.IO → el servidor avisa cada cambio de estado del token
+// (pendiente → pendiente_correo → autenticado); sin sondeo
+// ======================================================
+let socketQR = null;
+
+if (typeof io !== "undefined") {
+  socketQR = io(API, {
+    transports: ["websocket"],
+    path: "/socket.io",
+  });
+
+  // Al (re)conectar: volver a la room del token y ponerse al día
+  socketQR.on("connect", () => {
+    if (tokenGenerado) suscribirQR(tokenGenerado);
+  });
+
+  socketQR.on("estado_qr", (data) => {
+    if (!data || data.token !== tokenGenerado) return;
+    aplicarEstadoQR(data.estado);
+  });
+}
+
+async function suscribirQR(token) {
+  if (!socketQR || !socketQR.connected) return;
+  try {
+    await socketQR.timeout(5000).emitWithAck("suscribir_qr", { token });
+    // Por si cambió antes de entrar a la room
+    await verificarEstadoQR();
+  } catch (err) {
+    console.warn("No se pudo suscribir al estado del QR:", err);
+  }
+}
+
+function aplicarEstadoQR(estado) {
+  if (estado === "autenticado") {
+    clearInterval(verificacionIntervalo);
+    clearInterval(cuentaInterval);
+    statusMessage.textContent = "✅ Sesión iniciada. Redirigiendo...";
+    window.location.href = `${API}iniciar_sesion_con_token/${tokenGenerado}`;
+  } else if (estado === "pendiente_correo") {
+    statusMessage.textContent = "📱 QR escaneado. Completa la verificación en tu teléfono...";
+  }
+}
+
+async function verificarEstadoQR() {
+  if (!tokenGenerado) return;
+
+  const response = await fetch(`${API}verificar_estado_qr/${tokenGenerado}`);
+  if (response.status === 404) return;
+  if (!response.ok) throw new Error("Error verificando estado del QR");
+
+  const data = await response.json();
+  aplicarEstadoQR(data.estado);
+}
+
 // ======================================================
 // FUNCIÓN PRINCIPAL → Generar QR
 // ======================================================
@@ -48,10 +104,11 @@ async function generarQR() {
     const data = await response.json();
 
     tokenGenerado = data.token;
-    qrImage.src = `data:image/png;base64,${data.qr_code}`;
+    qrImage.src = `data:${data.mime || "image/png"};base64,${data.qr_code}`;
     qrImage.style.display = "block";
     statusMessage.textContent = `El QR expira en ${TTL} s`;
 
+    suscribirQR(tokenGenerado);
     iniciarVerificacion();
     iniciarCuentaRegresiva();
   } catch (error) {
@@ -61,26 +118,18 @@ async function generarQR() {
 }
 
 // ======================================================
-// Verificación periódica del estado del token QR
+// Respaldo: verificación periódica solo mientras el socket
+// no esté conectado
 // ======================================================
 function iniciarVerificacion() {
   if (verificacionIntervalo) clearInterval(verificacionIntervalo);
 
   verificacionIntervalo = setInterval(async () => {
     if (!tokenGenerado) return;
+    if (socketQR && socketQR.connected) return;
 
     try {
-      const response = await fetch(`${API}verificar_estado_qr/${tokenGenerado}`);
-      if (response.status === 404) return;
-      if (!response.ok) throw new Error("Error verificando estado del QR");
-
-      const data = await response.json();
-      if (data.estado === "autenticado") {
-        clearInterval(verificacionIntervalo);
-        clearInterval(cuentaInterval);
-        statusMessage.textContent = "✅ Sesión iniciada. Redirigiendo...";
-        window.location.href = `${API}iniciar_sesion_con_token/${tokenGenerado}`;
-      }
+      await verificarEstadoQR();
     } catch (error) {
       console.error("Error al verificar estado del QR:", error);
     }